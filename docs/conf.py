@@ -70,6 +70,10 @@ extensions = [
     'sphinx.ext.todo',
 ]
 
+# The asyncio connector requires aiohttp, which is not needed to build the
+# documentation.
+autodoc_mock_imports = ['aiohttp']
+
 # Add any paths that contain templates here, relative to this directory.
 templates_path = ['_templates']
 
@@ -303,3 +307,15 @@ texinfo_documents = [
 
 # If true, do not generate a @detailmenu in the "Top" node's menu.
 #texinfo_no_detailmenu = False
+
+
+def _remove_asyncio(app, docname, source):
+    """Leave out the asyncio connector, which needs Python 3.5+ syntax."""
+    if docname == 'index':
+        source[0] = source[0].replace(
+            '.. automodule:: invenio_client.aio\n   :members:\n\n', '')
+
+
+def setup(app):
+    if sys.version_info < (3, 5):
+        app.connect('source-read', _remove_asyncio)
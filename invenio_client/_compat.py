@@ -26,6 +26,16 @@
 import sys
 
 if sys.version_info[0] == 3:  # pragma: no cover (Python 2/3 specific code)
+    from http.cookiejar import DefaultCookiePolicy
+    from itertools import filterfalse as ifilterfalse
+    from urllib.parse import urlparse
+    ifilter = filter
+    imap = map
     binary_type = bytes
+    text_type = str
 else:  # pragma: no cover (Python 2/3 specific code)
+    from cookielib import DefaultCookiePolicy
+    from itertools import ifilter, ifilterfalse, imap
+    from urlparse import urlparse
     binary_type = str
+    text_type = unicode
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio-Client.
+# Copyright (C) 2014 CERN.
+#
+# Invenio-Client is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio-Client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this licence, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Asynchronous connector to remote Invenio servers.
+
+Requires Python 3.5+ and `aiohttp <https://docs.aiohttp.org>`_ (install
+with ``pip install invenio-client[asyncio]``).
+
+Example of use:
+
+.. code-block:: python
+
+    import asyncio
+    from invenio_client.aio import AsyncInvenioConnector
+
+    async def main():
+        async with AsyncInvenioConnector("http://demo.inveniosoftware.org") \\
+                as demo:
+            results = await asyncio.gather(demo.search(p="higgs"),
+                                           demo.search(p="ellis"))
+
+    asyncio.get_event_loop().run_until_complete(main())
+
+The returned records are the same :class:`~invenio_client.connector.Record`
+objects returned by :class:`~invenio_client.connector.InvenioConnector`.
+Requests are retried according to a
+:class:`~invenio_client.retry.RetryPolicy`, as with the synchronous
+connector. The :class:`~invenio_client.throttle.RateLimiter` blocks its
+thread while waiting, so it is not supported; the ``limit`` of
+simultaneous connections bounds the load instead.
+"""
+
+import asyncio
+import sys
+
+import aiohttp
+
+from ._compat import urlparse
+from .connector import (CFG_CHUNK_SIZE, CFG_USER_AGENT,
+                        InvenioConnectorAuthError,
+                        InvenioConnectorServerError, RecordsHandler,
+                        _default_cache_factory, _parse_recids,
+                        _search_cache_key)
+from .parsers import make_parser
+from .retry import RetryPolicy
+
+
+class AsyncInvenioConnector(object):
+
+    """Create an asynchronous connector to a server running Invenio.
+
+    The connector mirrors the API of
+    :class:`~invenio_client.connector.InvenioConnector`, with every method
+    performing I/O being a coroutine. Authentication through a browser is
+    not supported; pass the ``cookies`` of an authenticated
+    :class:`~invenio_client.connector.InvenioConnector` instead.
+    """
+
+    def __init__(self, url, session=None, cookies=None, timeout=None,
+                 limit=100, chunk_size=CFG_CHUNK_SIZE, cache_factory=None,
+                 parser="sax", retry=None):
+        """Initialize a new connector for the server at given URL.
+
+        :param url: the url to which this instance will be connected.
+        :param session: an existing :class:`aiohttp.ClientSession`.
+        :param cookies: cookies sent with every request.
+        :param timeout: total timeout in seconds of every request.
+        :param limit: maximum number of simultaneous connections of the
+            session created by the connector.
+        :param chunk_size: size of the chunks fed to the MARCXML parser.
+        :param cache_factory: see
+            :class:`~invenio_client.connector.InvenioConnector`.
+        :param parser: name of the MARCXML parser backend, see
+            :mod:`invenio_client.parsers`.
+        :param retry: :class:`~invenio_client.retry.RetryPolicy` of the
+            requests; defaults to a new policy with the default settings.
+        """
+        assert url is not None
+        self.server_url = url
+        self.cookies = cookies or {}
+        self.timeout = timeout
+        self.limit = limit
+        self.chunk_size = chunk_size
+        self.parser = parser
+        if cache_factory is None:
+            cache_factory = _default_cache_factory
+        self.cached_queries = cache_factory("queries")
+        self.cached_records = cache_factory("records")
+        self.cached_baskets = cache_factory("baskets")
+        self.session = session
+        self._owns_session = False
+        if retry is None:
+            retry = RetryPolicy()
+        self.retry = retry
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """Close the session created by this connector."""
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _get_session(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit))
+            self._owns_session = True
+        return self.session
+
+    async def _request(self, method, url, ssl_verify=True, **kwargs):
+        """Send a request and return the response with its body unread.
+
+        The :attr:`cookies` are sent with every request, also through a
+        session given to the connector. The request is retried according
+        to :attr:`retry`.
+        """
+        if self.cookies:
+            kwargs.setdefault('cookies', self.cookies)
+        if self.timeout is not None:
+            kwargs.setdefault('timeout',
+                              aiohttp.ClientTimeout(total=self.timeout))
+        if not ssl_verify:
+            kwargs['ssl'] = False
+        session = self._get_session()
+        method = method.upper()
+        self.retry._start()
+        attempt = 0
+        while True:
+            try:
+                response = await session.request(method, url, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                delay = self.retry._error_delay(
+                    method, attempt,
+                    isinstance(err, (aiohttp.ClientConnectionError,
+                                     asyncio.TimeoutError)),
+                    isinstance(err, aiohttp.ClientConnectorError))
+                if delay is None:
+                    raise
+            else:
+                delay = self.retry._response_delay(
+                    method, attempt, response.status, response.headers)
+                if delay is None:
+                    return response
+                response.release()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def search(self, read_cache=True, ssl_verify=True, recid=None,
+                     fields=None, **kwparams):
+        """Return records corresponding to the given search query.
+
+        See :meth:`~invenio_client.connector.InvenioConnector.search`.
+        """
+        params, cache_key, parse_results = _search_cache_key(kwparams, recid,
+                                                             fields)
+        of = params['of']
+
+        if read_cache:
+            cached = self.cached_queries.get(cache_key)
+            if cached is not None:
+                return cached
+
+        if recid:
+            url = self.server_url + '/record/' + recid
+        else:
+            url = self.server_url + "/search"
+        results = await self._request('GET', url, ssl_verify=ssl_verify,
+                                      params=_query(params))
+        async with results:
+            if recid and results.history:
+                new_recid = urlparse(str(results.url)).path.split('/')[-1]
+                raise InvenioConnectorServerError('The record has been'
+                                                  'merged with recid ' +
+                                                  new_recid)
+            if 'youraccount/login' in str(results.url):
+                # Current user not able to search collection
+                raise InvenioConnectorAuthError(
+                    "You are trying to search a restricted collection. "
+                    "Please authenticate yourself.\n")
+            if parse_results:
+                res = await self._parse_response(
+                    results,
+                    self.cached_records if fields is None else None,
+                    fields)
+            else:
+                res = await results.read()
+                if of == "id":
+                    res = _parse_recids(res)
+        self.cached_queries[cache_key] = res
+        return res
+
+    async def search_with_retry(self, sleeptime=3.0, retrycount=3,
+                                **params):
+        """Perform a search, retrying on timeouts.
+
+        The search is retried on top of the retries of :attr:`retry`. See
+        :meth:`~invenio_client.connector.InvenioConnector.search_with_retry`.
+        """
+        results = []
+        count = 0
+        while count < retrycount:
+            try:
+                results = await self.search(**params)
+                break
+            except asyncio.TimeoutError:
+                sys.stderr.write("Timeout while searching...Retrying\n")
+                await asyncio.sleep(sleeptime)
+                count += 1
+        else:
+            sys.stderr.write(
+                "Aborting search after %d attempts.\n" % (retrycount,))
+        return results
+
+    async def get_records_from_basket(self, bskid, group_basket=False,
+                                      read_cache=True):
+        """Return the records from the (public) basket with given bskid."""
+        if read_cache:
+            cached = self.cached_baskets.get(bskid)
+            if cached is not None:
+                return cached
+        params = {'of': 'xm', 'bskid': str(bskid)}
+        if self.cookies:
+            if group_basket:
+                params['category'] = 'G'
+            url = self.server_url + "/yourbaskets/display"
+        else:
+            url = self.server_url + "/yourbaskets/display_public"
+        results = await self._request('GET', url, params=params)
+        async with results:
+            parsed_records = await self._parse_response(results,
+                                                        self.cached_records)
+        self.cached_baskets[bskid] = parsed_records
+        return parsed_records
+
+    async def get_record(self, recid, read_cache=True):
+        """Return the record with given recid (``None`` if not found)."""
+        if read_cache:
+            record = self.cached_records.get(recid)
+            if record is not None:
+                return record
+        records = await self.search(recid=str(recid), read_cache=read_cache)
+        return records[0] if records else None
+
+    async def upload_marcxml(self, marcxml, mode):
+        """Upload a record to the server.
+
+        See
+        :meth:`~invenio_client.connector.InvenioConnector.upload_marcxml`.
+        The response body is read before returning it.
+        """
+        if mode not in ["-i", "-r", "-c", "-a", "-ir"]:
+            raise NameError("Incorrect mode " + str(mode))
+
+        results = await self._request(
+            'POST', self.server_url + "/batchuploader/robotupload",
+            data={'file': marcxml, 'mode': mode},
+            headers={'User-Agent': CFG_USER_AGENT})
+        async with results:
+            await results.read()
+        return results
+
+    async def _parse_response(self, response, cached_records, fields=None):
+        """Parse the MARCXML body of ``response`` as it is received."""
+        handler = RecordsHandler(cached_records, fields=fields)
+        parser = make_parser(handler, self.parser)
+        async for chunk in response.content.iter_chunked(self.chunk_size):
+            parser.feed(chunk)
+        parser.close()
+        return handler.records
+
+
+def _query(params):
+    """Flatten search parameters into a list of string pairs."""
+    query = []
+    for key, value in params.items():
+        if isinstance(value, (list, tuple)):
+            query.extend((key, str(item)) for item in value)
+        elif value is not None:
+            query.append((key, str(value)))
+    return query
+
+
+__all__ = ('AsyncInvenioConnector', )
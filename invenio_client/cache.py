@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio-Client.
+# Copyright (C) 2014 CERN.
+#
+# Invenio-Client is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio-Client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this licence, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Caches used by the connectors.
+
+The caches of :class:`~invenio_client.connector.InvenioConnector` are
+created by its ``cache_factory``, which is called with the name of the cache
+(``"queries"``, ``"records"``, ``"baskets"`` or ``"validators"``) and must
+return a mapping with the ``get``, ``invalidate`` and ``clear`` methods of
+:class:`LRUCache`. By default every cache is an unbounded :class:`LRUCache`:
+
+.. code-block:: python
+
+    from invenio_client import InvenioConnector
+    from invenio_client.cache import LRUCache
+
+    def cache_factory(name):
+        if name == "records":
+            return LRUCache(max_bytes=512 * 1024 * 1024, ttl=3600)
+        return LRUCache(max_entries=1000, ttl=600)
+
+    demo = InvenioConnector("http://demo.inveniosoftware.org",
+                            cache_factory=cache_factory)
+
+Responses and records can also be kept across restarts, and shared between
+processes, with a :class:`DiskCache`:
+
+.. code-block:: python
+
+    from invenio_client.cache import DiskCache
+
+    demo = InvenioConnector("http://demo.inveniosoftware.org",
+                            disk_cache=DiskCache("/var/cache/invenio.db",
+                                                 ttl=86400))
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+
+
+def approximate_size(value):
+    """Return the approximate memory footprint of ``value`` in bytes.
+
+    Containers (dicts, lists, tuples and sets) are walked recursively.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += approximate_size(key) + approximate_size(item)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            size += approximate_size(item)
+    return size
+
+
+class LRUCache(object):
+
+    """Thread-safe mapping with LRU eviction and per-entry expiration.
+
+    :param max_entries: maximum number of entries, or ``None``.
+    :param max_bytes: maximum total size of the values as computed by
+        ``sizeof``, or ``None``.
+    :param ttl: default number of seconds after which an entry expires, or
+        ``None`` for entries that never expire.
+    :param sizeof: function returning the size of a value in bytes.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None,
+                 sizeof=approximate_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _lookup(self, key):
+        """Return the entry for ``key``, dropping it if it has expired."""
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and \
+                entry[1] <= time.time():
+            self._remove(key)
+            self.expirations += 1
+            entry = None
+        return entry
+
+    def _remove(self, key):
+        value, expires, size = self._data.pop(key)
+        self.size -= size
+
+    def get(self, key, default=None):
+        """Return the value for ``key`` and mark it as recently used."""
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            # Move the entry to the most recently used end.
+            del self._data[key]
+            self._data[key] = entry
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """Store ``value`` for ``key``, expiring after ``ttl`` seconds."""
+        if ttl is None:
+            ttl = self.ttl
+        expires = None if ttl is None else time.time() + ttl
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, expires, size)
+            self.size += size
+            while self._data and (
+                    (self.max_entries is not None and
+                     len(self._data) > self.max_entries) or
+                    (self.max_bytes is not None and
+                     self.size > self.max_bytes)):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Remove ``key`` from the cache; return whether it was present."""
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+                return True
+            return False
+
+    def clear(self):
+        """Remove all the entries."""
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def stats(self):
+        """Return a dictionary with the counters of this cache."""
+        with self._lock:
+            return dict(entries=len(self._data), size=self.size,
+                        hits=self.hits, misses=self.misses,
+                        evictions=self.evictions,
+                        expirations=self.expirations)
+
+    def __getitem__(self, key):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                raise KeyError(key)
+            return self.get(key)
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        if not self.invalidate(key):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._data))
+
+    def keys(self):
+        """Return a list of the keys, least recently used first."""
+        return list(self)
+
+    def values(self):
+        """Return a list of the values, least recently used first."""
+        with self._lock:
+            return [entry[0] for entry in self._data.values()]
+
+    def items(self):
+        """Return a list of ``(key, value)`` pairs."""
+        with self._lock:
+            return [(key, entry[0]) for key, entry in self._data.items()]
+
+    def __eq__(self, other):
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "LRUCache(%r)" % (dict(self.items()), )
+
+
+class DiskCache(object):
+
+    """Persistent cache of raw responses stored in a SQLite database.
+
+    Entries are byte strings grouped in namespaces (the connector uses
+    ``"records"``, keyed by recid, and ``"queries"``, keyed by the
+    normalized search cache key). The database can be shared by several
+    threads and processes.
+
+    :param path: path of the SQLite database, created if needed.
+    :param ttl: number of seconds after which entries are stale, or
+        ``None`` for entries that never expire.
+    :param timeout: number of seconds to wait for a lock held by another
+        process.
+    """
+
+    def __init__(self, path, ttl=None, timeout=30.0):
+        self.path = path
+        self.ttl = ttl
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, "
+                "value BLOB NOT NULL, stored REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))")
+
+    def _connection(self):
+        """Return the connection of the current thread and process."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, namespace, key):
+        """Return the bytes stored under ``key``, or ``None``."""
+        row = self._connection().execute(
+            "SELECT value, stored FROM entries "
+            "WHERE namespace = ? AND key = ?",
+            (namespace, str(key))).fetchone()
+        if row is None:
+            return None
+        if self.ttl is not None and row[1] + self.ttl <= time.time():
+            self.invalidate(namespace, key)
+            return None
+        return bytes(row[0])
+
+    def set(self, namespace, key, value):
+        """Store the byte string ``value`` under ``key``."""
+        self.set_many(namespace, [(key, value)])
+
+    def set_many(self, namespace, items):
+        """Store all the ``(key, value)`` pairs in one transaction."""
+        now = time.time()
+        with self._connection() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                [(namespace, str(key), sqlite3.Binary(value), now)
+                 for key, value in items])
+
+    def invalidate(self, namespace, key):
+        """Remove ``key`` from the cache."""
+        with self._connection() as connection:
+            connection.execute(
+                "DELETE FROM entries WHERE namespace = ? AND key = ?",
+                (namespace, str(key)))
+
+    def purge(self):
+        """Remove all the stale entries."""
+        if self.ttl is None:
+            return
+        with self._connection() as connection:
+            connection.execute("DELETE FROM entries WHERE stored <= ?",
+                               (time.time() - self.ttl, ))
+
+    def clear(self):
+        """Remove all the entries."""
+        with self._connection() as connection:
+            connection.execute("DELETE FROM entries")
+
+
+class SingleFlight(object):
+
+    """Share the result of concurrent calls made with the same key.
+
+    While a call is in progress, the other threads calling :meth:`do` with
+    the same key wait for it and get its result (or exception) instead of
+    repeating the work. The connector uses it so that identical searches
+    issued by several threads at once send a single request.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        """Return ``function(*args, **kwargs)``, shared with other callers.
+
+        Nested calls with the key of the current call are not shared, as
+        they would wait for themselves.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None or call.thread == threading.current_thread():
+                call = _Call()
+                self._calls[key] = call
+                self.calls += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = function(*args, **kwargs)
+        except BaseException as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        """Return a dictionary with the numbers of calls and shared calls."""
+        with self._lock:
+            return dict(calls=self.calls, shared=self.shared,
+                        in_flight=len(self._calls))
+
+
+class _Call(object):
+
+    """Call in progress of a :class:`SingleFlight`."""
+
+    def __init__(self):
+        self.thread = threading.current_thread()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+__all__ = ('DiskCache', 'LRUCache', 'SingleFlight', 'approximate_size')
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio-Client.
+# Copyright (C) 2014 CERN.
+#
+# Invenio-Client is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio-Client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this licence, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Incremental decoding of compressed HTTP responses.
+
+The connectors ask the servers for compressed responses (``gzip`` and
+``deflate``, plus ``br`` and ``zstd`` if `brotli
+<https://pypi.python.org/pypi/Brotli>`_ and `zstandard
+<https://pypi.python.org/pypi/zstandard>`_ are installed) and decode them
+while they are read, so that the parser never receives compressed bytes.
+The bytes received and decoded are counted by the ``transfer_stats`` of the
+connector:
+
+.. code-block:: python
+
+    demo.search(p="higgs", rg=200)
+    print(demo.transfer_stats.stats())
+"""
+
+import threading
+import zlib
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover (depends on installed packages)
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover (depends on installed packages)
+    zstandard = None
+
+CFG_READ_SIZE = 65536
+
+
+class GzipDecoder(object):
+
+    """Incremental decoder of the ``gzip`` content coding."""
+
+    def __init__(self):
+        self.decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data):
+        return self.decoder.decompress(data)
+
+    def flush(self):
+        return self.decoder.flush()
+
+
+class DeflateDecoder(object):
+
+    """Incremental decoder of the ``deflate`` content coding.
+
+    Some servers send raw deflate data instead of the zlib format required
+    by the specification; both are accepted.
+    """
+
+    def __init__(self):
+        self.decoder = zlib.decompressobj()
+        self.first_chunk = True
+
+    def decompress(self, data):
+        if self.first_chunk and data:
+            self.first_chunk = False
+            try:
+                return self.decoder.decompress(data)
+            except zlib.error:
+                self.decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self.decoder.decompress(data)
+
+    def flush(self):
+        return self.decoder.flush()
+
+
+class BrotliDecoder(object):
+
+    """Incremental decoder of the ``br`` content coding."""
+
+    def __init__(self):
+        decoder = brotli.Decompressor()
+        # brotlicffi and old versions of brotli only have decompress().
+        self.decompress = getattr(decoder, 'process', None) or \
+            decoder.decompress
+
+    def flush(self):
+        return b""
+
+
+class ZstdDecoder(object):
+
+    """Incremental decoder of the ``zstd`` content coding."""
+
+    def __init__(self):
+        self.decoder = zstandard.ZstdDecompressor().decompressobj()
+
+    def decompress(self, data):
+        return self.decoder.decompress(data)
+
+    def flush(self):
+        return b""
+
+
+DECODERS = {
+    'gzip': GzipDecoder,
+    'x-gzip': GzipDecoder,
+    'deflate': DeflateDecoder,
+}
+
+if brotli is not None:  # pragma: no cover (depends on installed packages)
+    DECODERS['br'] = BrotliDecoder
+
+if zstandard is not None:  # pragma: no cover (depends on installed packages)
+    DECODERS['zstd'] = ZstdDecoder
+
+ACCEPT_ENCODING = ", ".join(
+    coding for coding in ('gzip', 'deflate', 'br', 'zstd')
+    if coding in DECODERS)
+
+
+class TransferStats(object):
+
+    """Thread-safe counters of the bytes received and decoded."""
+
+    def __init__(self):
+        self.responses = 0
+        self.received = 0
+        self.decoded = 0
+        self._lock = threading.Lock()
+
+    def add(self, received, decoded, responses=0):
+        """Count ``received`` bytes decoded into ``decoded`` bytes."""
+        with self._lock:
+            self.responses += responses
+            self.received += received
+            self.decoded += decoded
+
+    def stats(self):
+        """Return a dictionary with the counters and compression ratio."""
+        with self._lock:
+            return dict(responses=self.responses, received=self.received,
+                        decoded=self.decoded,
+                        ratio=(float(self.decoded) / self.received
+                               if self.received else None))
+
+
+class DecodingReader(object):
+
+    """File-like object decoding a response body as it is read.
+
+    :param raw: file-like object returning the body as received, such as
+        the ``raw`` attribute of a streamed :class:`requests.Response`.
+    :param content_encoding: value of the ``Content-Encoding`` header.
+    :param stats: optional :class:`TransferStats` updated while reading.
+    """
+
+    def __init__(self, raw, content_encoding=None, stats=None):
+        self.raw = raw
+        self.stats = stats
+        self.decoders = []
+        # Codings are listed in the order in which they were applied.
+        for coding in reversed((content_encoding or "").split(",")):
+            coding = coding.strip().lower()
+            if coding and coding != 'identity':
+                try:
+                    self.decoders.append(DECODERS[coding]())
+                except KeyError:
+                    raise ValueError("Unsupported content encoding %r"
+                                     % (coding, ))
+        self.buffer = b""
+        self.position = 0
+        self.finished = False
+        if stats is not None:
+            stats.add(0, 0, responses=1)
+
+    def _decode(self, data, final=False):
+        for decoder in self.decoders:
+            data = decoder.decompress(data)
+            if final:
+                data += decoder.flush()
+        return data
+
+    def _fill(self):
+        """Replace the consumed buffer with the next decoded bytes."""
+        data = self.raw.read(CFG_READ_SIZE)
+        self.finished = not data
+        self.buffer = self._decode(data, final=self.finished)
+        self.position = 0
+        if self.stats is not None:
+            self.stats.add(len(data), len(self.buffer))
+
+    def read(self, size=-1):
+        """Read at most ``size`` decoded bytes (all of them if < 0)."""
+        chunks = []
+        length = 0
+        while size < 0 or length < size:
+            if self.position == len(self.buffer):
+                if self.finished:
+                    break
+                self._fill()
+                continue
+            # Only copy the bytes returned: highly compressed bodies decode
+            # into buffers much larger than the reads.
+            end = len(self.buffer)
+            if size >= 0:
+                end = min(end, self.position + size - length)
+            chunks.append(self.buffer[self.position:end])
+            length += end - self.position
+            self.position = end
+        return b"".join(chunks)
+
+    def iter_chunks(self, chunk_size=CFG_READ_SIZE):
+        """Yield the decoded body in chunks of ``chunk_size`` bytes."""
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+__all__ = ('ACCEPT_ENCODING', 'DECODERS', 'DecodingReader', 'TransferStats')
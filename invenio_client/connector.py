@@ -40,14 +40,13 @@ Example of use:
 
 FIXME:
 
-- implement cache expiration
 - exceptions handling
-- parsing of ``<!-- Search-Engine-Total-Number-Of-Results: N -->``
 - better checking of input parameters
 """
 
 from __future__ import print_function
 
+import calendar
 import os
 import re
 import requests
@@ -55,17 +54,102 @@ import json
 import splinter
 import sys
 import tempfile
+import threading
 import time
+import uuid
 import xml.sax
 
+from collections import deque
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from email.utils import formatdate
+from bisect import bisect_left
+from itertools import chain, islice
+from xml.sax.saxutils import escape, quoteattr
+from requests.adapters import HTTPAdapter
 from requests.exceptions import (ConnectionError, InvalidSchema, InvalidURL,
                                  MissingSchema, RequestException)
-from urlparse import urlparse
 
-from ._compat import binary_type
+from ._compat import DefaultCookiePolicy, binary_type, text_type, urlparse
+from .cache import LRUCache, SingleFlight, approximate_size
+from .compression import ACCEPT_ENCODING, DecodingReader, TransferStats
+from .parsers import make_parser
+from .recids import RecidSet
+from .retry import RetryPolicy
+from .spool import BufferReader, Spool
 from .version import __version__
 
 CFG_USER_AGENT = "invenio_connector"
+CFG_SITE_RECORD = "record"
+CFG_POOL_CONNECTIONS = 10
+CFG_POOL_MAXSIZE = 10
+CFG_CHUNK_SIZE = 8192
+CFG_PAGE_SIZE = 100
+CFG_MAX_WORKERS = 4
+CFG_BATCH_SIZE = 200
+CFG_MAX_QUERY_LENGTH = 2000
+CFG_MAX_POOLED_VALUES = 100000
+CFG_PARSE_CHUNK_SIZE = 1024 * 1024
+CFG_SPOOL_CHUNK_SIZE = 65536
+CFG_MAX_SPOOLS = 32
+CFG_WIRE_FORMATS = ("xm", )
+CFG_WIRE_FORMAT_PROBE_SIZE = 10
+CFG_UPLOAD_MODES = ("-i", "-r", "-c", "-a", "-ir")
+CFG_UPLOAD_BATCH_SIZE = 10 * 1024 * 1024
+CFG_POOLED_VALUES = ('100__u', '700__u', '260__b', '773__p', '041__a',
+                     '65017a', '690C_a', '980__a', '980__b')
+
+_SHARED_SESSIONS = {}
+_WIRE_FORMATS = {}
+_WIRE_FORMATS_LOCK = threading.Lock()
+_WIRE_FORMAT_PROBES = SingleFlight()
+_SHARED_SESSIONS_LOCK = threading.Lock()
+
+
+def make_session(pool_connections=CFG_POOL_CONNECTIONS,
+                 pool_maxsize=CFG_POOL_MAXSIZE, pool_block=False,
+                 keep_alive=True):
+    """Return a new HTTP session backed by a sized connection pool.
+
+    :param pool_connections: number of per-host connection pools to keep.
+    :param pool_maxsize: maximum number of connections kept alive per host.
+    :param pool_block: whether to wait for a free connection instead of
+        opening a throw-away one when the pool is exhausted.
+    :param keep_alive: set to ``False`` to close connections after each
+        request.
+
+    The session asks for compressed responses, see
+    :mod:`invenio_client.compression`.
+    """
+    session = requests.Session()
+    session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+    adapter = HTTPAdapter(pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize, pool_block=pool_block)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def get_shared_session(url, **kwargs):
+    """Return the session shared by all connectors talking to ``url``'s host.
+
+    The session is created with :func:`make_session` on first use; the
+    keyword arguments are ignored afterwards. It never stores the cookies
+    set by the server, which would otherwise be sent on behalf of every
+    connector whatever its credentials; each connector sends its own
+    :attr:`~InvenioConnector.cookies` instead.
+    """
+    scheme, netloc = urlparse(url)[:2]
+    key = (scheme, netloc.lower())
+    with _SHARED_SESSIONS_LOCK:
+        if key not in _SHARED_SESSIONS:
+            session = make_session(**kwargs)
+            session.cookies.set_policy(
+                DefaultCookiePolicy(allowed_domains=[]))
+            _SHARED_SESSIONS[key] = session
+        return _SHARED_SESSIONS[key]
 
 
 class InvenioConnectorError(Exception):
@@ -97,7 +181,15 @@ class InvenioConnector(object):
     """Create an connector to a server running Invenio."""
 
     def __init__(self, url, user="", password="", login_method="Local",
-                 insecure_login=False):
+                 insecure_login=False, session=None, share_session=False,
+                 pool_connections=CFG_POOL_CONNECTIONS,
+                 pool_maxsize=CFG_POOL_MAXSIZE, keep_alive=True,
+                 timeout=None, cache_factory=None, disk_cache=None,
+                 compact_records=False, intern_values=CFG_POOLED_VALUES,
+                 parser="sax", parse_processes=None, keep_marcxml=None,
+                 spool=False, spool_dir=None,
+                 wire_formats=CFG_WIRE_FORMATS, retry=None,
+                 rate_limiter=None):
         """
         Initialize a new instance of the server at given URL.
 
@@ -117,14 +209,110 @@ class InvenioConnector(object):
         :param login_method: the name of the login method the Invenio instance
             is expecting for this user (in case there is more than one).
         :type login_method: string
+        :param session: an existing :class:`requests.Session` to use for all
+            the requests of this connector.
+        :param share_session: if ``True``, reuse the pooled session shared by
+            all the connectors pointing to the same host (see
+            :func:`get_shared_session`). The shared session keeps no
+            cookies, so that the connectors do not share logins.
+        :param pool_connections: number of per-host connection pools.
+        :param pool_maxsize: maximum number of keep-alive connections per
+            host.
+        :param keep_alive: set to ``False`` to disable persistent connections.
+        :param timeout: default timeout in seconds passed to every request,
+            either a number or a ``(connect, read)`` tuple.
+        :param cache_factory: callable returning the mapping used for each
+            of the ``"queries"``, ``"records"``, ``"baskets"`` and
+            ``"validators"`` caches, given its name. Defaults to unbounded
+            :class:`~invenio_client.cache.LRUCache` instances.
+        :param disk_cache: optional :class:`~invenio_client.cache.DiskCache`
+            used to persist search responses and records across restarts.
+        :param compact_records: if ``True``, parsed records are returned as
+            read-only :class:`CompactRecord` instances, which use much less
+            memory than :class:`Record` instances.
+        :param intern_values: codes of the subfields whose values are shared
+            between all the records parsed by this connector (affiliations,
+            collections, etc.), see :class:`RecordsHandler`.
+        :param parser: name of the MARCXML parser backend: ``"sax"``,
+            ``"expat"`` or ``"lxml"`` (see :mod:`invenio_client.parsers`).
+        :param parse_processes: number of worker processes used to parse
+            large MARCXML responses in parallel (e.g.
+            ``multiprocessing.cpu_count()``), or ``None`` to parse them in
+            the current process.
+        :param keep_marcxml: if ``True``, parsed records keep a reference to
+            the response they were parsed from, out of which
+            :meth:`Record.export` slices their original MARCXML. If
+            ``False``, the MARCXML is serialized from the fields on demand.
+            By default (``None``) it is only kept for spooled responses: in
+            memory, a retained response stays alive as long as one of its
+            records is referenced, which the size limit of the records cache
+            does not account for.
+        :param spool: if ``True``, MARCXML responses are written to
+            temporary files and parsed from memory-mapped
+            :class:`~invenio_client.spool.Spool` instances instead of being
+            held in memory. Each mapped file holds a file descriptor, so
+            only the last ``CFG_MAX_SPOOLS`` responses stay mapped; the
+            records of older ones export MARCXML serialized from their
+            fields.
+        :param spool_dir: directory of the temporary files.
+        :param wire_formats: output formats in which :meth:`search` may
+            download the records to parse, cheapest first, e.g.
+            ``("tm", "xm")`` to opt in for text MARC. The first one that
+            the server supports is used; support is probed once per server
+            by comparing the first records of the site in this format and
+            in MARCXML (``"xm"``), which is always supported. MARCXML is
+            used anyway if ``spool`` or ``parse_processes`` is set, or if
+            ``keep_marcxml`` is ``True``, as they only apply to MARCXML.
+        :param retry: :class:`~invenio_client.retry.RetryPolicy` of the
+            requests, which may be shared between connectors. Defaults to a
+            new policy; pass ``RetryPolicy(retries=0)`` to disable retries.
+        :param rate_limiter: optional
+            :class:`~invenio_client.throttle.RateLimiter` through which every
+            request (and retry) is sent. Use
+            :func:`~invenio_client.throttle.get_rate_limiter` to share one
+            between all the connectors talking to a server.
         """
         assert url is not None
         self.server_url = url
+        self.timeout = timeout
+        if retry is None:
+            retry = RetryPolicy()
+        self.retry = retry
+        self.rate_limiter = rate_limiter
+        self._owns_session = False
+        if session is None:
+            session_options = dict(pool_connections=pool_connections,
+                                   pool_maxsize=pool_maxsize,
+                                   keep_alive=keep_alive)
+            if share_session:
+                session = get_shared_session(url, **session_options)
+            else:
+                session = make_session(**session_options)
+                self._owns_session = True
+        self.session = session
         self._validate_server_url()
 
-        self.cached_queries = {}
-        self.cached_records = {}
-        self.cached_baskets = {}
+        if cache_factory is None:
+            cache_factory = _default_cache_factory
+        self.cached_queries = cache_factory("queries")
+        self.cached_records = cache_factory("records")
+        self.cached_baskets = cache_factory("baskets")
+        self.cached_validators = cache_factory("validators")
+        self.disk_cache = disk_cache
+        self.compact_records = compact_records
+        self.intern_values = intern_values
+        self.value_pool = {}
+        self.parser = parser
+        self.parse_processes = parse_processes
+        self.keep_marcxml = keep_marcxml
+        self.spool = spool
+        self.spool_dir = spool_dir
+        self._spools = deque()
+        self._spools_lock = threading.Lock()
+        self.transfer_stats = TransferStats()
+        self.single_flight = SingleFlight()
+        self.wire_formats = wire_formats
+        self._process_pool = None
         self.user = user
         self.password = password
         self.login_method = login_method
@@ -138,6 +326,47 @@ class InvenioConnector(object):
             self._init_browser()
             self._check_credentials()
 
+    def close(self):
+        """Release the pooled connections owned by this connector."""
+        if self._owns_session:
+            self.session.close()
+        if self._process_pool is not None:
+            self._process_pool.shutdown()
+            self._process_pool = None
+        with self._spools_lock:
+            while self._spools:
+                self._spools.popleft().close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _request(self, method, url, retry=True, **kwargs):
+        """Send a request through the pooled session of this connector.
+
+        The request is retried according to :attr:`retry`, unless ``retry``
+        is ``False``. Only the response headers are covered: errors while
+        reading a streamed body are not retried. Every attempt waits for
+        the permission of :attr:`rate_limiter`, if any.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        body = kwargs.get('data')
+
+        def send():
+            if isinstance(body, MultipartBody):
+                # Send the whole body again.
+                body.rewind()
+            if self.rate_limiter is not None:
+                return self.rate_limiter.call(
+                    lambda: self.session.request(method, url, **kwargs))
+            return self.session.request(method, url, **kwargs)
+
+        if not retry:
+            return send()
+        return self.retry.call(method, send)
+
     def _init_browser(self):
         """Overide in appropriate way to prepare a logged in browser."""
         self.browser = splinter.Browser('phantomjs')
@@ -158,80 +387,196 @@ class InvenioConnector(object):
                 "the provided credentials")
         self.cookies = self.browser.cookies.all()
 
-    def search(self, read_cache=True, ssl_verify=True, recid=None, **kwparams):
+    def search(self, read_cache=True, ssl_verify=True, recid=None,
+               fields=None, **kwparams):
         """
         Returns records corresponding to the given search query.
 
         See docstring of invenio.legacy.search_engine.perform_request_search()
         for an overview of available parameters.
-        """
-        parse_results = False
-        of = kwparams.get('of', "")
-        if of == "":
-            parse_results = True
-            of = "xm"
-            kwparams['of'] = of
-        params = kwparams
-        cache_key = (json.dumps(params), parse_results)
-
-        if cache_key not in self.cached_queries or \
-                not read_cache:
-            if recid:
-                results = requests.get(self.server_url + '/record/' + recid,
-                                       params=params, cookies=self.cookies,
-                                       stream=True, verify=ssl_verify,
-                                       allow_redirects=True)
-                if results.history:
-                    new_recid = urlparse(results.url).path.split('/')[-1]
-                    raise InvenioConnectorServerError('The record has been'
-                                                      'merged with recid ' +
-                                                      new_recid)
-            else:
-                results = requests.get(self.server_url + "/search",
-                                       params=params, cookies=self.cookies,
-                                       stream=True, verify=ssl_verify)
-            if 'youraccount/login' in results.url:
-                # Current user not able to search collection
-                raise InvenioConnectorAuthError(
-                    "You are trying to search a restricted collection. "
-                    "Please authenticate yourself.\n")
-        else:
-            return self.cached_queries[cache_key]
 
-        if parse_results:
+        :param fields: optional list of the fields to read from the parsed
+            records (e.g. ``["245__a", "100__a"]``), see
+            :class:`RecordsHandler`. The server is asked to only output the
+            corresponding tags (``ot``). Partial records are not added to
+            the records cache.
+
+        Identical searches issued concurrently by several threads share a
+        single request (see :class:`~invenio_client.cache.SingleFlight`).
+        """
+        wire_format = "xm"
+        if kwparams.get('of', "") == "":
+            wire_format = self._wire_format()
+        params, cache_key, parse_results = _search_cache_key(
+            kwparams, recid, fields, wire_format)
+        return self.single_flight.do(
+            (cache_key, read_cache, ssl_verify), self._search, params,
+            cache_key, parse_results, read_cache, ssl_verify, recid, fields)
+
+    def _search(self, params, cache_key, parse_results, read_cache,
+                ssl_verify, recid, fields):
+        """Return the results of a search, from the caches if possible."""
+        of = params['of']
+        cached_records = self.cached_records if fields is None else None
+
+        cached = self.cached_queries.get(cache_key)
+        if read_cache:
+            if cached is not None:
+                return cached
+            if self.disk_cache is not None:
+                body = self.disk_cache.get("queries", json.dumps(cache_key))
+                if body is not None:
+                    res = self._load_results(body, parse_results, of,
+                                             fields=fields)
+                    self.cached_queries[cache_key] = res
+                    return res
+        elif recid and parse_results and cached is None and \
+                cached_records is not None:
+            record = cached_records.get(int(recid))
+            if record is not None:
+                cached = [record]
+
+        headers = {}
+        if cached is not None:
+            headers = self._conditional_headers(cache_key, cached)
+        results = self._get_results(params, recid=recid,
+                                    ssl_verify=ssl_verify, headers=headers)
+        if results.status_code == 304:
+            # Not modified: keep using the cached results.
+            self.cached_queries[cache_key] = cached
+            return cached
+        if results.status_code >= 400:
+            # Error pages must not be parsed (or cached) as results.
+            results.close()
+            raise InvenioConnectorServerError(
+                "Unexpected status code '%d' searching: %s"
+                % (results.status_code, results.url))
+
+        if self.disk_cache is not None:
+            body = self._body(results).read()
+            # The response is fresh: its records replace the cached ones.
+            res = self._load_results(body, parse_results, of, persist=True,
+                                     fields=fields, replace=True)
+            # Only persist the bodies that could be loaded.
+            self.disk_cache.set("queries", json.dumps(cache_key), body)
+        elif parse_results:
             # FIXME: we should not try to parse if results is string
-            parsed_records = self._parse_results(results.raw,
-                                                 self.cached_records)
-            self.cached_queries[cache_key] = parsed_records
-            return parsed_records
+            res = self._parse_results(self._body(results), cached_records,
+                                      fields=fields, of=of, replace=True)
+        elif of == "id":
+            res = _parse_recids(self._body(results).iter_chunks())
         else:
             # pylint: disable=E1103
             # The whole point of the following code is to make sure we can
             # handle two types of variable.
             try:
-                res = results.content
+                res = self._body(results).read()
             except AttributeError:
                 res = results
             # pylint: enable=E1103
+        self._store_validators(cache_key, results)
+        self.cached_queries[cache_key] = res
+        return res
+
+    def iter_search(self, ssl_verify=True, recid=None,
+                    chunk_size=CFG_CHUNK_SIZE, fields=None, **kwparams):
+        """Yield the records matching the given query as they are parsed.
 
-            if of == "id":
-                try:
-                    if isinstance(res, binary_type):
-                        # Transform to list
-                        res = [int(recid.strip()) for record_id in
-                               res.decode('utf-8').strip("[]").split(",")
-                               if record_id.strip() != ""]
-                    res.reverse()
-                except (ValueError, AttributeError):
-                    res = []
-            self.cached_queries[cache_key] = res
-            return res
+        Unlike :meth:`search`, the response is fed to the parser in chunks of
+        ``chunk_size`` bytes and every record is yielded as soon as its
+        closing tag has been read. Neither the query nor the records are
+        cached, so memory usage does not grow with the number of results.
+
+        Accepts the same search parameters as :meth:`search`, including
+        ``fields``; the output format is always MARCXML.
+        """
+        kwparams['of'] = "xm"
+        if fields is not None:
+            kwparams.setdefault('ot', _output_tags(fields))
+        results = self._get_results(kwparams, recid=recid,
+                                    ssl_verify=ssl_verify)
+        chunks = self._body(results).iter_chunks(chunk_size)
+        return self._iter_parse_results(chunks, fields=fields)
+
+    def paginated_search(self, rg=CFG_PAGE_SIZE, jrec=1, ssl_verify=True,
+                         prefetch=0, max_workers=CFG_MAX_WORKERS,
+                         **kwparams):
+        """Return all the records matching the query, one page at a time.
+
+        The first page is fetched immediately so that the total number of
+        results is known up front (see :class:`PaginatedSearch`); the next
+        pages are requested with increasing ``jrec`` while iterating. As
+        with :meth:`iter_search`, neither the pages nor the records are
+        cached.
+
+        :param rg: number of records requested per page.
+        :param jrec: position of the first record to return (1-based).
+        :param prefetch: number of pages to download in the background
+            ahead of the one being consumed.
+        :param max_workers: maximum number of concurrent page requests when
+            prefetching. Keep it below the ``pool_maxsize`` of the connector
+            so that every worker gets a persistent connection.
+        :param kwparams: search parameters, see :meth:`search`.
+        """
+        return PaginatedSearch(self, kwparams, rg=rg, jrec=jrec,
+                               ssl_verify=ssl_verify, prefetch=prefetch,
+                               max_workers=max_workers)
+
+    def sync(self, store, key=None, since=None, rg=CFG_PAGE_SIZE, prefetch=0,
+             **kwparams):
+        """Fetch the records modified since the previous synchronization.
+
+        The records of the given query modified since the watermark saved
+        in ``store`` (see :class:`~invenio_client.harvest.WatermarkStore`)
+        are fetched page by page, using the ``dt=m`` and ``d1`` search
+        parameters, and stored in the record caches, replacing older
+        versions. Once all the pages have been fetched the most recent
+        ``005`` date seen becomes the new watermark.
+
+        :param store: object with ``get(key)`` and ``set(key, watermark)``
+            methods persisting the watermarks.
+        :param key: name of the watermark; defaults to the server URL
+            followed by the query.
+        :param since: modification date (``YYYY-MM-DD HH:MM:SS``) to use
+            instead of the stored watermark.
+        :param rg: number of records requested per page.
+        :param prefetch: see :meth:`paginated_search`.
+        :param kwparams: search parameters, see :meth:`search`.
+        :return: the list of modified records.
+        """
+        if key is None:
+            key = self.server_url + " " + \
+                _search_cache_key(kwparams)[1][0]
+        if since is None:
+            since = store.get(key)
+        if since is not None:
+            kwparams.update(dt='m', d1=since)
+
+        records = []
+        watermark = since
+        for dummy_jrec, page in self.paginated_search(
+                rg=rg, prefetch=prefetch, **kwparams).pages():
+            for record in page:
+                self.cached_records[record.recid] = record
+                modified = _record_modification_date(record)
+                if modified is not None and \
+                        (watermark is None or modified > watermark):
+                    watermark = modified
+            if self.disk_cache is not None:
+                self.disk_cache.set_many(
+                    "records", [(record.recid, _record_marcxml(record))
+                                for record in page])
+            records.extend(page)
+        if watermark is not None:
+            store.set(key, watermark)
+        return records
 
     def search_with_retry(self, sleeptime=3.0, retrycount=3, **params):
         """Perform a search given a dictionary of ``search(...)`` parameters.
 
         It accounts for server timeouts as necessary and will retry some number
-        of times.
+        of times, on top of the retries of the connector's
+        :class:`~invenio_client.retry.RetryPolicy`.
 
         :param sleeptime: number of seconds to sleep between retries
         :param retrycount: number of times to retry given search
@@ -266,34 +611,134 @@ class InvenioConnector(object):
         """
         Returns the records from the (public) basket with given bskid
         """
-        if bskid not in self.cached_baskets or not read_cache:
-            if self.user:
-                if group_basket:
-                    group_basket = '&category=G'
-                else:
-                    group_basket = ''
-                results = requests.get(
-                    self.server_url + "/yourbaskets/display?of=xm&bskid=" +
-                    str(bskid) + group_basket, cookies=self.cookies,
-                    stream=True)
+        if read_cache:
+            cached = self.cached_baskets.get(bskid)
+            if cached is not None:
+                return cached
+        if self.user:
+            if group_basket:
+                group_basket = '&category=G'
             else:
-                results = requests.get(
-                    self.server_url +
-                    "/yourbaskets/display_public?of=xm&bskid=" + str(bskid),
-                    stream=True)
+                group_basket = ''
+            results = self._request(
+                'GET', self.server_url + "/yourbaskets/display?of=xm&bskid=" +
+                str(bskid) + group_basket, cookies=self.cookies, stream=True)
         else:
-            return self.cached_baskets[bskid]
+            results = self._request(
+                'GET', self.server_url +
+                "/yourbaskets/display_public?of=xm&bskid=" + str(bskid),
+                stream=True)
 
-        parsed_records = self._parse_results(results.raw, self.cached_records)
+        parsed_records = self._parse_results(self._body(results),
+                                             self.cached_records)
         self.cached_baskets[bskid] = parsed_records
         return parsed_records
 
     def get_record(self, recid, read_cache=True):
-        """Return the record with given recid."""
-        if recid in self.cached_records or not read_cache:
-            return self.cached_records[recid]
-        else:
-            return self.search(recid=str(recid))
+        """Return the record with given recid (``None`` if not found)."""
+        if read_cache:
+            record = self.cached_records.get(recid)
+            if record is not None:
+                return record
+            if self.disk_cache is not None:
+                body = self.disk_cache.get("records", recid)
+                if body is not None:
+                    return self._load_results(body, True, "xm")[0]
+        records = self.search(recid=str(recid), read_cache=read_cache)
+        return records[0] if records else None
+
+    def invalidate_search(self, recid=None, **kwparams):
+        """Remove the results of the given search from the cache."""
+        cache_key = _search_cache_key(kwparams, recid)[1]
+        self.cached_queries.invalidate(cache_key)
+
+    def invalidate_record(self, recid):
+        """Remove the record with given recid from the cache."""
+        self.cached_records.invalidate(recid)
+
+    def invalidate_basket(self, bskid):
+        """Remove the records of the given basket from the cache."""
+        self.cached_baskets.invalidate(bskid)
+
+    def clear_cache(self):
+        """Empty the query, record and basket caches."""
+        self.cached_queries.clear()
+        self.cached_records.clear()
+        self.cached_baskets.clear()
+        self.cached_validators.clear()
+
+    def get_records(self, recids, batch_size=CFG_BATCH_SIZE,
+                    max_workers=CFG_MAX_WORKERS, read_cache=True,
+                    ssl_verify=True):
+        """Return the records with the given recids, in the same order.
+
+        Cached records are returned directly. The others are requested with
+        ``recid:`` queries (using ``recid:a->b`` ranges for contiguous
+        recids) of at most ``batch_size`` records and
+        ``CFG_MAX_QUERY_LENGTH`` characters, sent concurrently by up to
+        ``max_workers`` threads. Fetched records are added to the cache.
+        If ``read_cache`` is false, all the records are fetched and replace
+        the cached ones.
+
+        Recids not returned by any query are looked up individually: the
+        result list then contains a :class:`MergedRecord` if the record was
+        merged into another one, or a :class:`MissingRecord` otherwise.
+        """
+        recids = [int(recid) for recid in recids]
+        found = {}
+        for recid in recids:
+            record = self.cached_records.get(recid) if read_cache else None
+            if record is not None:
+                found[recid] = record
+        missing = sorted(set(recids).difference(found))
+
+        def fetch(batch):
+            return self._search_page({'p': batch[0]}, 1, batch[1],
+                                     ssl_verify=ssl_verify,
+                                     cached_records=self.cached_records,
+                                     replace=not read_cache)[0]
+
+        def resolve(recid):
+            return self._resolve_record(recid, ssl_verify=ssl_verify,
+                                        replace=not read_cache)
+
+        executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        try:
+            for records in executor.map(fetch,
+                                        _recid_batches(missing, batch_size)):
+                for record in records:
+                    found[record.recid] = record
+            missing = [recid for recid in missing if recid not in found]
+            for recid, record in zip(missing, executor.map(resolve, missing)):
+                found[recid] = record
+        finally:
+            executor.shutdown(wait=True)
+        return [found[recid] for recid in recids]
+
+    def _resolve_record(self, recid, ssl_verify=True, replace=False):
+        """Return the record, or a marker if it was merged or is missing.
+
+        If ``replace`` is true, the fetched record replaces the cached one.
+        """
+        results = self._request('GET', '%s/record/%d' % (self.server_url,
+                                                         recid),
+                                params={'of': 'xm'}, cookies=self.cookies,
+                                stream=True, verify=ssl_verify,
+                                allow_redirects=True)
+        if results.history:
+            new_recid = urlparse(results.url).path.rstrip('/').split('/')[-1]
+            try:
+                return MergedRecord(recid, int(new_recid))
+            except ValueError:
+                return MissingRecord(recid)
+        if results.status_code >= 400:
+            return MissingRecord(recid)
+        records = self._parse_results(self._body(results),
+                                      self.cached_records, replace=replace)
+        for record in records:
+            if record.recid == recid:
+                return record
+        return MissingRecord(recid)
 
     def upload_marcxml(self, marcxml, mode):
         """Upload a record to the server.
@@ -306,31 +751,424 @@ class InvenioConnector(object):
             - "-a" append fields to records
             - "-ir" insert record or replace if it exists
         """
-        if mode not in ["-i", "-r", "-c", "-a", "-ir"]:
+        if mode not in CFG_UPLOAD_MODES:
             raise NameError("Incorrect mode " + str(mode))
 
-        return requests.post(self.server_url + "/batchuploader/robotupload",
+        return self._request('POST',
+                             self.server_url + "/batchuploader/robotupload",
                              data={'file': marcxml, 'mode': mode},
                              headers={'User-Agent': CFG_USER_AGENT})
 
-    def _parse_results(self, results, cached_records):
+    def upload_records(self, records, mode,
+                       batch_size=CFG_UPLOAD_BATCH_SIZE, max_records=None,
+                       max_workers=CFG_MAX_WORKERS):
+        """Upload many records in batches.
+
+        The records are packed into ``<collection>`` batches of at most
+        ``batch_size`` bytes (and ``max_records`` records), which are
+        uploaded by up to ``max_workers`` threads. Batches are packed as the
+        records are consumed, and each batch body is streamed, so the
+        records are never all held in memory.
+
+        :param records: iterable of :class:`Record` (or
+            :class:`CompactRecord`) instances, or of MARCXML chunks holding
+            one or more ``<record>`` elements.
+        :param mode: the mode to use for the upload, see
+            :meth:`upload_marcxml`.
+        :return: the list of :class:`UploadBatch` instances, in order. The
+            failed ones can be uploaded again with :meth:`upload_batches`.
+        """
+        return self.upload_batches(
+            _pack_upload_batches(records, batch_size, max_records), mode,
+            max_workers=max_workers)
+
+    def upload_batches(self, batches, mode, max_workers=CFG_MAX_WORKERS,
+                       callback=None):
+        """Upload :class:`UploadBatch` instances concurrently.
+
+        Return the batches, in order, with their upload status. The MARCXML
+        of the successfully uploaded batches is released.
+
+        :param callback: function called with every batch as soon as its
+            upload is over, from the uploading thread.
+        """
+        if mode not in CFG_UPLOAD_MODES:
+            raise NameError("Incorrect mode " + str(mode))
+
+        batches = iter(batches)
+        uploaded = []
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        pending = deque(executor.submit(self._upload_batch, batch, mode,
+                                        callback)
+                        for batch in islice(batches, max_workers))
+        try:
+            while pending:
+                batch = pending.popleft().result()
+                for next_batch in islice(batches, 1):
+                    pending.append(executor.submit(
+                        self._upload_batch, next_batch, mode, callback))
+                uploaded.append(batch)
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown()
+        return uploaded
+
+    def _upload_batch(self, batch, mode, callback=None):
+        """Upload one batch and record its status."""
+        body = batch.body(mode)
+        batch.error = None
+        try:
+            response = self._request(
+                'POST', self.server_url + "/batchuploader/robotupload",
+                data=body, headers={'User-Agent': CFG_USER_AGENT,
+                                    'Content-Type': body.content_type})
+        except RequestException as err:
+            batch.error = err
+        else:
+            batch.status_code = response.status_code
+            batch.message = response.content.decode('utf-8', 'replace')
+        if batch.ok:
+            batch.parts = None
+        if callback is not None:
+            callback(batch)
+        return batch
+
+    def _get_results(self, params, recid=None, ssl_verify=True,
+                     headers=None):
+        """Send a search (or record) request and return the response."""
+        if recid:
+            results = self._request('GET',
+                                    self.server_url + '/record/' + recid,
+                                    params=params, cookies=self.cookies,
+                                    stream=True, verify=ssl_verify,
+                                    allow_redirects=True, headers=headers)
+            if results.history:
+                new_recid = urlparse(results.url).path.split('/')[-1]
+                raise InvenioConnectorServerError('The record has been'
+                                                  'merged with recid ' +
+                                                  new_recid)
+        else:
+            results = self._request('GET', self.server_url + "/search",
+                                    params=params, cookies=self.cookies,
+                                    stream=True, verify=ssl_verify,
+                                    headers=headers)
+        if 'youraccount/login' in results.url:
+            # Current user not able to search collection
+            raise InvenioConnectorAuthError(
+                "You are trying to search a restricted collection. "
+                "Please authenticate yourself.\n")
+        return results
+
+    def _wire_format(self):
+        """Return the first of the ``wire_formats`` the server supports."""
+        if self.spool or self.parse_processes or self.keep_marcxml is True:
+            return "xm"
+        for of in self.wire_formats:
+            if of == "xm":
+                return of
+            with _WIRE_FORMATS_LOCK:
+                supported = _WIRE_FORMATS.get((self.server_url, of))
+            if supported is None:
+                # Connectors searching the same site concurrently wait for
+                # a single probe.
+                supported = _WIRE_FORMAT_PROBES.do(
+                    (self.server_url, of), self._supports_wire_format, of)
+            if supported:
+                return of
+        return "xm"
+
+    def _supports_wire_format(self, of):
+        """Return whether the server supports format ``of``, probed once."""
+        key = (self.server_url, of)
+        with _WIRE_FORMATS_LOCK:
+            supported = _WIRE_FORMATS.get(key)
+        if supported is None:
+            supported = self._probe_wire_format(of)
+            with _WIRE_FORMATS_LOCK:
+                _WIRE_FORMATS[key] = supported
+        return supported
+
+    def _probe_wire_format(self, of):
+        """Return whether records are correctly output in format ``of``.
+
+        The first records of the site are fetched in MARCXML and in format
+        ``of``; the format is supported if both give the same records. Only
+        a sample is compared: values that the format cannot represent (such
+        as ``$$`` in text MARC) may still occur in other records.
+        """
+        parsed = []
+        for output_format in ("xm", of):
+            try:
+                results = self._get_results(
+                    {'p': "", 'rg': CFG_WIRE_FORMAT_PROBE_SIZE,
+                     'of': output_format})
+                parsed.append(self._parse(
+                    self._body(results), None, persist=False,
+                    of=output_format).records)
+            except Exception:  # pylint: disable=W0703
+                # Whatever went wrong, the format cannot be relied on.
+                return False
+        return bool(parsed[0]) and parsed[0] == parsed[1]
+
+    def _body(self, results):
+        """Return a reader of the decoded body of a streamed response."""
+        return DecodingReader(results.raw,
+                              results.headers.get('Content-Encoding'),
+                              self.transfer_stats)
+
+    def _conditional_headers(self, cache_key, cached):
+        """Return the headers revalidating the cached results of a query.
+
+        The ``ETag`` and ``Last-Modified`` headers of the response that
+        produced the cached results are used when known; otherwise the
+        ``005`` (date of last transaction) field of a single cached record
+        is used as modification date.
+        """
+        etag, last_modified = self.cached_validators.get(cache_key,
+                                                         (None, None))
+        if last_modified is None and isinstance(cached, list) and \
+                len(cached) == 1:
+            last_modified = _record_last_modified(cached[0])
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def _store_validators(self, cache_key, results):
+        """Remember the cache validators sent with a response."""
+        etag = results.headers.get('ETag')
+        last_modified = results.headers.get('Last-Modified')
+        if etag is not None or last_modified is not None:
+            self.cached_validators[cache_key] = (etag, last_modified)
+        else:
+            self.cached_validators.invalidate(cache_key)
+
+    def _make_handler(self, cached_records, fields=None, replace=False):
+        """Return a MARCXML handler configured for this connector."""
+        return RecordsHandler(cached_records, compact=self.compact_records,
+                              intern_values=self.intern_values,
+                              value_pool=self.value_pool, fields=fields,
+                              replace=replace)
+
+    def _parse_results(self, results, cached_records, fields=None,
+                       of="xm", replace=False):
         """
         Parses the given results (in MARCXML format).
 
         The given "cached_records" list is a pool of
         already existing parsed records (in order to
         avoid keeping several times the same records in memory)
+
+        If ``fields`` is given, only the selected fields are parsed. Results
+        in another output format are parsed according to ``of``. If
+        ``replace`` is true, the parsed records replace the cached ones.
         """
-        parser = xml.sax.make_parser()
-        handler = RecordsHandler(cached_records)
-        parser.setContentHandler(handler)
-        parser.parse(results)
-        return handler.records
+        return self._parse(results, cached_records, fields=fields,
+                           of=of, replace=replace).records
+
+    def spool_search(self, path=None, ssl_verify=True, recid=None,
+                     **kwparams):
+        """Download the MARCXML results of a query to a file.
+
+        The response is not parsed; pass the returned
+        :class:`~invenio_client.spool.Spool` to :meth:`parse_marcxml`, as
+        many times as needed.
+
+        :param path: path of the file, which is kept. By default the
+            response is written to a temporary file in ``spool_dir``,
+            removed automatically.
+        """
+        kwparams['of'] = "xm"
+        results = self._get_results(kwparams, recid=recid,
+                                    ssl_verify=ssl_verify)
+        return Spool.from_chunks(
+            self._body(results).iter_chunks(CFG_SPOOL_CHUNK_SIZE),
+            path=path, directory=self.spool_dir)
+
+    def parse_marcxml(self, marcxml, chunk_size=CFG_PARSE_CHUNK_SIZE,
+                      start=0):
+        """Parse a MARCXML document (e.g. a saved dump) into records.
+
+        The records are deduplicated against, and added to, the records
+        cache. With ``parse_processes``, the document is parsed in parallel
+        in chunks of about ``chunk_size`` bytes.
+
+        :param marcxml: MARCXML bytes, a binary file-like object or a
+            :class:`~invenio_client.spool.Spool`.
+        :param start: offset of the first record to parse, e.g. the end of
+            the :attr:`Record.marcxml_span` of the last record processed, to
+            resume an interrupted processing.
+        """
+        if isinstance(marcxml, binary_type):
+            marcxml = BytesIO(marcxml)
+        return self._parse(marcxml, self.cached_records, persist=False,
+                           chunk_size=chunk_size, start=start).records
+
+    def _parse(self, results, cached_records, persist=True,
+               chunk_size=CFG_PARSE_CHUNK_SIZE, fields=None, start=0,
+               of="xm", replace=False):
+        """Parse the given MARCXML file-like object and return the handler.
+
+        ``results`` can also be a :class:`~invenio_client.spool.Spool`.
+        Parsing starts with the record found at offset ``start``. Unless
+        ``persist`` is false, the records added to ``cached_records`` are
+        also written to the disk cache.
+
+        Results in other output formats (``of``) are always parsed in the
+        current process, and their MARCXML is not retained.
+        """
+        handler = self._make_handler(cached_records, fields, replace)
+        if of != "xm":
+            make_parser(handler, of=of).parse(results)
+        else:
+            self._feed_marcxml(handler, results, chunk_size, fields, start)
+        if persist and cached_records is not None and \
+                self.disk_cache is not None:
+            self.disk_cache.set_many(
+                "records", [(record.recid, _record_marcxml(record))
+                            for record in handler.records])
+        return handler
+
+    def _feed_marcxml(self, handler, results, chunk_size, fields, start):
+        """Parse MARCXML from a file-like object or spool into handler."""
+        if isinstance(results, Spool):
+            source = results
+        elif self.spool:
+            source = Spool.from_chunks(
+                iter(lambda: results.read(CFG_SPOOL_CHUNK_SIZE), b""),
+                directory=self.spool_dir)
+        elif self.keep_marcxml or self.parse_processes or start:
+            source = MARCXMLSource(results.read())
+        else:
+            self._make_parser(handler).parse(results)
+            return
+        keep_marcxml = self.keep_marcxml or (self.keep_marcxml is None and
+                                             isinstance(source, Spool))
+        if keep_marcxml:
+            # The records reference slices of the document.
+            handler.source = source
+        if self.parse_processes:
+            self._parse_parallel(handler, source.data, chunk_size, fields,
+                                 start, keep_marcxml)
+        else:
+            reader, handler.offset = _document_reader(source.data, start)
+            self._make_parser(handler, keep_marcxml).parse(reader)
+        if source is not results and isinstance(source, Spool):
+            if keep_marcxml:
+                self._retain_spool(source)
+            else:
+                source.close()
+
+    def _retain_spool(self, spool):
+        """Keep ``spool`` mapped, unmapping the oldest spools if needed."""
+        with self._spools_lock:
+            self._spools.append(spool)
+            while len(self._spools) > CFG_MAX_SPOOLS:
+                self._spools.popleft().close()
+
+    def _make_parser(self, handler, keep_marcxml=False):
+        """Return a parser feeding ``handler``.
+
+        If the MARCXML of the records is retained, the parser also reports
+        where each record is found in the document.
+        """
+        parser = make_parser(handler, self.parser)
+        if keep_marcxml:
+            handler.byte_index = parser.byte_index
+        return parser
+
+    def _parse_parallel(self, handler, data, chunk_size, fields=None,
+                        start=0, keep_marcxml=False):
+        """Parse ``data`` in worker processes, feeding ``handler``.
+
+        The documents are cut and sent to the workers as they free up, at
+        most two per worker at a time, so that the slices of ``data`` and
+        the parsed records are not all held at once.
+        """
+        documents = _split_records(data, chunk_size, start)
+        first = list(islice(documents, 2))
+        if len(first) == 1:
+            reader, handler.offset = _document_reader(data, start)
+            self._make_parser(handler, keep_marcxml).parse(reader)
+            return
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(self.parse_processes)
+        documents = chain(first, documents)
+
+        def submit(offset, document):
+            return offset, self._process_pool.submit(
+                _parse_document, document, self.parser, self.compact_records,
+                self.intern_values, fields, keep_marcxml)
+
+        pending = deque(submit(offset, document) for offset, document
+                        in islice(documents, 2 * self.parse_processes))
+        try:
+            while pending:
+                offset, future = pending.popleft()
+                records, counts = future.result()
+                for next_offset, document in islice(documents, 1):
+                    pending.append(submit(next_offset, document))
+                handler.counts = handler.counts or counts
+                for record in records:
+                    if isinstance(record._marcxml, tuple):
+                        # Locate the record in the whole document.
+                        dummy_source, begin, end = record._marcxml
+                        record._marcxml = (handler.source, begin + offset,
+                                           end + offset)
+                    handler.add_record(record)
+        finally:
+            for dummy_offset, future in pending:
+                future.cancel()
+
+    def _load_results(self, body, parse_results, of, persist=False,
+                      fields=None, replace=False):
+        """Return the search results contained in the response ``body``."""
+        if parse_results:
+            cached_records = self.cached_records if fields is None else None
+            return self._parse(BytesIO(body), cached_records,
+                               persist=persist, fields=fields, of=of,
+                               replace=replace).records
+        elif of == "id":
+            return _parse_recids(body)
+        return body
+
+    def _search_page(self, params, jrec, rg, ssl_verify=True,
+                     cached_records=None, replace=False):
+        """Return the records of one page of results and the total count.
+
+        If ``replace`` is true, the parsed records replace the cached ones.
+        """
+        params = dict(params, of="xm", jrec=jrec, rg=rg)
+        results = self._get_results(params, ssl_verify=ssl_verify)
+        handler = self._parse(self._body(results), cached_records,
+                              replace=replace)
+        return handler.records, handler.counts
+
+    def _iter_parse_results(self, chunks, cached_records=None, fields=None):
+        """Incrementally parse MARCXML ``chunks`` and yield the records.
+
+        If ``cached_records`` is ``None`` the records are not deduplicated
+        against (nor added to) any cache.
+        """
+        handler = self._make_handler(cached_records, fields)
+        parser = make_parser(handler, self.parser)
+        for chunk in chunks:
+            parser.feed(chunk)
+            for record in handler.records:
+                yield record
+            del handler.records[:]
+        parser.close()
+        for record in handler.records:
+            yield record
 
     def _validate_server_url(self):
         """Validates self.server_url"""
         try:
-            request = requests.head(self.server_url)
+            # Fail fast on wrong URLs.
+            request = self._request('HEAD', self.server_url, retry=False)
             if request.status_code >= 400:
                 raise InvenioConnectorServerError(
                     "Unexpected status code '%d' accessing URL: %s"
@@ -352,18 +1190,262 @@ class InvenioConnector(object):
                 % (self.server_url, err))
 
 
+class PaginatedSearch(object):
+
+    """Iterate over all the results of a search, page by page.
+
+    Instances are returned by :meth:`InvenioConnector.paginated_search`.
+    The number of results announced by the server is available as
+    :attr:`total` (``None`` if the server did not report it).
+
+    When the total is known and ``prefetch`` is positive, the next
+    ``prefetch`` pages are downloaded by a pool of at most ``max_workers``
+    threads while the current one is consumed. Pages are still yielded in
+    order.
+
+    Invenio caps the number of records per page: if the first page is
+    shorter than requested although more results remain, :attr:`rg` is
+    lowered to its length so that no record is skipped.
+    """
+
+    def __init__(self, connector, params, rg=CFG_PAGE_SIZE, jrec=1,
+                 ssl_verify=True, prefetch=0, max_workers=CFG_MAX_WORKERS):
+        self.connector = connector
+        self.params = params
+        self.rg = rg
+        self.jrec = jrec
+        self.ssl_verify = ssl_verify
+        self.prefetch = prefetch
+        self.max_workers = max_workers
+        self._first_page = self._fetch(jrec)
+        self.total = self._first_page[1] or None
+        returned = len(self._first_page[0])
+        if 0 < returned < rg and self.total is not None and \
+                jrec + returned <= self.total:
+            # The server capped the page size.
+            self.rg = returned
+
+    def _fetch(self, jrec):
+        return self.connector._search_page(self.params, jrec, self.rg,
+                                           ssl_verify=self.ssl_verify)
+
+    def pages(self):
+        """Yield ``(jrec, records)`` for every page of results."""
+        if self.prefetch > 0 and self.total is not None:
+            return self._prefetched_pages()
+        return self._sequential_pages()
+
+    def _sequential_pages(self):
+        jrec = self.jrec
+        records = self._first_page[0]
+        while True:
+            yield jrec, records
+            jrec += self.rg
+            if self.total is not None:
+                if jrec > self.total:
+                    break
+            elif len(records) < self.rg:
+                break
+            records = self._fetch(jrec)[0]
+
+    def _prefetched_pages(self):
+        yield self.jrec, self._first_page[0]
+        jrecs = iter(range(self.jrec + self.rg, self.total + 1, self.rg))
+        executor = ThreadPoolExecutor(
+            max_workers=max(1, min(self.prefetch, self.max_workers)))
+        pending = deque((jrec, executor.submit(self._fetch, jrec))
+                        for jrec in islice(jrecs, self.prefetch))
+        try:
+            while pending:
+                jrec, future = pending.popleft()
+                for next_jrec in islice(jrecs, 1):
+                    pending.append(
+                        (next_jrec, executor.submit(self._fetch, next_jrec)))
+                yield jrec, future.result()[0]
+        finally:
+            for dummy_jrec, future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def __iter__(self):
+        for dummy_jrec, records in self.pages():
+            for record in records:
+                yield record
+
+
+class UploadBatch(object):
+
+    """Batch of MARCXML records uploaded in one request.
+
+    :attr:`ok` tells whether the upload succeeded; otherwise
+    :attr:`status_code` and :attr:`message` hold the answer of the server,
+    or :attr:`error` the exception raised while sending the batch.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.parts = []
+        self.size = 0
+        self.count = 0
+        self.status_code = None
+        self.message = None
+        self.error = None
+
+    def add(self, part):
+        """Add the MARCXML of one or more records."""
+        self.parts.append(part)
+        self.size += len(part)
+        self.count += part.count(b"</record>")
+
+    @property
+    def ok(self):
+        """Whether the batch was successfully uploaded."""
+        return self.error is None and self.status_code is not None and \
+            self.status_code < 400 and \
+            not (self.message or "").startswith("[ERROR]")
+
+    def body(self, mode):
+        """Return the streamed request body uploading the batch."""
+        return MultipartBody(
+            [('mode', mode)], 'file', 'records.xml',
+            [b'<?xml version="1.0" encoding="UTF-8"?>\n'
+             b'<collection xmlns="http://www.loc.gov/MARC21/slim">\n'] +
+            self.parts + [b'\n</collection>\n'])
+
+    def __repr__(self):
+        return "UploadBatch(%r, count=%r, status_code=%r)" % (
+            self.index, self.count, self.status_code)
+
+
+class MultipartBody(object):
+
+    """Streamed ``multipart/form-data`` request body.
+
+    The length of the body is known in advance, so that it is sent with a
+    ``Content-Length`` header; the file content is read from ``chunks``
+    without being concatenated.
+
+    :param fields: list of ``(name, value)`` form fields.
+    :param name: name of the file field.
+    :param filename: name of the uploaded file.
+    :param chunks: list of byte strings making the file content.
+    """
+
+    def __init__(self, fields, name, filename, chunks):
+        boundary = uuid.uuid4().hex
+        self.content_type = "multipart/form-data; boundary=" + boundary
+        head = []
+        for field, value in fields:
+            head.append('--%s\r\nContent-Disposition: form-data; '
+                        'name="%s"\r\n\r\n%s\r\n'
+                        % (boundary, field, value))
+        head.append('--%s\r\nContent-Disposition: form-data; name="%s"; '
+                    'filename="%s"\r\nContent-Type: application/xml\r\n\r\n'
+                    % (boundary, name, filename))
+        self.chunks = [''.join(head).encode('utf-8')] + list(chunks) + \
+            [('\r\n--%s--\r\n' % (boundary, )).encode('utf-8')]
+        self.length = sum(len(chunk) for chunk in self.chunks)
+        self.rewind()
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def rewind(self):
+        """Restart reading the body from the beginning."""
+        self._index = 0
+        self._offset = 0
+
+    def read(self, size=-1):
+        """Read at most ``size`` bytes of the body (the rest if < 0)."""
+        if size < 0:
+            data = b"".join([self.chunks[self._index][self._offset:]] +
+                            self.chunks[self._index + 1:])
+            self._index = len(self.chunks)
+            self._offset = 0
+            return data
+        while self._index < len(self.chunks):
+            chunk = self.chunks[self._index]
+            data = chunk[self._offset:self._offset + size]
+            self._offset += len(data)
+            if self._offset >= len(chunk):
+                self._index += 1
+                self._offset = 0
+            if data:
+                return data
+        return b""
+
+
+class MissingRecord(object):
+
+    """Placeholder for a recid that does not exist on the server."""
+
+    def __init__(self, recid):
+        self.recid = recid
+
+    def __bool__(self):
+        return False
+
+    __nonzero__ = __bool__
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.__dict__ == other.__dict__
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.recid)
+
+
+class MergedRecord(MissingRecord):
+
+    """Placeholder for a recid that has been merged into ``new_recid``."""
+
+    def __init__(self, recid, new_recid):
+        super(MergedRecord, self).__init__(recid)
+        self.new_recid = new_recid
+
+    def __repr__(self):
+        return "MergedRecord(%r, %r)" % (self.recid, self.new_recid)
+
+
 class Record(dict):
 
     """Represent an Invenio record."""
 
     def __init__(self, recid=None, marcxml=None, server_url=None):
         self.recid = recid
-        self.marcxml = ""
-        if marcxml is not None:
-            self.marcxml = marcxml
+        self._marcxml = marcxml
         self.server_url = server_url
 
+    @property
+    def marcxml(self):
+        """MARCXML of the record.
+
+        Parsed records return their original MARCXML, sliced on demand out
+        of the retained response; other records are serialized.
+        """
+        if self._marcxml is None or isinstance(self._marcxml, tuple):
+            return _record_marcxml(self).decode('utf-8')
+        return self._marcxml
+
+    @marcxml.setter
+    def marcxml(self, marcxml):
+        self._marcxml = marcxml
+
+    @property
+    def marcxml_span(self):
+        """Offsets ``(start, end)`` of the record in its document, or None."""
+        if isinstance(self._marcxml, tuple):
+            return self._marcxml[1:]
+
     def __setitem__(self, item, value):
+        # The original MARCXML no longer matches the record.
+        if isinstance(self._marcxml, tuple):
+            self._marcxml = None
         tag, ind1, ind2, subcode = decompose_code(item)
         if subcode is not None:
             super(Record, self).__setitem__(
@@ -371,6 +1453,17 @@ class Record(dict):
         else:
             super(Record, self).__setitem__(tag + ind1 + ind2, value)
 
+    def __reduce__(self):
+        # Restore the fields as they are, without decoding every code in
+        # __setitem__ (records are sent back by the parsing processes).
+        attributes = dict(self.__dict__, _marcxml=_pickled_marcxml(self))
+        return (type(self), (), (dict(self), attributes))
+
+    def __setstate__(self, state):
+        fields, attributes = state
+        dict.update(self, fields)
+        self.__dict__.update(attributes)
+
     def __getitem__(self, item):
         tag, ind1, ind2, subcode = decompose_code(item)
 
@@ -388,6 +1481,8 @@ class Record(dict):
         return "Record(" + dict.__repr__(self) + ")"
 
     def __str__(self):
+        if str is binary_type:
+            return self.marcxml.encode('utf-8')
         return self.marcxml
 
     def export(self, of="marcxml"):
@@ -409,61 +1504,286 @@ class Record(dict):
             return None
 
 
+class CompactRecord(object):
+
+    """Read-only, memory efficient representation of an Invenio record.
+
+    Fields are stored in tuples instead of nested dicts and lists, with
+    shared (pooled) field keys and subfield codes, which takes a fraction of
+    the memory of a :class:`Record`. Values are accessed in the same way,
+    e.g. ``record["100__a"]``; use :meth:`as_record` to get a mutable
+    :class:`Record`.
+    """
+
+    __slots__ = ('recid', 'server_url', '_keys', '_values', '_marcxml')
+
+    def __init__(self, recid, server_url, keys, values, marcxml=None):
+        self.recid = recid
+        self.server_url = server_url
+        self._keys = keys
+        self._values = values
+        self._marcxml = marcxml
+
+    @classmethod
+    def from_record(cls, record):
+        """Return the compact representation of a :class:`Record`."""
+        keys = sorted(dict.keys(record))
+        values = []
+        for key in keys:
+            fields = dict.__getitem__(record, key)
+            if key.startswith('00'):
+                values.append(tuple(fields))
+                continue
+            values.append(tuple(
+                tuple(item for subcode in sorted(datafield)
+                      for value in datafield[subcode]
+                      for item in (_pool(subcode), value))
+                for datafield in fields))
+        return cls(record.recid, record.server_url,
+                   tuple(_pool(key) for key in keys), tuple(values),
+                   record._marcxml)
+
+    def __reduce__(self):
+        return (type(self), (self.recid, self.server_url, self._keys,
+                             self._values, _pickled_marcxml(self)))
+
+    def __sizeof__(self):
+        # Include the fields, for the size limit of the records cache.
+        return object.__sizeof__(self) + approximate_size(self._keys) + \
+            approximate_size(self._values)
+
+    def _fields(self, key):
+        index = bisect_left(self._keys, key)
+        if index == len(self._keys) or self._keys[index] != key:
+            raise KeyError(key)
+        return key, self._values[index]
+
+    def __getitem__(self, item):
+        tag, ind1, ind2, subcode = decompose_code(item)
+        key, fields = self._fields(tag + ind1 + ind2)
+        if key.startswith('00'):
+            return list(fields)
+        if subcode is not None:
+            return [datafield[i + 1] for datafield in fields
+                    for i in range(0, len(datafield), 2)
+                    if datafield[i] == subcode]
+        return [_subfields_dict(datafield) for datafield in fields]
+
+    def get(self, item, default=None):
+        """Return ``self[item]`` if it exists, ``default`` otherwise."""
+        try:
+            return self[item]
+        except KeyError:
+            return default
+
+    def __contains__(self, item):
+        tag, ind1, ind2, subcode = decompose_code(item)
+        try:
+            self._fields(tag + ind1 + ind2)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def keys(self):
+        """Return the list of field keys (e.g. ``"100__"``)."""
+        return list(self._keys)
+
+    def as_record(self):
+        """Materialize the equivalent :class:`Record`."""
+        record = Record(recid=self.recid, marcxml=self._marcxml,
+                        server_url=self.server_url)
+        for key, fields in zip(self._keys, self._values):
+            if key.startswith('00'):
+                dict.__setitem__(record, key, list(fields))
+            else:
+                dict.__setitem__(record, key, [_subfields_dict(datafield)
+                                               for datafield in fields])
+        return record
+
+    def __eq__(self, other):
+        if isinstance(other, CompactRecord):
+            return (self.recid, self._keys, self._values) == \
+                (other.recid, other._keys, other._values)
+        return self.as_record() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "CompactRecord(" + dict.__repr__(self.as_record()) + ")"
+
+    @property
+    def marcxml_span(self):
+        """See :attr:`Record.marcxml_span`."""
+        if isinstance(self._marcxml, tuple):
+            return self._marcxml[1:]
+
+    def export(self, of="marcxml"):
+        """Return the record in chosen format."""
+        return _record_marcxml(self).decode('utf-8')
+
+    def url(self):
+        """Return the URL to this record, or ``None`` if not known."""
+        if self.server_url is not None and self.recid is not None:
+            return '/'.join(
+                [self.server_url, CFG_SITE_RECORD, str(self.recid)])
+
+
+class MARCXMLSource(object):
+
+    """Document shared by the records parsed from it.
+
+    Records reference their MARCXML as ``(source, start, end)``; ``data`` is
+    ``None`` until the whole document has been read.
+    """
+
+    def __init__(self, data=None):
+        self.data = data
+
+
 class RecordsHandler(xml.sax.handler.ContentHandler):
 
     "MARCXML Parser"
 
-    def __init__(self, records):
+    def __init__(self, records, compact=False, intern_values=None,
+                 value_pool=None, max_pooled_values=CFG_MAX_POOLED_VALUES,
+                 fields=None, replace=False):
         """Initialize MARCXML Parser.
 
-        :param records: dictionary with an already existing cache of records
+        Field keys and subfield codes are always shared between records.
+        Values of the subfields listed in ``intern_values`` (e.g.
+        ``["100__u", "980__a"]``) are deduplicated through ``value_pool``.
+
+        If ``fields`` is given, the fields with other tags are skipped
+        without being decoded. Fields are selected by tag, regardless of
+        their indicators: ``"100"`` keeps all the subfields of the ``100``
+        fields and ``"100__a"`` only their ``a`` subfields. The ``001``
+        field (the recid) is always kept.
+
+        :param records: dictionary with an already existing cache of records,
+            or ``None`` to disable the records cache
+        :param compact: whether to return :class:`CompactRecord` instances
+        :param intern_values: codes of the subfields whose values should be
+            deduplicated
+        :param value_pool: dictionary used to deduplicate values, which can
+            be shared between handlers
+        :param max_pooled_values: maximum size of ``value_pool``; values not
+            already pooled are kept as they are once it is full
+        :param fields: codes of the fields to parse, or ``None`` for all
+        :param replace: if ``True``, the parsed records replace the cached
+            ones (e.g. for fresh responses) instead of being deduplicated
+
+        To retain the MARCXML of the records, set :attr:`byte_index` to a
+        callable returning the offset in the document of the current event
+        (see :meth:`~.parsers.MARCXMLParser.byte_index`) and, once the
+        document is parsed, store it in ``source.data``. :attr:`offset` is
+        added to the reported offsets.
         """
         self.cached_records = records
+        self.replace = replace
+        self.compact = compact
+        self.intern_values = {}
+        for code in intern_values or ():
+            tag, ind1, ind2, subcode = decompose_code(code)
+            self.intern_values.setdefault(tag + ind1 + ind2,
+                                          set()).add(subcode)
+        self.value_pool = {} if value_pool is None else value_pool
+        self.max_pooled_values = max_pooled_values
+        self.fields = None
+        if fields is not None:
+            self.fields = {'001': None}
+            for code in fields:
+                tag, ind1, ind2, subcode = decompose_code(code)
+                if subcode is None or self.fields.get(tag, ()) is None:
+                    self.fields[tag] = None
+                else:
+                    self.fields.setdefault(tag, set()).add(subcode)
         self.records = []
+        self.source = MARCXMLSource()
+        self.byte_index = None
+        self.offset = 0
+        self.record_start = None
         self.in_record = False
         self.in_controlfield = False
         self.in_datafield = False
         self.in_subfield = False
         self.cur_tag = None
         self.cur_subfield = None
+        self.cur_subcode = None
+        self.cur_subcodes = None
+        self.cur_interned_codes = None
         self.cur_controlfield = None
         self.cur_datafield = None
         self.cur_record = None
         self.recid = 0
-        self.buffer = ""
+        self.buffer = []
         self.counts = 0
 
+    def _position(self):
+        """Return the offset of the current event in the source, if known.
+
+        Parser backends that cannot locate events report ``None``.
+        """
+        if self.byte_index is None:
+            return None
+        index = self.byte_index()
+        if index is None:
+            return None
+        return index + self.offset
+
     def startElement(self, name, attributes):
         if name == "record":
             self.cur_record = Record()
+            self.recid = None
             self.in_record = True
+            self.record_start = self._position()
 
         elif name == "controlfield":
             tag = attributes["tag"]
             self.cur_datafield = ""
             self.cur_tag = tag
-            self.cur_controlfield = []
-            if tag not in self.cur_record:
-                self.cur_record[tag] = self.cur_controlfield
-            self.in_controlfield = True
+            if self.fields is None or tag in self.fields:
+                self.cur_controlfield = []
+                dict.__setitem__(self.cur_record, _pool(tag + "__"),
+                                 self.cur_controlfield)
+                self.in_controlfield = True
 
         elif name == "datafield":
             tag = attributes["tag"]
             self.cur_tag = tag
+            if self.fields is not None:
+                # Skip the subfields of the fields that were not selected.
+                self.cur_subcodes = self.fields.get(tag, ())
+                if self.cur_subcodes == ():
+                    return
             ind1 = attributes["ind1"]
             if ind1 == " ":
                 ind1 = "_"
             ind2 = attributes["ind2"]
             if ind2 == " ":
                 ind2 = "_"
-            if tag + ind1 + ind2 not in self.cur_record:
-                self.cur_record[tag + ind1 + ind2] = []
+            key = _pool(tag + ind1 + ind2)
+            datafields = dict.get(self.cur_record, key)
+            if datafields is None:
+                datafields = []
+                dict.__setitem__(self.cur_record, key, datafields)
             self.cur_datafield = {}
-            self.cur_record[tag + ind1 + ind2].append(self.cur_datafield)
+            datafields.append(self.cur_datafield)
+            self.cur_interned_codes = self.intern_values.get(key)
             self.in_datafield = True
 
         elif name == "subfield":
-            subcode = attributes["code"]
+            subcode = _pool(attributes["code"])
+            if self.cur_subcodes is not None and \
+                    subcode not in self.cur_subcodes:
+                return
+            self.cur_subcode = subcode
             if subcode not in self.cur_datafield:
                 self.cur_subfield = []
                 self.cur_datafield[subcode] = self.cur_subfield
@@ -472,41 +1792,349 @@ class RecordsHandler(xml.sax.handler.ContentHandler):
             self.in_subfield = True
 
     def characters(self, data):
-        if self.in_subfield:
-            self.buffer += data
-        elif self.in_controlfield:
-            self.buffer += data
-        elif "Search-Engine-Total-Number-Of-Results:" in data:
-            print(data)
-            match_obj = re.search("\d+", data)
+        if self.in_subfield or self.in_controlfield:
+            self.buffer.append(data)
+
+    def add_record(self, record):
+        """Append a record to the results, deduplicated by the cache."""
+        if self.cached_records is not None:
+            cached = None
+            if not self.replace:
+                cached = self.cached_records.get(record.recid)
+            if cached is not None:
+                # Record has already been parsed, no need to add
+                record = cached
+            else:
+                # Add record to the global cache
+                self.cached_records[record.recid] = record
+        # Add record to the ordered list of results
+        self.records.append(record)
+
+    def comment(self, data):
+        """Read the total number of results announced by the server."""
+        if "Search-Engine-Total-Number-Of-Results:" in data:
+            match_obj = re.search(r"\d+", data)
             if match_obj:
-                print(int(match_obj.group()))
                 self.counts = int(match_obj.group())
 
+    def startDTD(self, name, public_id, system_id):
+        pass
+
+    def endDTD(self):
+        pass
+
+    def startCDATA(self):
+        pass
+
+    def endCDATA(self):
+        pass
+
     def endElement(self, name):
         if name == "record":
             self.in_record = False
-        elif name == "controlfield":
+            if self.recid is not None:
+                record = self.cur_record
+                end = self._position()
+                if self.record_start is not None and end is not None:
+                    record._marcxml = (self.source, self.record_start,
+                                       end + len("</record>"))
+                if self.compact:
+                    record = CompactRecord.from_record(record)
+                self.add_record(record)
+        elif name == "controlfield" and self.in_controlfield:
+            value = "".join(self.buffer)
             if self.cur_tag == "001":
-                self.recid = int(self.buffer)
-                if self.recid in self.cached_records:
-                    # Record has already been parsed, no need to add
-                    pass
-                else:
-                    # Add record to the global cache
-                    self.cached_records[self.recid] = self.cur_record
-                # Add record to the ordered list of results
-                self.records.append(self.cached_records[self.recid])
+                self.recid = int(value)
+                self.cur_record.recid = self.recid
 
-            self.cur_controlfield.append(self.buffer)
+            self.cur_controlfield.append(value)
             self.in_controlfield = False
-            self.buffer = ""
+            self.buffer = []
         elif name == "datafield":
             self.in_datafield = False
-        elif name == "subfield":
+        elif name == "subfield" and self.in_subfield:
             self.in_subfield = False
-            self.cur_subfield.append(self.buffer)
-            self.buffer = ""
+            value = "".join(self.buffer)
+            if self.cur_interned_codes and \
+                    self.cur_subcode in self.cur_interned_codes:
+                pooled = self.value_pool.get(value)
+                if pooled is not None:
+                    value = pooled
+                elif len(self.value_pool) < self.max_pooled_values:
+                    self.value_pool[value] = value
+            self.cur_subfield.append(value)
+            self.buffer = []
+
+
+_RECORD_START = re.compile(br'<record[\s>]')
+
+
+def _split_records(data, chunk_size=CFG_PARSE_CHUNK_SIZE, start=0):
+    """Split a MARCXML document into smaller standalone documents.
+
+    Each document holds the ``<record>`` elements found in about
+    ``chunk_size`` bytes of ``data``, surrounded by everything before the
+    first record (XML declaration, comments and ``<collection>`` start tag)
+    and everything after the last one. The records before offset ``start``
+    are left out.
+
+    Yield, for each document, the number to add to an offset in the
+    document to get the offset in ``data``, and the document itself.
+    """
+    match = _RECORD_START.search(data)
+    end = data.rfind(b'</record>')
+    if match is None or end == -1:
+        yield 0, data
+        return
+    end += len(b'</record>')
+    prolog, epilog = data[:match.start()], data[end:]
+    start = max(start, match.start())
+    while start < end:
+        match = _RECORD_START.search(data, start + chunk_size, end)
+        stop = end if match is None else match.start()
+        yield start - len(prolog), prolog + data[start:stop] + epilog
+        start = stop
+
+
+def _document_reader(data, start=0):
+    """Return a reader of the MARCXML ``data`` from offset ``start``.
+
+    The reader yields everything before the first record, then the
+    document from the record at offset ``start``. Return it with the number
+    to add to an offset in what it reads to get the offset in ``data``.
+    """
+    match = _RECORD_START.search(data)
+    if not start or match is None or start <= match.start():
+        return BufferReader(data), 0
+    prolog = data[:match.start()]
+    return BufferReader(data, start, prolog), start - len(prolog)
+
+
+def _parse_document(document, parser, compact, intern_values, fields,
+                    keep_marcxml=False):
+    """Parse a standalone MARCXML document in a worker process.
+
+    Return the records and the total number of results announced in it.
+    """
+    handler = RecordsHandler(None, compact=compact,
+                             intern_values=intern_values, fields=fields)
+    parser = make_parser(handler, parser)
+    if keep_marcxml:
+        handler.byte_index = parser.byte_index
+    parser.parse(BytesIO(document))
+    return handler.records, handler.counts
+
+
+def _pickled_marcxml(record):
+    """Return the ``_marcxml`` attribute of ``record`` to pickle.
+
+    The retained document is replaced by the record's own MARCXML, so that
+    pickling a record does not copy the whole response (nor fail on a
+    memory-mapped one). Offsets in a document that is not available, as
+    in the parsing processes, are kept as they are.
+    """
+    marcxml = record._marcxml
+    if isinstance(marcxml, tuple) and marcxml[0].data is not None:
+        return _record_marcxml(record).decode('utf-8')
+    return marcxml
+
+
+def _record_marcxml(record):
+    """Return the MARCXML of ``record`` (UTF-8 encoded bytes).
+
+    The original MARCXML of a parsed record is sliced out of the retained
+    document; other records are serialized.
+    """
+    marcxml = record._marcxml
+    if isinstance(marcxml, tuple):
+        source, start, end = marcxml
+        if source.data is not None:
+            return source.data[start:end]
+    elif isinstance(marcxml, text_type):
+        return marcxml.encode('utf-8')
+    elif marcxml is not None:
+        return marcxml
+    return _record_to_marcxml(record)
+
+
+def _pack_upload_batches(records, batch_size=CFG_UPLOAD_BATCH_SIZE,
+                         max_records=None):
+    """Pack records (or MARCXML chunks) into :class:`UploadBatch` objects.
+
+    A record larger than ``batch_size`` is uploaded alone.
+    """
+    batch = UploadBatch(0)
+    for record in records:
+        part = _upload_part(record)
+        if batch.parts and (batch.size + len(part) > batch_size or
+                            batch.count == max_records):
+            yield batch
+            batch = UploadBatch(batch.index + 1)
+        batch.add(part)
+    if batch.parts:
+        yield batch
+
+
+def _upload_part(record):
+    """Return the ``<record>`` elements of a record or MARCXML chunk."""
+    if isinstance(record, (Record, CompactRecord)):
+        return _record_marcxml(record)
+    if isinstance(record, text_type):
+        record = record.encode('utf-8')
+    # Strip the XML declaration and <collection> element, if any.
+    match = _RECORD_START.search(record)
+    end = record.rfind(b'</record>')
+    if match is None or end == -1:
+        raise ValueError("No <record> element in %r" % (record[:100], ))
+    return record[match.start():end + len(b'</record>')]
+
+
+def _record_to_marcxml(record):
+    """Serialize a :class:`Record` to MARCXML (UTF-8 encoded bytes)."""
+    if isinstance(record, CompactRecord):
+        record = record.as_record()
+    out = [u'<record>']
+    for code in sorted(record):
+        fields = dict.__getitem__(record, code)
+        if code.startswith('00'):
+            for value in fields:
+                out.append(u'<controlfield tag=%s>%s</controlfield>'
+                           % (quoteattr(code[:3]), escape(value)))
+            continue
+        ind1 = code[3:4].replace('_', ' ')
+        ind2 = code[4:5].replace('_', ' ')
+        for datafield in fields:
+            out.append(u'<datafield tag=%s ind1=%s ind2=%s>'
+                       % (quoteattr(code[:3]), quoteattr(ind1),
+                          quoteattr(ind2)))
+            for subcode in sorted(datafield):
+                for value in datafield[subcode]:
+                    out.append(u'<subfield code=%s>%s</subfield>'
+                               % (quoteattr(subcode), escape(value)))
+            out.append(u'</datafield>')
+    out.append(u'</record>')
+    return u''.join(out).encode('utf-8')
+
+
+def _record_timestamp(record):
+    """Return the ``005`` field of ``record`` as a ``struct_time``.
+
+    The field looks like ``20141210101530.0``; ``None`` is returned if it is
+    missing or malformed.
+    """
+    try:
+        return time.strptime(record['005'][0][:14], '%Y%m%d%H%M%S')
+    except (KeyError, IndexError, ValueError):
+        return None
+
+
+def _record_last_modified(record):
+    """Return the ``005`` field as an HTTP date (assuming UTC)."""
+    modified = _record_timestamp(record)
+    if modified is not None:
+        return formatdate(calendar.timegm(modified), usegmt=True)
+
+
+def _record_modification_date(record):
+    """Return the ``005`` field as ``YYYY-MM-DD HH:MM:SS``."""
+    modified = _record_timestamp(record)
+    if modified is not None:
+        return time.strftime('%Y-%m-%d %H:%M:%S', modified)
+
+
+def _default_cache_factory(name):
+    """Return an unbounded cache."""
+    return LRUCache()
+
+
+def _search_cache_key(kwparams, recid=None, fields=None, wire_format="xm"):
+    """Return the parameters, normalized cache key and parsing flag.
+
+    An empty (or missing) ``of`` parameter means that the results are
+    requested as MARCXML (or another ``wire_format``) and parsed into
+    :class:`Record` instances.
+    """
+    params = dict(kwparams)
+    parse_results = params.get('of', "") == ""
+    if parse_results:
+        params['of'] = wire_format
+        if fields is not None:
+            params.setdefault('ot', _output_tags(fields))
+    cache_key = (json.dumps(params, sort_keys=True), parse_results,
+                 None if recid is None else str(recid))
+    if parse_results and fields is not None:
+        cache_key += (tuple(sorted(fields)), )
+    return params, cache_key, parse_results
+
+
+def _output_tags(fields):
+    """Return the ``ot`` parameter selecting the tags of ``fields``."""
+    return ",".join(sorted(set(['001']) |
+                           set(decompose_code(code)[0] for code in fields)))
+
+
+def _recid_batches(recids, batch_size=CFG_BATCH_SIZE,
+                   max_length=CFG_MAX_QUERY_LENGTH):
+    """Group sorted recids into ``(pattern, count)`` search batches.
+
+    Contiguous recids are collapsed into ``recid:a->b`` ranges. Every
+    pattern matches at most ``batch_size`` recids and is at most
+    ``max_length`` characters long.
+    """
+    terms = []
+    count = 0
+    length = 0
+    start = 0
+    while start < len(recids):
+        end = start
+        while end + 1 < len(recids) and end - start + 1 < batch_size and \
+                recids[end + 1] == recids[end] + 1:
+            end += 1
+        if end > start:
+            term = "recid:%d->%d" % (recids[start], recids[end])
+        else:
+            term = "recid:%d" % recids[start]
+        size = end - start + 1
+        if terms and (count + size > batch_size or
+                      length + len(term) + 4 > max_length):
+            yield " or ".join(terms), count
+            terms, count, length = [], 0, 0
+        terms.append(term)
+        count += size
+        length += len(term) + 4
+        start = end + 1
+    if terms:
+        yield " or ".join(terms), count
+
+
+def _parse_recids(res):
+    """Transform the body of an ``of=id`` response into a :class:`RecidSet`.
+
+    The body can be given as bytes or as an iterable of byte strings. An
+    empty set is returned if it is not a list of recids.
+    """
+    if isinstance(res, binary_type):
+        res = [res]
+    try:
+        return RecidSet.parse(res)
+    except ValueError:
+        return RecidSet()
+
+
+_POOL = {}
+
+
+def _pool(string):
+    """Return the shared instance of a small, frequently repeated string."""
+    return _POOL.setdefault(string, string)
+
+
+def _subfields_dict(datafield):
+    """Turn a ``(code, value, code, value...)`` tuple into a dict."""
+    subfields = {}
+    for i in range(0, len(datafield), 2):
+        subfields.setdefault(datafield[i], []).append(datafield[i + 1])
+    return subfields
 
 
 def decompose_code(code):
@@ -32,16 +32,19 @@ class CDSInvenioConnector(InvenioConnector):
 
     __url__ = "http://cds.cern.ch/"
 
-    def __init__(self, user="", password=""):
+    def __init__(self, user="", password="", **kwargs):
         """Use to connect to the CERN Document Server (CDS).
 
+        Extra keyword arguments (e.g. ``share_session`` or ``timeout``) are
+        passed to :class:`~invenio_client.connector.InvenioConnector`.
+
         .. note:: It uses centralized SSO for authentication.
         """
         cds_url = self.__url__
         if user:
             cds_url = cds_url.replace('http', 'https')
         super(CDSInvenioConnector, self).__init__(
-            cds_url, user, password)
+            cds_url, user, password, **kwargs)
 
     def _init_browser(self):
         """Update this everytime the CERN SSO login form is refactored."""
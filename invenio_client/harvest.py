@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio-Client.
+# Copyright (C) 2014 CERN.
+#
+# Invenio-Client is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio-Client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this licence, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Helpers for long running harvests.
+
+Example of an incremental harvest, only fetching the records modified since
+the previous run:
+
+.. code-block:: python
+
+    from invenio_client import InvenioConnector
+    from invenio_client.harvest import WatermarkStore
+
+    demo = InvenioConnector("http://demo.inveniosoftware.org")
+    store = WatermarkStore("/var/lib/harvester/watermarks.json")
+
+    for record in demo.sync(store, c="Articles"):
+        print(record["245__a"][0])
+
+Multi-hour harvests and uploads can be journaled so that, after a crash,
+running the same job again resumes where it stopped instead of starting
+over:
+
+.. code-block:: python
+
+    from invenio_client.harvest import HarvestJob, UploadJob
+
+    def save(records):
+        for record in records:
+            archive_record(record)
+
+    HarvestJob(demo, "/var/lib/harvester/articles.journal", store=store,
+               c="Articles").run(save)
+
+    mirror = InvenioConnector("http://mirror.example.org", user="admin",
+                              password="...")
+    UploadJob(mirror, "/var/lib/harvester/upload.journal",
+              mode="-ir").run(read_records("/data/dump.xml"))
+"""
+
+import json
+import os
+import tempfile
+import threading
+
+from .connector import (CFG_MAX_WORKERS, CFG_PAGE_SIZE, CFG_UPLOAD_BATCH_SIZE,
+                        _pack_upload_batches, _record_modification_date,
+                        _search_cache_key)
+
+
+class WatermarkStore(object):
+
+    """Persist the modification date reached by each incremental harvest.
+
+    Watermarks are kept in a JSON file, rewritten atomically on every
+    update.
+
+    :param path: path of the JSON file, created if needed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _load(self):
+        try:
+            with open(self.path) as store:
+                return json.load(store)
+        except IOError:
+            return {}
+
+    def get(self, key, default=None):
+        """Return the watermark stored under ``key``."""
+        return self._load().get(key, default)
+
+    def set(self, key, watermark):
+        """Store ``watermark`` under ``key``."""
+        watermarks = self._load()
+        watermarks[key] = watermark
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as store:
+            json.dump(watermarks, store, indent=2, sort_keys=True)
+        try:
+            os.rename(tmp_path, self.path)
+        except OSError:
+            # Windows does not allow renaming over an existing file.
+            os.remove(self.path)
+            os.rename(tmp_path, self.path)
+
+
+class Journal(object):
+
+    """Append-only journal of the progress of a job.
+
+    Every entry is a JSON object written on its own line, and flushed to
+    disk before :meth:`append` returns. A crash can only leave the last
+    line truncated; it is ignored when reading the journal and dropped by
+    the next :meth:`append`.
+
+    :param path: path of the journal file, created if needed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._checked = False
+
+    def entries(self):
+        """Return the list of complete entries, oldest first."""
+        try:
+            with open(self.path, 'rb') as journal:
+                lines = journal.read().split(b'\n')
+        except IOError:
+            return []
+        # The last item is either empty or a truncated entry.
+        return [json.loads(line.decode('utf-8')) for line in lines[:-1]]
+
+    def append(self, **entry):
+        """Write an entry at the end of the journal."""
+        line = (json.dumps(entry, sort_keys=True) + '\n').encode('utf-8')
+        with self._lock:
+            with open(self.path, 'ab') as journal:
+                if not self._checked:
+                    self._truncate_partial_entry(journal)
+                    self._checked = True
+                journal.write(line)
+                journal.flush()
+                os.fsync(journal.fileno())
+
+    def _truncate_partial_entry(self, journal):
+        journal.seek(0, os.SEEK_END)
+        size = journal.tell()
+        if not size:
+            return
+        with open(self.path, 'rb') as existing:
+            end = existing.read().rfind(b'\n') + 1
+        if end < size:
+            journal.truncate(end)
+
+
+def _open_journal(journal, job):
+    """Return the journal and its entries, checking it belongs to ``job``.
+
+    The description of the job is written as the first entry of a new
+    journal.
+    """
+    if not isinstance(journal, Journal):
+        journal = Journal(journal)
+    # Normalize the description as it is read back from the journal.
+    job = json.loads(json.dumps(job))
+    entries = journal.entries()
+    if not entries:
+        journal.append(**job)
+    elif dict((key, entries[0].get(key)) for key in job) != job:
+        raise ValueError("The journal %s belongs to another job: %r"
+                         % (journal.path, entries[0]))
+    return journal, entries[1:]
+
+
+class HarvestJob(object):
+
+    """Search-driven harvest that can be resumed after a crash.
+
+    The pages of results are passed to a ``process`` function one at a
+    time (see :meth:`run`). Once it returns, the position of the next page
+    and the watermark reached are appended to the journal, so running the
+    job again after a crash resumes with the first page that was not
+    processed. That page may have been partially processed, so
+    ``process`` should be idempotent.
+
+    As with :meth:`~invenio_client.connector.InvenioConnector.sync`, if a
+    ``store`` of watermarks is given only the records modified since the
+    previous harvest are fetched, and the new watermark is stored once the
+    harvest is complete. The modification date used as a starting point is
+    journaled so that it does not change when resuming.
+
+    :param connector: the :class:`~invenio_client.connector.InvenioConnector`
+        to harvest.
+    :param journal: a :class:`Journal` or the path of its file. Use a new
+        journal for every harvest.
+    :param rg: number of records requested per page.
+    :param prefetch: see
+        :meth:`~invenio_client.connector.InvenioConnector.paginated_search`.
+    :param store: optional :class:`WatermarkStore`.
+    :param key: name of the watermark, see
+        :meth:`~invenio_client.connector.InvenioConnector.sync`.
+    :param kwparams: search parameters.
+    """
+
+    def __init__(self, connector, journal, rg=CFG_PAGE_SIZE, prefetch=0,
+                 store=None, key=None, **kwparams):
+        self.connector = connector
+        self.rg = rg
+        self.prefetch = prefetch
+        self.store = store
+        self.params = kwparams
+        if key is None:
+            key = connector.server_url + " " + \
+                _search_cache_key(kwparams)[1][0]
+        self.key = key
+        self.journal, entries = _open_journal(journal, {
+            'job': 'harvest', 'server': connector.server_url,
+            'params': kwparams, 'rg': rg, 'key': key})
+
+        self.jrec = 1
+        self.total = None
+        self.since = None
+        self.done = False
+        if not entries and store is not None:
+            self.since = store.get(key)
+            self.journal.append(since=self.since)
+        for entry in entries:
+            if 'since' in entry:
+                self.since = entry['since']
+            self.jrec = entry.get('jrec', self.jrec)
+            self.total = entry.get('total', self.total)
+            self.done = entry.get('done', self.done)
+        self.watermark = entries[-1].get('watermark', self.since) \
+            if entries else self.since
+
+    def run(self, process):
+        """Harvest the pages that have not been processed yet.
+
+        :param process: function called with the list of records of every
+            page.
+        :return: the number of records processed by this run.
+        """
+        if self.done:
+            return 0
+        count = 0
+        if self.total is None or self.jrec <= self.total:
+            params = dict(self.params)
+            if self.since is not None:
+                params.update(dt='m', d1=self.since)
+            search = self.connector.paginated_search(
+                rg=self.rg, jrec=self.jrec, prefetch=self.prefetch, **params)
+            for jrec, page in search.pages():
+                process(page)
+                count += len(page)
+                for record in page:
+                    modified = _record_modification_date(record)
+                    if modified is not None and (self.watermark is None or
+                                                 modified > self.watermark):
+                        self.watermark = modified
+                # The server may have capped the page size.
+                self.jrec = jrec + search.rg
+                self.total = search.total
+                self.journal.append(jrec=self.jrec, total=self.total,
+                                    watermark=self.watermark)
+        if self.store is not None and self.watermark is not None:
+            self.store.set(self.key, self.watermark)
+        self.journal.append(done=True, watermark=self.watermark)
+        self.done = True
+        return count
+
+
+class UploadJob(object):
+
+    """Bulk upload that can be resumed after a crash.
+
+    The records are packed into batches as by
+    :meth:`~invenio_client.connector.InvenioConnector.upload_records`, and
+    the index of every batch is journaled as soon as it is uploaded. When
+    the job is run again, the batches uploaded by previous runs are packed
+    but not sent; the records must therefore be given in the same order
+    on every run. Failed batches are uploaded again by the next run.
+
+    A batch being uploaded during a crash may reach the server twice, so
+    prefer modes that can be replayed such as ``-r`` or ``-ir``.
+
+    :param connector: the :class:`~invenio_client.connector.InvenioConnector`
+        to upload to.
+    :param journal: a :class:`Journal` or the path of its file.
+    :param mode: see
+        :meth:`~invenio_client.connector.InvenioConnector.upload_marcxml`.
+    """
+
+    def __init__(self, connector, journal, mode,
+                 batch_size=CFG_UPLOAD_BATCH_SIZE, max_records=None,
+                 max_workers=CFG_MAX_WORKERS):
+        self.connector = connector
+        self.mode = mode
+        self.batch_size = batch_size
+        self.max_records = max_records
+        self.max_workers = max_workers
+        self.journal, entries = _open_journal(journal, {
+            'job': 'upload', 'server': connector.server_url, 'mode': mode,
+            'batch_size': batch_size, 'max_records': max_records})
+        self.uploaded = set(entry['batch'] for entry in entries
+                            if entry.get('ok'))
+
+    def run(self, records):
+        """Upload the batches of ``records`` not uploaded yet.
+
+        :return: the list of :class:`~invenio_client.connector.UploadBatch`
+            instances uploaded by this run, in order.
+        """
+        batches = (batch for batch in _pack_upload_batches(
+            records, self.batch_size, self.max_records)
+            if batch.index not in self.uploaded)
+        return self.connector.upload_batches(
+            batches, self.mode, max_workers=self.max_workers,
+            callback=self._journal_batch)
+
+    def _journal_batch(self, batch):
+        if batch.ok:
+            self.uploaded.add(batch.index)
+        self.journal.append(batch=batch.index, ok=batch.ok,
+                            records=batch.count)
+
+
+__all__ = ('HarvestJob', 'Journal', 'UploadJob', 'WatermarkStore')
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio-Client.
+# Copyright (C) 2014 CERN.
+#
+# Invenio-Client is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio-Client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this licence, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""XML parser backends driving a :class:`~.connector.RecordsHandler`.
+
+All the backends report the same events to the handler (``startElement``,
+``characters``, ``endElement`` and ``comment``) and therefore produce the
+same records:
+
+- ``"sax"``: :mod:`xml.sax`, the default;
+- ``"expat"``: direct :mod:`pyexpat` callbacks, avoiding the SAX layers;
+- ``"lxml"``: :class:`lxml.etree.XMLPullParser`, available if
+  `lxml <http://lxml.de>`_ is installed.
+
+The backend is chosen with the ``parser`` argument of
+:class:`~.connector.InvenioConnector`.
+
+Records can also be read from the text MARC output format (``of=tm``) of
+Invenio, which is smaller and cheaper to parse than MARCXML, with
+:class:`TextMARCParser` (see :data:`FORMATS`).
+"""
+
+import re
+import xml.sax
+
+from xml.parsers import expat
+
+try:
+    from lxml import etree
+except ImportError:  # pragma: no cover (depends on installed packages)
+    etree = None
+
+CFG_READ_SIZE = 65536
+
+
+class MARCXMLParser(object):
+
+    """Base class of the parser backends.
+
+    Subclasses implement :meth:`feed` and :meth:`close`, and
+    :meth:`byte_index` if they can locate the events in the document.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def feed(self, data):
+        """Parse a chunk of the document."""
+        raise NotImplementedError
+
+    def close(self):
+        """Signal the end of the document."""
+        raise NotImplementedError
+
+    def byte_index(self):
+        """Return the offset in the document of the current event.
+
+        Returns ``None`` if the backend cannot locate events.
+        """
+        return None
+
+    def parse(self, source):
+        """Parse a whole document from the file-like object ``source``."""
+        while True:
+            data = source.read(CFG_READ_SIZE)
+            if not data:
+                break
+            self.feed(data)
+        self.close()
+
+
+class SaxParser(MARCXMLParser):
+
+    """Parser backend based on :mod:`xml.sax`."""
+
+    def __init__(self, handler):
+        super(SaxParser, self).__init__(handler)
+        self.parser = xml.sax.make_parser()
+        self.parser.setContentHandler(handler)
+        self.parser.setProperty(xml.sax.handler.property_lexical_handler,
+                                handler)
+
+    def feed(self, data):
+        self.parser.feed(data)
+
+    def close(self):
+        self.parser.close()
+
+    def byte_index(self):
+        # The expat parser wrapped by the SAX reader.
+        return self.parser._parser.CurrentByteIndex
+
+
+class ExpatParser(MARCXMLParser):
+
+    """Parser backend calling the handler directly from :mod:`pyexpat`."""
+
+    def __init__(self, handler):
+        super(ExpatParser, self).__init__(handler)
+        self.parser = expat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = handler.startElement
+        self.parser.EndElementHandler = handler.endElement
+        self.parser.CharacterDataHandler = handler.characters
+        self.parser.CommentHandler = handler.comment
+
+    def feed(self, data):
+        self.parser.Parse(data, False)
+
+    def close(self):
+        self.parser.Parse(b"", True)
+
+    def byte_index(self):
+        return self.parser.CurrentByteIndex
+
+
+class LxmlParser(MARCXMLParser):
+
+    """Parser backend based on :class:`lxml.etree.XMLPullParser`."""
+
+    def __init__(self, handler):
+        if etree is None:
+            raise ImportError("The 'lxml' parser requires lxml.")
+        super(LxmlParser, self).__init__(handler)
+        self.parser = etree.XMLPullParser(events=('start', 'end', 'comment'),
+                                          resolve_entities=False)
+
+    def feed(self, data):
+        self.parser.feed(data)
+        self._dispatch()
+
+    def close(self):
+        self.parser.close()
+        self._dispatch()
+
+    def _dispatch(self):
+        handler = self.handler
+        for event, element in self.parser.read_events():
+            if event == 'comment':
+                handler.comment(element.text)
+                continue
+            name = element.tag.rpartition('}')[2]
+            if event == 'start':
+                handler.startElement(name, element.attrib)
+            else:
+                if element.text:
+                    handler.characters(element.text)
+                handler.endElement(name)
+                if name == 'record':
+                    # Free the memory used by the parsed records.
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+
+
+class TextMARCParser(MARCXMLParser):
+
+    """Parser of the text MARC format reporting MARCXML events.
+
+    Every line holds one field of a record, e.g.::
+
+        000000001 001__ 1
+        000000001 100__ $$aEllis, J$$uCERN
+
+    Lines that do not start with a recid continue the value of the
+    previous line (values containing new lines).
+    """
+
+    line_start = re.compile(r'\d{9} ')
+
+    def __init__(self, handler):
+        super(TextMARCParser, self).__init__(handler)
+        self.buffer = b""
+        self.line = None
+        self.recid = None
+
+    def feed(self, data):
+        lines = (self.buffer + data).split(b"\n")
+        self.buffer = lines.pop()
+        for line in lines:
+            self._read_line(line.decode('utf-8'))
+
+    def close(self):
+        if self.buffer:
+            self._read_line(self.buffer.decode('utf-8'))
+            self.buffer = b""
+        self._field()
+        if self.recid is not None:
+            self.handler.endElement('record')
+            self.recid = None
+
+    def _read_line(self, line):
+        if self.line_start.match(line):
+            self._field()
+            self.line = line
+        elif self.line is not None:
+            self.line += u"\n" + line
+
+    def _field(self):
+        """Report the events of the pending line."""
+        line = self.line
+        if line is None:
+            return
+        self.line = None
+        handler = self.handler
+        recid = line[:9]
+        if recid != self.recid:
+            if self.recid is not None:
+                handler.endElement('record')
+            handler.startElement('record', {})
+            self.recid = recid
+        tag, ind1, ind2 = line[10:13], line[13:14], line[14:15]
+        value = line[16:]
+        if tag.startswith('00'):
+            handler.startElement('controlfield', {'tag': tag})
+            handler.characters(value)
+            handler.endElement('controlfield')
+            return
+        handler.startElement('datafield',
+                             {'tag': tag, 'ind1': ind1, 'ind2': ind2})
+        for subfield in value.split(u"$$")[1:]:
+            handler.startElement('subfield', {'code': subfield[:1]})
+            handler.characters(subfield[1:])
+            handler.endElement('subfield')
+        handler.endElement('datafield')
+
+
+PARSERS = {
+    'sax': SaxParser,
+    'expat': ExpatParser,
+}
+
+if etree is not None:  # pragma: no cover (depends on installed packages)
+    PARSERS['lxml'] = LxmlParser
+
+
+#: Parsers of the output formats other than MARCXML (``xm``).
+FORMATS = {
+    'tm': TextMARCParser,
+}
+
+
+def make_parser(handler, backend='sax', of='xm'):
+    """Return a parser of the given backend reporting events to handler.
+
+    The backend is only used for MARCXML; other output formats (``of``)
+    have their own parser.
+    """
+    try:
+        if of == 'xm':
+            parser_class = PARSERS[backend]
+        else:
+            parser_class = FORMATS[of]
+    except KeyError:
+        raise ValueError("Unknown or unavailable parser backend %r"
+                         % (backend if of == 'xm' else of, ))
+    return parser_class(handler)
+
+
+__all__ = ('ExpatParser', 'FORMATS', 'LxmlParser', 'MARCXMLParser',
+           'PARSERS', 'SaxParser', 'TextMARCParser', 'make_parser')
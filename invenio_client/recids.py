@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio-Client.
+# Copyright (C) 2014 CERN.
+#
+# Invenio-Client is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio-Client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this licence, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Compact sets of record identifiers.
+
+Searches with ``of="id"`` return a :class:`RecidSet`, which stores the
+recids in a sorted array of machine integers (4 bytes per recid instead of
+about 30 for a list of Python integers) and supports set algebra, so that
+large queries can be combined on the client side:
+
+.. code-block:: python
+
+    articles = demo.search(c="Articles", of="id")
+    cern = demo.search(p="affiliation:CERN", of="id")
+    for recid in (articles & cern) - demo.search(p="higgs", of="id"):
+        ...
+
+A set iterates in ascending order. When the server ranks the results
+(e.g. ``sf``, ``so`` or ``rm``), its order is available from
+:meth:`RecidSet.ranked`.
+"""
+
+import re
+import sys
+
+from array import array
+from bisect import bisect_left
+from itertools import chain, compress, islice
+from operator import ge, le, ne
+
+from ._compat import ifilter, ifilterfalse, imap
+
+# Unsigned integers of at least 4 bytes.
+TYPECODE = 'I' if array('I').itemsize >= 4 else 'L'
+
+_SEPARATORS = re.compile(br'[\s,\[\]]+')
+
+
+class RecidSet(object):
+
+    """Immutable, sorted set of recids.
+
+    The set operations only build a transient Python set of the smaller
+    operand, and merge the sorted arrays.
+
+    :param recids: iterable of recids, in any order and possibly repeated.
+    """
+
+    _ranking = None
+
+    def __init__(self, recids=()):
+        if isinstance(recids, RecidSet):
+            self._recids = recids._recids
+        else:
+            self._recids = _sorted_array(recids)
+
+    @classmethod
+    def parse(cls, chunks):
+        """Parse the body of an ``of=id`` response, e.g. ``[3, 2, 1]``.
+
+        The body is given as an iterable of byte strings, parsed as they
+        come, so that the whole body is never held in memory. If the recids
+        are neither in ascending nor in descending order, the server ranked
+        them and their order is kept for :meth:`ranked`.
+
+        :raises ValueError: if the body is not a list of integers.
+        """
+        recids = array(TYPECODE)
+        tail = b""
+        for chunk in chunks:
+            numbers = _SEPARATORS.split(tail + chunk)
+            # The last number may continue in the next chunk.
+            tail = numbers.pop()
+            recids.extend(int(number) for number in numbers if number)
+        if tail:
+            recids.append(int(tail))
+        result = cls(recids)
+        if not _is_sorted(recids) and not _is_sorted(recids, ge):
+            result._ranking = recids
+        return result
+
+    def ranked(self):
+        """Return the recids in the order of the server's ranking.
+
+        Only the sets returned by a ranked search have one; the others,
+        including the results of set operations, return their recids in
+        ascending order.
+        """
+        if self._ranking is None:
+            return self.tolist()
+        return self._ranking.tolist()
+
+    def __len__(self):
+        return len(self._recids)
+
+    def __iter__(self):
+        return iter(self._recids)
+
+    def __reversed__(self):
+        return reversed(self._recids)
+
+    def __contains__(self, recid):
+        index = bisect_left(self._recids, recid)
+        return index < len(self._recids) and self._recids[index] == recid
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            result = _from_array(self._recids[index])
+            if index.step is not None and index.step < 0:
+                result._recids.reverse()
+            return result
+        return self._recids[index]
+
+    def __bool__(self):
+        return len(self._recids) > 0
+
+    __nonzero__ = __bool__
+
+    def __eq__(self, other):
+        if isinstance(other, RecidSet):
+            return self._recids == other._recids
+        return NotImplemented
+
+    def __ne__(self, other):
+        if isinstance(other, RecidSet):
+            return self._recids != other._recids
+        return NotImplemented
+
+    def __sizeof__(self):
+        # Include the arrays, for the size limits of the caches.
+        size = object.__sizeof__(self) + sys.getsizeof(self._recids)
+        if self._ranking is not None:
+            size += sys.getsizeof(self._ranking)
+        return size
+
+    def __hash__(self):
+        return hash(tuple(self._recids))
+
+    def __repr__(self):
+        return "RecidSet(%r)" % (self._recids.tolist(), )
+
+    def range(self, start, stop):
+        """Return the recids ``r`` such that ``start <= r < stop``."""
+        return self[bisect_left(self._recids, start):
+                    bisect_left(self._recids, stop)]
+
+    def union(self, *others):
+        """Return the recids found in this set or in any of ``others``."""
+        recids = self._recids
+        for other in others:
+            other = RecidSet(other)._recids
+            if len(other) > len(recids):
+                recids, other = other, recids
+            recids = _merge(recids, _difference(other, recids))
+        return _from_array(recids)
+
+    def intersection(self, *others):
+        """Return the recids found in this set and in all ``others``."""
+        recids = self._recids
+        for other in others:
+            small, large = sorted((recids, RecidSet(other)._recids),
+                                  key=len)
+            recids = array(TYPECODE, ifilter(set(small).__contains__, large))
+        return _from_array(recids)
+
+    def difference(self, *others):
+        """Return the recids of this set not found in any of ``others``."""
+        recids = self._recids
+        for other in others:
+            recids = _difference(recids, RecidSet(other)._recids)
+        return _from_array(recids)
+
+    def symmetric_difference(self, other):
+        """Return the recids found in exactly one of the two sets."""
+        other = RecidSet(other)._recids
+        return _from_array(_merge(_difference(self._recids, other),
+                                  _difference(other, self._recids)))
+
+    def issubset(self, other):
+        """Return whether all the recids of this set are in ``other``."""
+        other = RecidSet(other)._recids
+        return len(self) <= len(other) and \
+            not _difference(self._recids, other)
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    def __sub__(self, other):
+        return self.difference(other)
+
+    def __xor__(self, other):
+        return self.symmetric_difference(other)
+
+    def __le__(self, other):
+        return self.issubset(other)
+
+    def tolist(self):
+        """Return the recids as a list of integers."""
+        return self._recids.tolist()
+
+
+def _is_sorted(recids, compare=le):
+    """Return whether ``compare`` holds for all the consecutive recids."""
+    return all(imap(compare, recids, islice(recids, 1, None)))
+
+
+def _unique(recids):
+    """Return an array of the sorted ``recids``, without repetitions."""
+    # Keep the recids that differ from the next one, and the last one.
+    last = chain(imap(ne, recids, islice(recids, 1, None)), [True])
+    return array(TYPECODE, compress(recids, last))
+
+
+def _sorted_array(recids):
+    """Return an array of the given ``recids``, sorted and unique."""
+    recids = array(TYPECODE, recids)
+    if _is_sorted(recids, ge):
+        recids.reverse()
+    elif not _is_sorted(recids):
+        recids = array(TYPECODE, sorted(recids))
+    return _unique(recids)
+
+
+def _merge(first, second):
+    """Return an array of the recids of two disjoint sorted arrays."""
+    if not second:
+        return first
+    # Sorting two runs only merges them, in linear time.
+    return array(TYPECODE, sorted(chain(first, second)))
+
+
+def _difference(recids, other):
+    """Return an array of the sorted ``recids`` not found in ``other``.
+
+    Only the smaller of the two arrays is turned into a Python set.
+    """
+    if len(other) <= len(recids):
+        return array(TYPECODE, ifilterfalse(set(other).__contains__, recids))
+    recids = set(recids)
+    recids.difference_update(other)
+    return array(TYPECODE, sorted(recids))
+
+
+def _from_array(recids):
+    """Return a set of the sorted and unique ``recids`` array."""
+    result = RecidSet()
+    result._recids = recids
+    return result
+
+
+__all__ = ('RecidSet', )
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio-Client.
+# Copyright (C) 2014 CERN.
+#
+# Invenio-Client is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio-Client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this licence, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Retry policy of the requests sent by the connector.
+
+Every request of an :class:`~invenio_client.connector.InvenioConnector`
+(searches, records, baskets and uploads) goes through its
+:class:`RetryPolicy`, which retries:
+
+- requests that could not connect, whatever their method;
+- broken connections (e.g. reset by the server), read timeouts and
+  responses with a transient status (429 and 5xx by default) for the
+  idempotent methods only (``GET`` and ``HEAD`` by default), as the
+  server may have received the request, so that uploads are not
+  duplicated.
+
+Retries wait an exponentially growing, randomized delay, or the delay
+requested by the ``Retry-After`` header of the response. A retry budget
+limits the proportion of retried requests, so that a failing server is not
+flooded with retries.
+
+Example of use:
+
+.. code-block:: python
+
+    from invenio_client import InvenioConnector
+    from invenio_client.retry import RetryPolicy
+
+    retry = RetryPolicy(retries=5, backoff=1.0, methods=("GET", "POST"))
+    demo = InvenioConnector("http://demo.inveniosoftware.org", retry=retry)
+    ...
+    print(retry.stats())
+"""
+
+import random
+import threading
+import time
+
+from email.utils import mktime_tz, parsedate_tz
+
+from requests.exceptions import (ConnectionError, ConnectTimeout,
+                                 RequestException, Timeout)
+from requests.packages.urllib3.exceptions import NewConnectionError
+
+CFG_RETRY_STATUSES = (429, 500, 502, 503, 504)
+CFG_RETRY_METHODS = ("GET", "HEAD")
+
+
+class RetryPolicy(object):
+
+    """Decide whether and when failed requests are sent again.
+
+    The n-th retry of a request waits a random delay between 0 and
+    ``backoff * 2 ** (n - 1)`` seconds (at most ``max_backoff``), unless
+    the response has a ``Retry-After`` header. A policy is thread-safe and
+    can be shared by several connectors; its retry budget and counters are
+    then shared too.
+
+    :param retries: maximum number of retries of a request.
+    :param backoff: base delay in seconds.
+    :param max_backoff: maximum delay in seconds. Responses asking to
+        retry after a longer delay are returned without retrying.
+    :param statuses: HTTP status codes of the responses to retry.
+    :param methods: HTTP methods retried on a retryable status, a broken
+        connection or a read timeout. Other methods are only retried if
+        the connection could not be established.
+    :param budget: number of retries earned by every request, e.g. ``0.2``
+        to retry at most about one request in five in the long run, or
+        ``None`` for an unlimited budget.
+    :param max_budget: maximum number of retries saved up, which are
+        available at once.
+    """
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=60.0,
+                 statuses=CFG_RETRY_STATUSES, methods=CFG_RETRY_METHODS,
+                 budget=0.2, max_budget=10):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = frozenset(statuses)
+        self.methods = frozenset(method.upper() for method in methods)
+        self.budget = budget
+        self.max_budget = max_budget
+        self._tokens = float(max_budget)
+        self._lock = threading.Lock()
+        self._counters = dict(requests=0, retries=0, failures=0,
+                              budget_exhausted=0, waited=0.0)
+
+    def call(self, method, send):
+        """Call ``send()`` until its response is final and return it.
+
+        :param method: HTTP method of the request.
+        :param send: function sending the request and returning a
+            :class:`requests.Response`.
+        :raises: the last :class:`requests.exceptions.RequestException`
+            raised by ``send()`` if the request cannot be retried.
+        """
+        method = method.upper()
+        self._start()
+        attempt = 0
+        while True:
+            try:
+                response = send()
+            except RequestException as err:
+                retryable = isinstance(err, (ConnectionError, Timeout))
+                delay = self._error_delay(method, attempt, retryable,
+                                          _not_sent(err))
+                if delay is None:
+                    raise
+            else:
+                delay = self._response_delay(method, attempt,
+                                             response.status_code,
+                                             response.headers)
+                if delay is None:
+                    return response
+                response.close()
+            attempt += 1
+            time.sleep(delay)
+
+    def stats(self):
+        """Return a dictionary with the retry counters.
+
+        ``requests`` counts the requests (not the attempts), ``retries``
+        the attempts after the first one, ``failures`` the requests given
+        up on, among which ``budget_exhausted`` were not retried for lack
+        of budget, and ``waited`` the total time spent waiting.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['budget'] = self._tokens if self.budget is not None \
+                else None
+            return stats
+
+    def _start(self):
+        """Count a new request and earn its retry budget."""
+        with self._lock:
+            self._counters['requests'] += 1
+            if self.budget is not None:
+                self._tokens = min(self.max_budget,
+                                   self._tokens + self.budget)
+
+    def _error_delay(self, method, attempt, retryable, not_sent):
+        """Return the delay before retrying after an error, or ``None``.
+
+        ``retryable`` tells whether the error is a broken connection or a
+        timeout, and ``not_sent`` whether it was raised before connecting.
+        """
+        if not (not_sent or (retryable and method in self.methods)) or \
+                not self._allow_retry(attempt):
+            return None
+        return self._wait(self._backoff(attempt))
+
+    def _response_delay(self, method, attempt, status, headers):
+        """Return the delay before retrying after a response, or ``None``.
+
+        The response is final, and returned, if the delay is ``None``.
+        """
+        if status not in self.statuses or method not in self.methods:
+            return None
+        delay = _retry_after(headers)
+        if delay is None:
+            delay = self._backoff(attempt)
+        elif delay > self.max_backoff:
+            self._count('failures')
+            return None
+        if not self._allow_retry(attempt):
+            return None
+        return self._wait(delay)
+
+    def _wait(self, delay):
+        with self._lock:
+            self._counters['waited'] += delay
+        return delay
+
+    def _allow_retry(self, attempt):
+        """Take a retry from the budget; count the failure if none is left."""
+        with self._lock:
+            if attempt >= self.retries:
+                self._counters['failures'] += 1
+                return False
+            if self.budget is not None:
+                if self._tokens < 1:
+                    self._counters['failures'] += 1
+                    self._counters['budget_exhausted'] += 1
+                    return False
+                self._tokens -= 1
+            self._counters['retries'] += 1
+            return True
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff * 2 ** attempt))
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+
+def _not_sent(err):
+    """Return whether ``err`` was raised before connecting to the server.
+
+    Other connection errors (e.g. ``Connection aborted``) may happen after
+    the request was sent.
+    """
+    if isinstance(err, ConnectTimeout):
+        return True
+    reason = err.args[0] if err.args else None
+    # requests wraps the urllib3 error in a MaxRetryError.
+    reason = getattr(reason, 'reason', reason)
+    return isinstance(reason, NewConnectionError)
+
+
+def _retry_after(headers):
+    """Return the delay in seconds asked by the ``Retry-After`` header.
+
+    The header holds either a number of seconds or an HTTP date; ``None``
+    is returned if it is missing or malformed.
+    """
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0.0, mktime_tz(date) - time.time())
+
+
+__all__ = ('RetryPolicy', )
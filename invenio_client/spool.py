@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio-Client.
+# Copyright (C) 2014 CERN.
+#
+# Invenio-Client is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio-Client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this licence, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Responses spooled to memory-mapped files.
+
+Large MARCXML responses can be spooled to disk instead of being held in
+memory, and parsed (or parsed again) from the mapped file:
+
+.. code-block:: python
+
+    from invenio_client import InvenioConnector
+    from invenio_client.spool import Spool
+
+    demo = InvenioConnector("http://demo.inveniosoftware.org")
+    spool = demo.spool_search("/var/tmp/articles.xml", c="Articles", rg=0)
+
+    # Later, possibly after a crash, without downloading the file again:
+    spool = Spool("/var/tmp/articles.xml")
+    for record in demo.parse_marcxml(spool, start=offset):
+        ...
+"""
+
+import mmap
+import os
+import tempfile
+
+
+class Spool(object):
+
+    """MARCXML document stored in a file and mapped in memory.
+
+    The document is available as :attr:`data`, which supports slicing and
+    searching like a byte string without being loaded in memory. Records
+    parsed from a spool reference it to export their MARCXML.
+
+    :param path: path of the file.
+    :param delete: if ``True``, the file is removed as soon as possible,
+        i.e. once mapped on POSIX systems or once closed otherwise.
+    """
+
+    def __init__(self, path, delete=False):
+        self.path = path
+        self.delete = delete
+        with open(path, 'rb') as spool:
+            if os.fstat(spool.fileno()).st_size:
+                self.data = mmap.mmap(spool.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+            else:
+                # Empty files cannot be mapped.
+                self.data = b""
+        if delete:
+            try:
+                os.remove(path)
+            except OSError:
+                # Windows does not allow removing a mapped file.
+                pass
+
+    @classmethod
+    def from_chunks(cls, chunks, path=None, directory=None):
+        """Write the byte string ``chunks`` to a file and map it.
+
+        :param path: path of the file, which is kept. By default the chunks
+            are written to a temporary file, removed automatically.
+        :param directory: directory of the temporary file.
+        """
+        delete = path is None
+        if delete:
+            fd, path = tempfile.mkstemp(dir=directory, suffix='.xml')
+            spool = os.fdopen(fd, 'wb')
+        else:
+            spool = open(path, 'wb')
+        try:
+            with spool:
+                for chunk in chunks:
+                    spool.write(chunk)
+        except BaseException:
+            # Do not leave a partial download behind.
+            os.remove(path)
+            raise
+        return cls(path, delete=delete)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Unmap the file, and remove it if needed.
+
+        The records parsed from the spool then export their MARCXML
+        serialized from their fields.
+        """
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data = None
+        if self.delete and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class BufferReader(object):
+
+    """File-like object reading ``prefix`` then ``data[start:]``.
+
+    ``data`` can be any byte string or buffer, such as :attr:`Spool.data`;
+    it is read without being copied as a whole.
+    """
+
+    def __init__(self, data, start=0, prefix=b""):
+        self.data = data
+        self.position = start
+        self.prefix = prefix
+
+    def read(self, size=-1):
+        """Read at most ``size`` bytes (all the remaining ones if < 0)."""
+        if size < 0:
+            size = len(self.prefix) + len(self.data) - self.position
+        head = self.prefix[:size]
+        self.prefix = self.prefix[size:]
+        end = min(self.position + size - len(head), len(self.data))
+        chunk = self.data[self.position:end]
+        self.position = end
+        return head + chunk
+
+
+__all__ = ('BufferReader', 'Spool')
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio-Client.
+# Copyright (C) 2014 CERN.
+#
+# Invenio-Client is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio-Client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this licence, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Client-side throttling of the requests sent to a server.
+
+A :class:`RateLimiter` lets through at most ``rate`` requests per second
+(with bursts of ``burst`` requests) and at most ``max_in_flight``
+requests at a time. Give the same limiter to all the connectors (and
+threads) talking to a server, e.g. with :func:`get_rate_limiter`:
+
+.. code-block:: python
+
+    from invenio_client.contrib.cds import CDSInvenioConnector
+    from invenio_client.throttle import get_rate_limiter
+
+    limiter = get_rate_limiter(CDSInvenioConnector.__url__, rate=5,
+                               max_in_flight=4, adaptive=True)
+    cds = CDSInvenioConnector(rate_limiter=limiter)
+
+Processes harvesting the same server can share the rate through a lock
+file (on POSIX systems):
+
+.. code-block:: python
+
+    limiter = get_rate_limiter(url, rate=5, lock_path="/tmp/cds.rate")
+
+In adaptive mode the rate is halved when the server answers with errors
+(or more slowly than ``latency_target``), and slowly raised back to
+``rate`` while it answers normally.
+
+The limiter waits by blocking the calling thread, so it only applies to
+:class:`~invenio_client.connector.InvenioConnector`. The requests of
+:class:`~invenio_client.aio.AsyncInvenioConnector` are only bounded by its
+``limit`` of simultaneous connections.
+"""
+
+import os
+import threading
+import time
+
+from requests.exceptions import RequestException
+
+from ._compat import urlparse
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover (Windows)
+    fcntl = None
+
+CFG_THROTTLE_STATUSES = (429, 500, 502, 503, 504)
+
+_RATE_LIMITERS = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+
+
+class RateLimiter(object):
+
+    """Token bucket rate limiter and concurrency governor.
+
+    :param rate: number of requests per second, or ``None`` for no rate
+        limit.
+    :param burst: number of requests that can be sent at once after a
+        pause; defaults to one second worth of requests.
+    :param max_in_flight: maximum number of requests waiting for their
+        response, or ``None``. Streamed response bodies are not counted.
+    :param lock_path: path of a file through which the processes of the
+        machine using the same path share the rate.
+    :param adaptive: if ``True``, lower the rate when the server answers
+        with errors (see ``statuses``) or slowly.
+    :param latency_target: time in seconds to receive a response above
+        which the server is considered overloaded in adaptive mode.
+    :param min_rate: lowest rate of the adaptive mode; defaults to a tenth
+        of ``rate``.
+    :param statuses: HTTP status codes considered as errors by the
+        adaptive mode.
+    """
+
+    def __init__(self, rate=None, burst=None, max_in_flight=None,
+                 lock_path=None, adaptive=False, latency_target=None,
+                 min_rate=None, statuses=CFG_THROTTLE_STATUSES):
+        if adaptive and rate is None:
+            raise ValueError("The adaptive mode requires a rate")
+        if lock_path is not None and fcntl is None:
+            raise ValueError("Lock files are not supported on this system")
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate or 0)
+        self.max_in_flight = max_in_flight
+        self.lock_path = lock_path
+        self.adaptive = adaptive
+        self.latency_target = latency_target
+        self.min_rate = min_rate if min_rate is not None else \
+            (rate or 0) / 10.0
+        self.statuses = frozenset(statuses)
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(max_in_flight) \
+            if max_in_flight else None
+        self._tokens = float(self.burst)
+        self._updated = time.time()
+        self._decreased = 0
+        self._counters = dict(requests=0, errors=0, waited=0.0,
+                              in_flight=0)
+
+    def call(self, send):
+        """Call ``send()`` once allowed to, and return its response."""
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+        if self._semaphore is not None:
+            started = time.time()
+            self._semaphore.acquire()
+            delay += time.time() - started
+        with self._lock:
+            self._counters['requests'] += 1
+            self._counters['waited'] += delay
+            self._counters['in_flight'] += 1
+        started = time.time()
+        release = _Release(self._release)
+        try:
+            response = send()
+        except Exception as error:
+            release()
+            if isinstance(error, RequestException):
+                self._feedback(time.time() - started, True)
+            raise
+        if self._semaphore is not None and \
+                not getattr(response, '_content_consumed', True):
+            # The connection is busy until the body is read.
+            response.raw = _BodyReader(response.raw, release)
+        else:
+            release()
+        self._feedback(time.time() - started,
+                       response.status_code in self.statuses)
+        return response
+
+    def _release(self):
+        """Free the slot of a request once its response is received."""
+        with self._lock:
+            self._counters['in_flight'] -= 1
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    def stats(self):
+        """Return a dictionary with the counters and the current rate.
+
+        ``waited`` is the total time spent waiting for the permission to
+        send and ``errors`` counts the failed requests.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['rate'] = self.rate
+            return stats
+
+    def _reserve(self):
+        """Take a token and return the time to wait before using it.
+
+        Tokens can be reserved in advance, in which case the balance is
+        negative and the requests are spaced out by ``1 / rate``.
+        """
+        if self.rate is None:
+            return 0
+        with self._lock:
+            if self.lock_path is None:
+                self._tokens, self._updated, delay = self._take(
+                    self._tokens, self._updated)
+                return delay
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    tokens, updated = map(float,
+                                          os.read(fd, 64).split())
+                except ValueError:
+                    tokens, updated = self.burst, time.time()
+                tokens, updated, delay = self._take(tokens, updated)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, ('%r %r' % (tokens, updated)).encode('ascii'))
+                return delay
+            finally:
+                # Closing the file releases the lock.
+                os.close(fd)
+
+    def _take(self, tokens, updated):
+        now = time.time()
+        tokens = min(self.burst,
+                     tokens + max(0, now - updated) * self.rate) - 1
+        return tokens, now, max(0, -tokens / self.rate)
+
+    def _feedback(self, latency, failed):
+        """Adapt the rate to the outcome of a request."""
+        with self._lock:
+            if failed:
+                self._counters['errors'] += 1
+            if not self.adaptive:
+                return
+            if failed or (self.latency_target is not None and
+                          latency > self.latency_target):
+                now = time.time()
+                # The requests sent at the same time fail together;
+                # only slow down once for them.
+                if now - self._decreased > 1.0 / self.rate:
+                    self.rate = max(self.min_rate, self.rate / 2.0)
+                    self._decreased = now
+            else:
+                self.rate = min(self.max_rate,
+                                self.rate + self.max_rate / 20.0)
+
+
+class _Release(object):
+
+    """Call ``release`` on the first call only."""
+
+    def __init__(self, release):
+        self._release = release
+        self._lock = threading.Lock()
+        self.done = False
+
+    def __call__(self):
+        with self._lock:
+            if self.done:
+                return
+            self.done = True
+        self._release()
+
+
+class _BodyReader(object):
+
+    """Body of a streamed response holding a slot of the rate limiter.
+
+    ``release`` is called once the body has been read to the end, or the
+    response closed or garbage collected.
+    """
+
+    def __init__(self, raw, release):
+        self._raw = raw
+        self._release = release
+
+    def read(self, *args, **kwargs):
+        data = self._raw.read(*args, **kwargs)
+        if not data and (not args or args[0] != 0):
+            self._release()
+        return data
+
+    def stream(self, *args, **kwargs):
+        try:
+            for chunk in self._raw.stream(*args, **kwargs):
+                yield chunk
+        finally:
+            self._release()
+
+    def close(self):
+        try:
+            self._raw.close()
+        finally:
+            self._release()
+
+    def release_conn(self):
+        try:
+            self._raw.release_conn()
+        finally:
+            self._release()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __del__(self):
+        self._release()
+
+
+def get_rate_limiter(url, **kwargs):
+    """Return the rate limiter shared by all the users of ``url``'s host.
+
+    The limiter is created with the keyword arguments on first use; they
+    are ignored afterwards.
+    """
+    key = urlparse(url)[1].lower()
+    with _RATE_LIMITERS_LOCK:
+        if key not in _RATE_LIMITERS:
+            _RATE_LIMITERS[key] = RateLimiter(**kwargs)
+        return _RATE_LIMITERS[key]
+
+
+__all__ = ('RateLimiter', 'get_rate_limiter')
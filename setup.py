@@ -63,6 +63,15 @@ with open(os.path.join('invenio_client', 'version.py'), 'rt') as f:
         f.read()
     ).group('version')
 
+install_requires = [
+    'requests',
+    'splinter',
+    'click',
+]
+
+if sys.version_info[0] == 2:
+    install_requires.append('futures>=2.1.6')
+
 tests_require = [
     'pytest-cache>=1.0',
     'pytest-cov>=2.1.0',
@@ -83,12 +92,10 @@ setup(
     long_description=__doc__,
     packages=find_packages(exclude=["tests", "docs"]),
     include_package_data=True,
-    install_requires=[
-        'requests',
-        'splinter',
-        'click',
-    ],
+    install_requires=install_requires,
     extras_require={
+        "asyncio": ["aiohttp>=3.0"],
+        "compression": ["brotli", "zstandard"],
         "docs": ["sphinx_rtd_theme"],
         "tests": tests_require,
     },
@@ -96,7 +103,6 @@ setup(
     cmdclass={'test': PyTest},
     classifiers=[
         'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.6',
         'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
         'Programming Language :: Python :: 3.3',
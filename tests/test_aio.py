@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio-Client.
+# Copyright (C) 2014 CERN.
+#
+# Invenio-Client is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio-Client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this licence, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Unit tests for the asynchronous connector."""
+
+import sys
+
+from unittest import TestCase, skipIf
+
+try:
+    import asyncio
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from invenio_client.retry import RetryPolicy
+
+from test_connector import CFG_SITE_URL, MARCXML
+
+
+def done(loop, result=None):
+    """Return an already resolved future."""
+    future = loop.create_future()
+    future.set_result(result)
+    return future
+
+
+class FakeContent(object):
+
+    """Asynchronous iterator over the chunks of a body."""
+
+    def __init__(self, loop, content):
+        self.loop = loop
+        self.chunks = [content[i:i + 64] for i in range(0, len(content), 64)]
+
+    def iter_chunked(self, chunk_size):
+        return self
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        if not self.chunks:
+            raise StopAsyncIteration
+        return done(self.loop, self.chunks.pop(0))
+
+
+class FakeResponse(object):
+
+    """Minimal stand-in for :class:`aiohttp.ClientResponse`."""
+
+    def __init__(self, loop, content, url=CFG_SITE_URL + '/search',
+                 history=(), status=200, headers=None):
+        self.loop = loop
+        self.url = url
+        self.history = history
+        self.status = status
+        self.headers = headers or {}
+        self.released = False
+        self.body = content
+        self.content = FakeContent(loop, content)
+
+    def read(self):
+        return done(self.loop, self.body)
+
+    def release(self):
+        self.released = True
+
+    def __aenter__(self):
+        return done(self.loop, self)
+
+    def __aexit__(self, exc_type, exc_value, traceback):
+        return done(self.loop)
+
+
+class FakeSession(object):
+
+    """Answer the requests with the given responses, then with ``content``.
+
+    The responses can also be exceptions to raise.
+    """
+
+    def __init__(self, loop, content, *responses):
+        self.loop = loop
+        self.content = content
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        if not self.responses:
+            return done(self.loop, FakeResponse(self.loop, self.content))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            future = self.loop.create_future()
+            future.set_exception(response)
+            return future
+        return done(self.loop, response)
+
+
+@skipIf(sys.version_info < (3, 5) or aiohttp is None,
+        'requires Python 3.5+ and aiohttp')
+class TestAsyncConnector(TestCase):
+
+    """Test the asynchronous connector."""
+
+    def test_search(self):
+        """AsyncInvenioConnector - search shares the Record model"""
+        from invenio_client.aio import AsyncInvenioConnector
+        from invenio_client.connector import Record
+
+        loop = asyncio.new_event_loop()
+        session = FakeSession(loop, MARCXML)
+        server = AsyncInvenioConnector(CFG_SITE_URL, session=session)
+        try:
+            records = loop.run_until_complete(
+                server.search(p='higgs', c=['Books', 'Theses']))
+            again = loop.run_until_complete(server.search(p='higgs',
+                                                          c=['Books',
+                                                             'Theses']))
+            record = loop.run_until_complete(server.get_record(2))
+        finally:
+            loop.close()
+        self.assertTrue(isinstance(records[0], Record))
+        self.assertEqual(['Ellis, J'], records[0]['100__a'])
+        self.assertTrue(records is again)
+        self.assertTrue(record is records[1])
+        self.assertEqual(1, len(session.requests))
+        self.assertEqual([('p', 'higgs'), ('c', 'Books'), ('c', 'Theses'),
+                          ('of', 'xm')],
+                         sorted(session.requests[0][2]['params'],
+                                key=lambda pair: ['p', 'c', 'of'].index(
+                                    pair[0])))
+
+    def test_baskets(self):
+        """AsyncInvenioConnector - private baskets are fetched with cookies"""
+        from invenio_client.aio import AsyncInvenioConnector
+
+        loop = asyncio.new_event_loop()
+        session = FakeSession(loop, MARCXML)
+        cookies = {'INVENIOSESSION': 'secret'}
+        private = AsyncInvenioConnector(CFG_SITE_URL, session=session,
+                                        cookies=cookies)
+        public = AsyncInvenioConnector(CFG_SITE_URL, session=session)
+        try:
+            records = loop.run_until_complete(
+                private.get_records_from_basket(3, group_basket=True))
+            cached = loop.run_until_complete(
+                private.get_records_from_basket(3))
+            loop.run_until_complete(public.get_records_from_basket(3))
+        finally:
+            loop.close()
+        self.assertEqual(2, len(records))
+        self.assertTrue(records is cached)
+        (method, url, kwargs), (dummy, public_url, public_kwargs) = \
+            session.requests
+        self.assertEqual(CFG_SITE_URL + '/yourbaskets/display', url)
+        self.assertEqual({'of': 'xm', 'bskid': '3', 'category': 'G'},
+                         kwargs['params'])
+        self.assertEqual(cookies, kwargs['cookies'])
+        self.assertEqual(CFG_SITE_URL + '/yourbaskets/display_public',
+                         public_url)
+        self.assertFalse('cookies' in public_kwargs)
+
+    def test_upload_marcxml(self):
+        """AsyncInvenioConnector - records are uploaded with a mode"""
+        from invenio_client.aio import AsyncInvenioConnector
+
+        loop = asyncio.new_event_loop()
+        session = FakeSession(loop, b'[INFO] ok')
+        server = AsyncInvenioConnector(CFG_SITE_URL, session=session)
+        try:
+            self.assertRaises(NameError, loop.run_until_complete,
+                              server.upload_marcxml('<record/>', '-x'))
+            response = loop.run_until_complete(
+                server.upload_marcxml('<record/>', '-ir'))
+        finally:
+            loop.close()
+        self.assertEqual(b'[INFO] ok', response.body)
+        method, url, kwargs = session.requests[0]
+        self.assertEqual('POST', method)
+        self.assertEqual(CFG_SITE_URL + '/batchuploader/robotupload', url)
+        self.assertEqual({'file': '<record/>', 'mode': '-ir'},
+                         kwargs['data'])
+
+    def test_search_with_retry(self):
+        """AsyncInvenioConnector - searches are retried on timeouts"""
+        from invenio_client.aio import AsyncInvenioConnector
+
+        loop = asyncio.new_event_loop()
+        session = FakeSession(loop, MARCXML, asyncio.TimeoutError())
+        server = AsyncInvenioConnector(CFG_SITE_URL, session=session,
+                                       retry=RetryPolicy(retries=0))
+        try:
+            records = loop.run_until_complete(
+                server.search_with_retry(sleeptime=0, p='higgs'))
+        finally:
+            loop.close()
+        self.assertEqual(2, len(records))
+        self.assertEqual(2, len(session.requests))
+
+    def test_retry(self):
+        """AsyncInvenioConnector - requests go through the retry policy"""
+        from invenio_client.aio import AsyncInvenioConnector
+
+        loop = asyncio.new_event_loop()
+        unavailable = FakeResponse(loop, b'', status=503,
+                                   headers={'Retry-After': '0'})
+        session = FakeSession(loop, MARCXML, unavailable,
+                              aiohttp.ServerDisconnectedError(),
+                              FakeResponse(loop, MARCXML),
+                              aiohttp.ServerDisconnectedError())
+        retry = RetryPolicy(backoff=0)
+        server = AsyncInvenioConnector(CFG_SITE_URL, session=session,
+                                       retry=retry)
+        try:
+            records = loop.run_until_complete(server.search(p='higgs'))
+            # The upload may have been received: it is not sent again.
+            self.assertRaises(aiohttp.ServerDisconnectedError,
+                              loop.run_until_complete,
+                              server.upload_marcxml('<record/>', '-i'))
+        finally:
+            loop.close()
+        self.assertEqual(2, len(records))
+        self.assertTrue(unavailable.released)
+        self.assertEqual(['GET', 'GET', 'GET', 'POST'],
+                         [method for method, _, _ in session.requests])
+        self.assertEqual(2, retry.stats()['retries'])
+
+    def test_merged_record(self):
+        """AsyncInvenioConnector - merged records are reported"""
+        from invenio_client.aio import AsyncInvenioConnector
+        from invenio_client.connector import InvenioConnectorServerError
+
+        loop = asyncio.new_event_loop()
+        session = FakeSession(loop, MARCXML, FakeResponse(
+            loop, b'', url=CFG_SITE_URL + '/record/12', history=(None, )))
+        server = AsyncInvenioConnector(CFG_SITE_URL, session=session)
+        try:
+            self.assertRaises(InvenioConnectorServerError,
+                              loop.run_until_complete,
+                              server.get_record(9))
+        finally:
+            loop.close()
+        self.assertEqual(CFG_SITE_URL + '/record/9', session.requests[0][1])
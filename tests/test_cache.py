@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio-Client.
+# Copyright (C) 2014 CERN.
+#
+# Invenio-Client is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio-Client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this licence, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Unit tests for the connector caches."""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from unittest import TestCase
+
+from invenio_client import InvenioConnector, InvenioConnectorServerError
+from invenio_client.cache import DiskCache, LRUCache, SingleFlight
+from invenio_client.connector import _WIRE_FORMAT_PROBES
+from invenio_client.retry import RetryPolicy
+
+from test_connector import CFG_SITE_URL, MARCXML, TEXTMARC, FakeResponse, \
+    FakeSession
+
+
+class TestLRUCache(TestCase):
+
+    """Test the in-memory cache."""
+
+    def test_max_entries(self):
+        """LRUCache - least recently used entries are evicted"""
+        cache = LRUCache(max_entries=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(1, cache['a'])
+        cache['c'] = 3
+        self.assertEqual(['a', 'c'], cache.keys())
+        self.assertEqual(None, cache.get('b'))
+        self.assertEqual(dict(entries=2, size=0, hits=1, misses=1,
+                              evictions=1, expirations=0), cache.stats())
+
+    def test_max_bytes(self):
+        """LRUCache - entries are evicted above the size limit"""
+        cache = LRUCache(max_bytes=10, sizeof=len)
+        cache['a'] = 'x' * 6
+        cache['b'] = 'x' * 4
+        cache['c'] = 'x' * 2
+        self.assertEqual(['b', 'c'], cache.keys())
+        self.assertEqual(6, cache.size)
+
+    def test_ttl(self):
+        """LRUCache - expired entries are dropped"""
+        cache = LRUCache(ttl=60)
+        cache.set('a', 1, ttl=-1)
+        cache['b'] = 2
+        self.assertFalse('a' in cache)
+        self.assertTrue('b' in cache)
+        self.assertEqual(1, cache.stats()['expirations'])
+        self.assertTrue(cache.invalidate('b'))
+        self.assertRaises(KeyError, cache.__getitem__, 'b')
+
+
+class TestDiskCache(TestCase):
+
+    """Test the persistent cache."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_set(self):
+        """DiskCache - entries are persisted"""
+        DiskCache(self.path).set('records', 1, b'<record/>')
+        cache = DiskCache(self.path)
+        self.assertEqual(b'<record/>', cache.get('records', 1))
+        self.assertEqual(None, cache.get('queries', 1))
+        cache.invalidate('records', 1)
+        self.assertEqual(None, cache.get('records', 1))
+
+    def test_ttl(self):
+        """DiskCache - stale entries are ignored"""
+        cache = DiskCache(self.path, ttl=-1)
+        cache.set('records', 1, b'<record/>')
+        self.assertEqual(None, cache.get('records', 1))
+
+    def test_connector(self):
+        """DiskCache - records are rehydrated without requests"""
+        session = FakeSession(FakeResponse(MARCXML))
+        server = InvenioConnector(CFG_SITE_URL, session=session,
+                                  disk_cache=DiskCache(self.path))
+        records = server.search(p='higgs')
+
+        session = FakeSession()
+        server = InvenioConnector(CFG_SITE_URL, session=session,
+                                  disk_cache=DiskCache(self.path))
+        self.assertEqual(records, server.search(p='higgs'))
+        server.clear_cache()
+        record = server.get_record(1)
+        self.assertEqual(records[0], record)
+        self.assertEqual(['Ellis, J'], record['100__a'])
+        self.assertEqual(['HEAD'], [method for method, _, _ in
+                                    session.requests])
+
+    def test_connector_errors(self):
+        """DiskCache - error responses and broken bodies are not persisted"""
+        session = FakeSession(FakeResponse(b'<html><p>Error', 500),
+                              FakeResponse(b'<collection><record>'))
+        server = InvenioConnector(CFG_SITE_URL, session=session,
+                                  disk_cache=DiskCache(self.path),
+                                  retry=RetryPolicy(retries=0))
+        self.assertRaises(InvenioConnectorServerError, server.search,
+                          p='higgs')
+        self.assertRaises(Exception, server.search, p='higgs')
+        session = FakeSession(FakeResponse(MARCXML))
+        server = InvenioConnector(CFG_SITE_URL, session=session,
+                                  disk_cache=DiskCache(self.path))
+        self.assertEqual(2, len(server.search(p='higgs')))
+
+
+def run_concurrently(count, function, single_flight):
+    """Call ``function`` from ``count`` threads sharing one call.
+
+    ``function`` is only allowed to return once all the threads have
+    joined the call of the first one.
+    """
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(function()))
+               for dummy in range(count)]
+    shared = single_flight.stats()['shared'] + count - 1
+    for thread in threads:
+        thread.start()
+    deadline = time.time() + 5
+    while single_flight.stats()['shared'] < shared and \
+            time.time() < deadline:
+        time.sleep(0.001)
+    return threads, results
+
+
+class TestSingleFlight(TestCase):
+
+    """Test the deduplication of concurrent calls."""
+
+    def test_do(self):
+        """SingleFlight - concurrent calls share one result"""
+        single_flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def work():
+            calls.append(None)
+            release.wait()
+            return len(calls)
+
+        threads, results = run_concurrently(
+            4, lambda: single_flight.do('key', work), single_flight)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([1] * 4, results)
+        self.assertEqual(dict(calls=1, shared=3, in_flight=0),
+                         single_flight.stats())
+        self.assertEqual(2, single_flight.do('key', work))
+
+        def fail():
+            raise KeyError('failed')
+
+        self.assertRaises(KeyError, single_flight.do, 'key', fail)
+        self.assertEqual(
+            3, single_flight.do('key', lambda: single_flight.do('key', work)))
+
+    def test_connector(self):
+        """InvenioConnector - identical concurrent searches are coalesced"""
+        release = threading.Event()
+
+        class SlowSession(FakeSession):
+
+            def request(self, method, url, **kwargs):
+                if method == 'GET':
+                    release.wait()
+                return FakeSession.request(self, method, url, **kwargs)
+
+        session = SlowSession(FakeResponse(MARCXML), FakeResponse(MARCXML))
+        server = InvenioConnector(CFG_SITE_URL, session=session)
+        threads, results = run_concurrently(
+            3, lambda: server.search(p='higgs'), server.single_flight)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(3, len(results))
+        self.assertTrue(all(result is results[0] for result in results))
+
+        release.clear()
+        threads, records = run_concurrently(
+            3, lambda: server.get_record(3, read_cache=False),
+            server.single_flight)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(['HEAD', 'GET', 'GET'],
+                         [method for method, _, _ in session.requests])
+        self.assertEqual(3, len(records))
+        self.assertTrue(all(record is records[0] for record in records))
+
+    def test_wire_format_probe(self):
+        """InvenioConnector - concurrent first searches probe once"""
+        release = threading.Event()
+
+        class FormatSession(FakeSession):
+
+            def request(self, method, url, **kwargs):
+                self.requests.append((method, url, kwargs))
+                if method == 'HEAD':
+                    return FakeResponse()
+                release.wait()
+                if kwargs['params']['of'] == 'tm':
+                    return FakeResponse(TEXTMARC)
+                return FakeResponse(MARCXML)
+
+        session = FormatSession()
+        servers = [InvenioConnector('http://probed.example.org',
+                                    session=session, keep_marcxml=False,
+                                    wire_formats=('tm', 'xm'))
+                   for dummy in range(3)]
+        threads, results = run_concurrently(
+            3, lambda: servers.pop().search(p='higgs'), _WIRE_FORMAT_PROBES)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([2, 2, 2], [len(result) for result in results])
+        self.assertEqual(['xm', 'tm', 'tm', 'tm', 'tm'],
+                         [kwargs['params']['of'] for method, _, kwargs
+                          in session.requests if method == 'GET'])
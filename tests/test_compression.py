@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio-Client.
+# Copyright (C) 2014 CERN.
+#
+# Invenio-Client is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio-Client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this licence, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Test the decoding of compressed responses."""
+
+import gzip
+import zlib
+
+from io import BytesIO
+from unittest import TestCase
+
+from invenio_client import InvenioConnector
+from invenio_client.compression import ACCEPT_ENCODING, DecodingReader, \
+    TransferStats
+from invenio_client.connector import make_session
+
+from test_connector import CFG_SITE_URL, MARCXML, FakeResponse, \
+    FakeSession, make_marcxml
+
+
+def gzip_compress(data):
+    """Return ``data`` compressed with gzip."""
+    out = BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb') as compressed:
+        compressed.write(data)
+    return out.getvalue()
+
+
+def raw_deflate(data):
+    """Return ``data`` compressed as raw deflate data (without header)."""
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class TestCompression(TestCase):
+
+    """Test the incremental decoding of responses."""
+
+    def test_decoding_reader(self):
+        """Compression - bodies are decoded while they are read"""
+        data = make_marcxml(range(1, 2000))
+        for encoding, body in (('gzip', gzip_compress(data)),
+                               ('deflate', zlib.compress(data)),
+                               ('deflate', raw_deflate(data)),
+                               ('deflate, gzip',
+                                gzip_compress(zlib.compress(data))),
+                               (None, data)):
+            stats = TransferStats()
+            reader = DecodingReader(BytesIO(body), encoding, stats)
+            self.assertEqual(data[:10], reader.read(10))
+            self.assertEqual(data[10:], b''.join(reader.iter_chunks(1000)))
+            self.assertEqual(b'', reader.read())
+            self.assertEqual(dict(responses=1, received=len(body),
+                                  decoded=len(data),
+                                  ratio=float(len(data)) / len(body)),
+                             stats.stats())
+        self.assertRaises(ValueError, DecodingReader, BytesIO(), 'unknown')
+
+    def test_connector(self):
+        """Compression - compressed responses are parsed and counted"""
+        self.assertTrue('gzip, deflate' in ACCEPT_ENCODING)
+        self.assertEqual(ACCEPT_ENCODING,
+                         make_session().headers['Accept-Encoding'])
+        body = gzip_compress(MARCXML)
+        response = FakeResponse(body, headers={'Content-Encoding': 'gzip'})
+        server = InvenioConnector(CFG_SITE_URL,
+                                  session=FakeSession(response))
+        records = server.search(p='higgs')
+        self.assertEqual([1, 2], [record.recid for record in records])
+        stats = server.transfer_stats.stats()
+        self.assertEqual(len(body), stats['received'])
+        self.assertEqual(len(MARCXML), stats['decoded'])
@@ -23,9 +23,102 @@
 
 """Unit tests for the utils/connector."""
 
+import pickle
+from io import BytesIO
 from unittest import TestCase
 
+import requests
+
+from requests.cookies import extract_cookies_to_jar
+
 from invenio_client import InvenioConnector, InvenioConnectorServerError
+from invenio_client.cache import approximate_size
+from invenio_client.connector import CompactRecord, MergedRecord, \
+    MissingRecord, _pack_upload_batches, get_shared_session
+from invenio_client.parsers import PARSERS
+
+CFG_SITE_URL = 'http://invenio.example.org'
+
+MARCXML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<!-- Search-Engine-Total-Number-Of-Results: 2 -->
+<collection xmlns="http://www.loc.gov/MARC21/slim">
+<record>
+  <controlfield tag="001">1</controlfield>
+  <datafield tag="100" ind1=" " ind2=" ">
+    <subfield code="a">Ellis, J</subfield>
+    <subfield code="u">CERN</subfield>
+  </datafield>
+  <datafield tag="245" ind1=" " ind2=" ">
+    <subfield code="a">Higgs</subfield>
+  </datafield>
+</record>
+<record>
+  <controlfield tag="001">2</controlfield>
+  <datafield tag="245" ind1=" " ind2=" ">
+    <subfield code="a">Bosons</subfield>
+  </datafield>
+</record>
+</collection>
+"""
+
+TEXTMARC = b"""000000001 001__ 1
+000000001 100__ $$aEllis, J$$uCERN
+000000001 245__ $$aHiggs
+000000002 001__ 2
+000000002 245__ $$aBosons
+"""
+
+
+def make_marcxml(recids, total=None):
+    """Return a MARCXML collection with one record per given recid."""
+    out = [b'<?xml version="1.0" encoding="UTF-8"?>\n']
+    if total is not None:
+        out.append(('<!-- Search-Engine-Total-Number-Of-Results: %d -->\n'
+                    % total).encode('ascii'))
+    out.append(b'<collection xmlns="http://www.loc.gov/MARC21/slim">\n')
+    for recid in recids:
+        out.append(('<record><controlfield tag="001">%d</controlfield>'
+                    '<datafield tag="245" ind1=" " ind2=" ">'
+                    '<subfield code="a">Title %d</subfield></datafield>'
+                    '</record>\n' % (recid, recid)).encode('ascii'))
+    out.append(b'</collection>\n')
+    return b''.join(out)
+
+
+class FakeResponse(object):
+
+    """Minimal stand-in for :class:`requests.Response`."""
+
+    def __init__(self, content=b"", status_code=200, url=CFG_SITE_URL,
+                 headers=None):
+        self.content = content
+        self.status_code = status_code
+        self.url = url
+        self.headers = headers or {}
+        self.history = []
+        self.raw = BytesIO(content)
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        self.raw.close()
+
+
+class FakeSession(object):
+
+    """Record the requests and answer them from a list of responses."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        if method == 'HEAD' or not self.responses:
+            return FakeResponse()
+        return self.responses.pop(0)
 
 
 class TestConnector(TestCase):
@@ -44,3 +137,408 @@ class TestConnector(TestCase):
         for url in invalid_urls:
             self.assertRaises(InvenioConnectorServerError,
                               InvenioConnector, url)
+
+    def test_pooled_session(self):
+        """InvenioConnector - requests go through the pooled session"""
+        session = FakeSession(FakeResponse(MARCXML))
+        server = InvenioConnector(CFG_SITE_URL, session=session, timeout=5)
+        records = server.search(p='higgs')
+        self.assertEqual(['Higgs', 'Bosons'],
+                         [record['245__a'][0] for record in records])
+        self.assertEqual(['HEAD', 'GET'],
+                         [method for method, _, _ in session.requests])
+        self.assertEqual(5, session.requests[1][2]['timeout'])
+
+    def test_shared_session(self):
+        """InvenioConnector - connectors can share a session per host"""
+        session = get_shared_session('http://Invenio.example.org/search')
+        self.assertTrue(session is get_shared_session(CFG_SITE_URL))
+        self.assertFalse(
+            session is get_shared_session('https://invenio.example.org'))
+
+        class Headers(object):
+            def get_all(self, name, default=()):
+                return ['session=alice; path=/'] if name == 'Set-Cookie' \
+                    else list(default)
+            getheaders = get_all
+
+        class Login(object):
+            _original_response = type('Response', (), {'msg': Headers()})
+
+        request = requests.Request('GET', CFG_SITE_URL).prepare()
+        extract_cookies_to_jar(session.cookies, request, Login())
+        self.assertEqual(0, len(session.cookies))
+        jar = requests.Session().cookies
+        extract_cookies_to_jar(jar, request, Login())
+        self.assertEqual('alice', jar['session'])
+
+    def test_iter_search(self):
+        """InvenioConnector - records are streamed while parsing"""
+        server = InvenioConnector(CFG_SITE_URL,
+                                  session=FakeSession(FakeResponse(MARCXML)))
+        consumed = []
+
+        def chunks():
+            for start in range(0, len(MARCXML), 64):
+                consumed.append(start)
+                yield MARCXML[start:start + 64]
+
+        records = server._iter_parse_results(chunks())
+        first = next(records)
+        self.assertEqual(1, first.recid)
+        self.assertEqual(['CERN'], first['100__u'])
+        self.assertTrue(len(consumed) < len(MARCXML) // 64)
+        self.assertEqual([2], [record.recid for record in records])
+
+        records = list(server.iter_search(p='higgs', chunk_size=16))
+        self.assertEqual([1, 2], [record.recid for record in records])
+        self.assertEqual({}, server.cached_records)
+
+    def test_paginated_search(self):
+        """InvenioConnector - all pages of results are walked"""
+        session = FakeSession(FakeResponse(make_marcxml([1, 2], total=5)),
+                              FakeResponse(make_marcxml([3, 4], total=5)),
+                              FakeResponse(make_marcxml([5], total=5)))
+        server = InvenioConnector(CFG_SITE_URL, session=session)
+        results = server.paginated_search(p='ellis', rg=2)
+        self.assertEqual(5, results.total)
+        self.assertEqual([1, 2, 3, 4, 5],
+                         [record.recid for record in results])
+        self.assertEqual([1, 3, 5], [kwargs['params']['jrec']
+                                     for _, _, kwargs in session.requests[1:]])
+
+    def test_paginated_search_without_total(self):
+        """InvenioConnector - pages are walked until a short page"""
+        session = FakeSession(FakeResponse(make_marcxml([1, 2])),
+                              FakeResponse(make_marcxml([3])))
+        server = InvenioConnector(CFG_SITE_URL, session=session)
+        results = server.paginated_search(p='ellis', rg=2)
+        self.assertEqual(None, results.total)
+        self.assertEqual([1, 2, 3], [record.recid for record in results])
+
+    def test_paginated_search_capped(self):
+        """InvenioConnector - pages capped by the server are all walked"""
+        class CappedSession(FakeSession):
+
+            def request(self, method, url, **kwargs):
+                self.requests.append((method, url, kwargs))
+                if method == 'HEAD':
+                    return FakeResponse()
+                jrec = kwargs['params']['jrec']
+                return FakeResponse(make_marcxml(
+                    range(jrec, min(jrec + 2, 8)), total=7))
+
+        server = InvenioConnector(CFG_SITE_URL, session=CappedSession())
+        for prefetch in (0, 2):
+            results = server.paginated_search(p='ellis', rg=3,
+                                              prefetch=prefetch)
+            self.assertEqual(2, results.rg)
+            self.assertEqual(list(range(1, 8)),
+                             [record.recid for record in results])
+
+    def test_paginated_search_prefetch(self):
+        """InvenioConnector - pages are prefetched in order"""
+        pages = dict((jrec, make_marcxml(range(jrec, min(jrec + 2, 8)),
+                                         total=7))
+                     for jrec in (1, 3, 5, 7))
+
+        class PageSession(FakeSession):
+
+            def request(self, method, url, **kwargs):
+                self.requests.append((method, url, kwargs))
+                if method == 'HEAD':
+                    return FakeResponse()
+                return FakeResponse(pages[kwargs['params']['jrec']])
+
+        server = InvenioConnector(CFG_SITE_URL, session=PageSession())
+        results = server.paginated_search(p='ellis', rg=2, prefetch=2,
+                                          max_workers=2)
+        self.assertEqual(7, results.total)
+        self.assertEqual(list(range(1, 8)),
+                         [record.recid for record in results])
+
+    def test_get_records(self):
+        """InvenioConnector - records are fetched in batches"""
+        merged = FakeResponse(url=CFG_SITE_URL + '/record/12')
+        merged.history = [FakeResponse(status_code=301)]
+        session = FakeSession(FakeResponse(make_marcxml([1, 3, 4, 5])),
+                              FakeResponse(make_marcxml([]),
+                                           status_code=404),
+                              merged)
+        server = InvenioConnector(CFG_SITE_URL, session=session)
+        server.cached_records[2] = cached = make_marcxml([2])
+        records = server.get_records([3, 1, 2, 5, 4, 8, 9], max_workers=1)
+        self.assertEqual([3, 1], [record.recid for record in records[:2]])
+        self.assertTrue(records[2] is cached)
+        self.assertEqual([5, 4], [record.recid for record in records[3:5]])
+        self.assertEqual([MissingRecord(8), MergedRecord(9, 12)],
+                         records[5:])
+        self.assertEqual('recid:1 or recid:3->5 or recid:8->9',
+                         session.requests[1][2]['params']['p'])
+        self.assertTrue(server.cached_records[4] is records[4])
+
+    def test_get_records_refresh(self):
+        """InvenioConnector - fetched records replace the cached ones"""
+        updated = MARCXML.replace(b'Higgs', b'New')
+        session = FakeSession(FakeResponse(MARCXML), FakeResponse(updated),
+                              FakeResponse(updated))
+        server = InvenioConnector(CFG_SITE_URL, session=session)
+        self.assertEqual(['Higgs'], server.get_records([1])[0]['245__a'])
+        self.assertEqual(['New'], server.get_records(
+            [1], read_cache=False)[0]['245__a'])
+        self.assertEqual(['New'], server.cached_records[1]['245__a'])
+        record = server._resolve_record(1, replace=True)
+        self.assertTrue(server.cached_records[1] is record)
+
+    def test_get_record_cache(self):
+        """InvenioConnector - records are cached by recid"""
+        session = FakeSession(FakeResponse(make_marcxml([5])),
+                              FakeResponse(make_marcxml([6])))
+        server = InvenioConnector(CFG_SITE_URL, session=session)
+        self.assertEqual(5, server.get_record(5).recid)
+        self.assertEqual(6, server.get_record(6).recid)
+        self.assertTrue(server.get_record(5) is server.cached_records[5])
+        self.assertEqual(3, len(session.requests))
+        server.invalidate_record(5)
+        self.assertFalse(5 in server.cached_records)
+
+    def test_revalidation(self):
+        """InvenioConnector - cached results are revalidated"""
+        etag = {'ETag': '"v1"', 'Last-Modified': 'Wed, 10 Dec 2014 10:00:00'}
+        session = FakeSession(FakeResponse(MARCXML, headers=etag),
+                              FakeResponse(status_code=304),
+                              FakeResponse(make_marcxml([1, 3])))
+        server = InvenioConnector(CFG_SITE_URL, session=session)
+        records = server.search(p='higgs')
+        self.assertTrue(records is server.search(p='higgs', read_cache=False))
+        self.assertEqual({'If-None-Match': '"v1"',
+                          'If-Modified-Since': 'Wed, 10 Dec 2014 10:00:00'},
+                         session.requests[2][2]['headers'])
+        records = server.search(p='higgs', read_cache=False)
+        self.assertEqual([1, 3], [record.recid for record in records])
+        self.assertEqual(['Title 1', 'Title 3'],
+                         [record['245__a'][0] for record in records])
+        self.assertTrue(server.cached_records[1] is records[0])
+
+        server.session = FakeSession(FakeResponse(make_marcxml([1])))
+        server.cached_records[1]['245__a'] = 'Outdated'
+        self.assertEqual(['Title 1'],
+                         server.get_record(1, read_cache=False)['245__a'])
+        self.assertEqual(['Title 1'], server.get_record(1)['245__a'])
+
+    def test_revalidation_005(self):
+        """InvenioConnector - records are revalidated using their 005"""
+        server = InvenioConnector(CFG_SITE_URL,
+                                  session=FakeSession(FakeResponse(
+                                      status_code=304)))
+        record = server._parse_results(BytesIO(MARCXML.replace(
+            b'<controlfield tag="001">1</controlfield>',
+            b'<controlfield tag="001">7</controlfield>'
+            b'<controlfield tag="005">20141210101530.0</controlfield>')),
+            server.cached_records)[0]
+        self.assertTrue(record is server.get_record(7, read_cache=False))
+        self.assertEqual({'If-Modified-Since':
+                          'Wed, 10 Dec 2014 10:15:30 GMT'},
+                         server.session.requests[1][2]['headers'])
+
+    def test_compact_records(self):
+        """InvenioConnector - compact records behave like records"""
+        server = InvenioConnector(CFG_SITE_URL, session=FakeSession(
+            FakeResponse(MARCXML)), compact_records=True)
+        compact = server.search(p='higgs')
+        records = server._parse_results(BytesIO(MARCXML), {})
+        self.assertTrue(isinstance(compact[0], CompactRecord))
+        for code in ('001', '100__', '100__a', '100__u', '245__a'):
+            self.assertEqual(records[0][code], compact[0][code])
+        self.assertRaises(KeyError, compact[0].__getitem__, '700__a')
+        self.assertEqual([], compact[1]['245__u'])
+        self.assertTrue('245__' in compact[1])
+        self.assertFalse('100__' in compact[1])
+        self.assertEqual(records, [record.as_record() for record in compact])
+        self.assertEqual(records[1], compact[1])
+        self.assertTrue(compact[0]._keys[-1] is compact[1]._keys[-1])
+        # The fields are measured for the size limit of the cache.
+        self.assertTrue(approximate_size(compact[0]) >
+                        approximate_size(records[0]) / 2)
+
+    def test_pooled_values(self):
+        """InvenioConnector - repeated keys and values are shared"""
+        server = InvenioConnector(CFG_SITE_URL, session=FakeSession(),
+                                  intern_values=['100__u'])
+        first = server._parse_results(BytesIO(MARCXML), {})[0]
+        second = server._parse_results(BytesIO(MARCXML), {})[0]
+        self.assertFalse(first is second)
+        self.assertTrue(first['100__u'][0] is second['100__u'][0])
+        self.assertFalse(first['100__a'][0] is second['100__a'][0])
+        self.assertTrue(list(first['100__'][0])[0] is
+                        list(second['100__'][0])[0])
+        self.assertEqual(['CERN'], list(server.value_pool))
+
+    def test_parallel_parse(self):
+        """InvenioConnector - MARCXML is parsed in parallel in order"""
+        marcxml = make_marcxml(range(1, 200), total=1000)
+        expected = InvenioConnector(
+            CFG_SITE_URL, session=FakeSession()).parse_marcxml(marcxml)
+        with InvenioConnector(CFG_SITE_URL, session=FakeSession(
+                FakeResponse(marcxml)), parse_processes=2) as server:
+            cached = server.parse_marcxml(MARCXML)[0]
+            records = server.parse_marcxml(BytesIO(marcxml), chunk_size=500)
+            self.assertEqual(expected[2:], records[2:])
+            self.assertEqual(expected[-1].export(), records[-1].export())
+            self.assertEqual(list(range(1, 200)),
+                             [record.recid for record in records])
+            self.assertTrue(records[0] is cached)
+            self.assertTrue(server.cached_records[199] is records[-1])
+            records, total = server._search_page({'p': 'higgs'}, 1, 200)
+            self.assertEqual(1000, total)
+            self.assertEqual(expected, records)
+
+    def test_pickle_record(self):
+        """InvenioConnector - records keep their fields through pickling"""
+        server = InvenioConnector(CFG_SITE_URL, session=FakeSession(),
+                                  keep_marcxml=True)
+        record = server.parse_marcxml(MARCXML)[0]
+        copy = pickle.loads(pickle.dumps(record, 2))
+        self.assertEqual(dict(record), dict(copy))
+        self.assertEqual(record['100__a'], copy['100__a'])
+        self.assertEqual(1, copy.recid)
+        self.assertEqual(record.export(), copy.export())
+        self.assertEqual(None, copy.marcxml_span)
+        marcxml = make_marcxml(range(1, 1000))
+        records = server.parse_marcxml(marcxml)
+        self.assertTrue(len(pickle.dumps(records[0], 2)) < 1000)
+        compact = InvenioConnector(
+            CFG_SITE_URL, session=FakeSession(), keep_marcxml=True,
+            compact_records=True).parse_marcxml(marcxml)[1]
+        self.assertTrue(len(pickle.dumps(compact, 2)) < 1000)
+        self.assertEqual(compact.export(),
+                         pickle.loads(pickle.dumps(compact, 2)).export())
+
+    def test_fields(self):
+        """InvenioConnector - only the requested fields are parsed"""
+        session = FakeSession(FakeResponse(MARCXML), FakeResponse(MARCXML))
+        server = InvenioConnector(CFG_SITE_URL, session=session)
+        records = server.search(p='higgs', fields=['245', '100__u'])
+        params = session.requests[-1][2]['params']
+        self.assertEqual('001,100,245', params['ot'])
+        self.assertEqual({'001__': ['1'], '100__': [{'u': ['CERN']}],
+                          '245__': [{'a': ['Higgs']}]}, dict(records[0]))
+        self.assertEqual(1, records[0].recid)
+        self.assertEqual(0, len(server.cached_records))
+        records = list(server.iter_search(p='higgs', fields=['001']))
+        self.assertEqual([{'001__': ['1']}, {'001__': ['2']}],
+                         [dict(record) for record in records])
+        self.assertEqual(records, server._parse_results(
+            BytesIO(MARCXML), None, fields=['001']))
+
+    def test_export(self):
+        """InvenioConnector - records export their original MARCXML"""
+        original = MARCXML[MARCXML.index(b'<record>'):
+                           MARCXML.index(b'</record>') + 9].decode('utf-8')
+        for backend in ('sax', 'expat'):
+            server = InvenioConnector(CFG_SITE_URL, session=FakeSession(
+                FakeResponse(MARCXML)), parser=backend, keep_marcxml=True)
+            record = server.search(p='higgs')[0]
+            self.assertEqual(original, record.export())
+            self.assertEqual(original, record.marcxml)
+            self.assertEqual(original, CompactRecord.from_record(
+                record).export())
+            record['245__a'] = 'Higgs boson'
+            self.assertTrue('Higgs boson' in record.export())
+        # By default only spooled responses are retained.
+        record = InvenioConnector(CFG_SITE_URL, session=FakeSession(
+            FakeResponse(MARCXML))).search(p='higgs')[0]
+        self.assertEqual(None, record.marcxml_span)
+        server = InvenioConnector(CFG_SITE_URL, session=FakeSession(
+            FakeResponse(MARCXML)), keep_marcxml=False)
+        record = server.search(p='higgs')[0]
+        self.assertEqual(record, server._parse_results(
+            BytesIO(record.export().encode('utf-8')), None)[0])
+
+    def test_parser_backends(self):
+        """InvenioConnector - searches work with every parser backend"""
+        marcxml = make_marcxml(range(1, 50), total=49)
+        for backend in PARSERS:
+            for keep_marcxml in (True, False):
+                server = InvenioConnector(
+                    CFG_SITE_URL, session=FakeSession(FakeResponse(marcxml)),
+                    parser=backend, keep_marcxml=keep_marcxml)
+                records = server.search(p='title')
+                self.assertEqual(list(range(1, 50)),
+                                 [record.recid for record in records])
+                self.assertEqual('Title 7', records[6]['245__a'][0])
+                self.assertTrue(u'Title 7' in records[6].export())
+
+    def test_wire_format(self):
+        """InvenioConnector - records are downloaded in the cheapest format"""
+        url = 'http://textmarc.example.org'
+        options = dict(wire_formats=('tm', 'xm'), keep_marcxml=False)
+        session = FakeSession(FakeResponse(MARCXML), FakeResponse(TEXTMARC),
+                              FakeResponse(TEXTMARC))
+        server = InvenioConnector(url, session=session, **options)
+        self.assertEqual(server._parse_results(BytesIO(MARCXML), {}),
+                         server.search(p='higgs'))
+        self.assertEqual(['xm', 'tm', 'tm'],
+                         [kwargs['params']['of'] for method, _, kwargs
+                          in session.requests if method == 'GET'])
+        session = FakeSession(FakeResponse(TEXTMARC))
+        server = InvenioConnector(url, session=session, **options)
+        self.assertEqual(2, len(server.search(p='higgs')))
+        self.assertEqual(2, len(session.requests))
+        # The MARCXML is still used where the format matters.
+        self.assertEqual(b'', server.search(p='higgs', of='xm'))
+        self.assertEqual('xm', session.requests[-1][2]['params']['of'])
+
+        session = FakeSession(FakeResponse(MARCXML), FakeResponse(b'<html>'),
+                              FakeResponse(MARCXML))
+        server = InvenioConnector('http://xm.example.org', session=session,
+                                  **options)
+        self.assertEqual(2, len(server.search(p='higgs')))
+        self.assertEqual('xm', session.requests[-1][2]['params']['of'])
+
+        # Negotiation is opt-in, and MARCXML-only features disable it.
+        for options in ({}, dict(options, spool=True),
+                        dict(options, keep_marcxml=True)):
+            session = FakeSession(FakeResponse(MARCXML))
+            server = InvenioConnector(url, session=session, **options)
+            self.assertEqual(2, len(server.search(p='higgs')))
+            self.assertEqual(['HEAD', 'GET'],
+                             [method for method, _, _ in session.requests])
+            self.assertEqual('xm', session.requests[-1][2]['params']['of'])
+
+    def test_upload_records(self):
+        """InvenioConnector - records are uploaded in streamed batches"""
+        records = InvenioConnector(CFG_SITE_URL, session=FakeSession(
+            FakeResponse(make_marcxml(range(1, 11))))).search(p='')
+        chunk = MARCXML.decode('utf-8')
+        session = FakeSession(FakeResponse(b'[INFO] ok'),
+                              FakeResponse(b'[ERROR] failed'),
+                              FakeResponse(status_code=500))
+        server = InvenioConnector(CFG_SITE_URL, session=session)
+        batches = server.upload_records(records + [chunk], '-ir',
+                                        max_records=4, max_workers=1)
+        self.assertEqual([0, 1, 2], [batch.index for batch in batches])
+        self.assertEqual([4, 4, 4], [batch.count for batch in batches])
+        self.assertEqual([True, False, False],
+                         [batch.ok for batch in batches])
+        self.assertEqual(None, batches[0].parts)
+        self.assertEqual('[ERROR] failed', batches[1].message)
+        self.assertEqual(500, batches[2].status_code)
+
+        bodies = [kwargs['data'] for method, _, kwargs in session.requests
+                  if method == 'POST']
+        body = bodies[1].read(20) + bodies[1].read()
+        self.assertEqual(len(bodies[1]), len(body))
+        self.assertEqual(body, b''.join(bodies[1]))
+        self.assertTrue(b'name="mode"\r\n\r\n-ir\r\n' in body)
+        self.assertTrue(b'<controlfield tag="001">5</controlfield>' in body)
+        self.assertTrue(b'</record>\n</collection>' in body)
+        self.assertEqual(1, body.count(b'<collection'))
+        self.assertTrue(session.requests[-1][2]['headers'][
+            'Content-Type'].startswith('multipart/form-data; boundary='))
+
+        self.assertEqual(11, len(list(_pack_upload_batches(
+            records + [chunk], batch_size=1))))
+        retried = server.upload_batches(batches[1:], '-ir', max_workers=3)
+        self.assertEqual([True, True], [batch.ok for batch in retried])
+        self.assertRaises(NameError, server.upload_batches, batches, '-x')
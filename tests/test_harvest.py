@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio-Client.
+# Copyright (C) 2014 CERN.
+#
+# Invenio-Client is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio-Client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this licence, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Unit tests for the harvesting helpers."""
+
+import os
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+from invenio_client import InvenioConnector
+from invenio_client.harvest import HarvestJob, Journal, UploadJob, \
+    WatermarkStore
+
+from test_connector import CFG_SITE_URL, FakeResponse, FakeSession, \
+    make_marcxml
+
+MODIFIED = b"""<collection>
+<record>
+  <controlfield tag="001">%d</controlfield>
+  <controlfield tag="005">%s</controlfield>
+</record>
+</collection>
+"""
+
+
+class TestHarvest(TestCase):
+
+    """Test incremental harvesting."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = WatermarkStore(os.path.join(self.tmpdir, 'wm.json'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_watermark_store(self):
+        """WatermarkStore - watermarks are persisted"""
+        self.assertEqual(None, self.store.get('a'))
+        self.store.set('a', '2014-12-10 10:00:00')
+        self.store.set('b', '2014-12-11 10:00:00')
+        store = WatermarkStore(self.store.path)
+        self.assertEqual('2014-12-10 10:00:00', store.get('a'))
+        self.assertEqual(['wm.json'], os.listdir(self.tmpdir))
+
+    def test_sync(self):
+        """InvenioConnector - only modified records are fetched"""
+        session = FakeSession(
+            FakeResponse(MODIFIED % (1, b'20141210101530.0')),
+            FakeResponse(MODIFIED % (2, b'20141211080000.0')))
+        server = InvenioConnector(CFG_SITE_URL, session=session)
+        self.assertEqual([1], [record.recid for record in
+                               server.sync(self.store, key='k', c='Books')])
+        self.assertEqual('2014-12-10 10:15:30', self.store.get('k'))
+        self.assertFalse('d1' in session.requests[1][2]['params'])
+
+        server.cached_records[2] = 'outdated'
+        records = server.sync(self.store, key='k', c='Books')
+        self.assertTrue(server.cached_records[2] is records[0])
+        self.assertEqual('2014-12-11 08:00:00', self.store.get('k'))
+        params = session.requests[2][2]['params']
+        self.assertEqual(('m', '2014-12-10 10:15:30', 'Books'),
+                         (params['dt'], params['d1'], params['c']))
+
+
+class PageSession(FakeSession):
+
+    """Answer every search with the page starting at the requested jrec."""
+
+    def __init__(self, pages):
+        super(PageSession, self).__init__()
+        self.pages = pages
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        if method == 'HEAD':
+            return FakeResponse()
+        return FakeResponse(self.pages[kwargs['params']['jrec']])
+
+
+class TestJobs(TestCase):
+
+    """Test the resumable jobs."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = WatermarkStore(os.path.join(self.tmpdir, 'wm.json'))
+        self.path = os.path.join(self.tmpdir, 'job.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_journal(self):
+        """Journal - a truncated last entry is ignored and dropped"""
+        journal = Journal(self.path)
+        self.assertEqual([], journal.entries())
+        journal.append(jrec=1)
+        with open(self.path, 'ab') as stream:
+            stream.write(b'{"jrec": 1')
+        self.assertEqual([{'jrec': 1}], journal.entries())
+        Journal(self.path).append(jrec=11, done=True)
+        self.assertEqual([{'jrec': 1}, {'jrec': 11, 'done': True}],
+                         journal.entries())
+
+    def test_harvest_job(self):
+        """HarvestJob - an interrupted harvest is resumed"""
+        total = b'<!-- Search-Engine-Total-Number-Of-Results: 3 -->\n'
+        session = PageSession({
+            1: total + MODIFIED % (1, b'20141210101530.0'),
+            2: total + MODIFIED % (2, b'20141212080000.0'),
+            3: total + MODIFIED % (3, b'20141211080000.0')})
+        server = InvenioConnector(CFG_SITE_URL, session=session)
+        processed = []
+        crash = [True]
+
+        def process(records):
+            recids = [record.recid for record in records]
+            if recids == [2] and crash:
+                raise RuntimeError("crash")
+            processed.extend(recids)
+
+        def job():
+            return HarvestJob(server, self.path, rg=1, store=self.store,
+                              key='k', c='Books')
+
+        self.assertRaises(RuntimeError, job().run, process)
+        self.assertEqual([1], processed)
+        self.assertEqual(None, self.store.get('k'))
+
+        del crash[:]
+        self.assertEqual(2, job().run(process))
+        self.assertEqual([1, 2, 3], processed)
+        self.assertEqual([2, 2, 3], [kwargs['params']['jrec'] for method, _,
+                                     kwargs in session.requests
+                                     if method == 'GET'][1:])
+        self.assertEqual('2014-12-12 08:00:00', self.store.get('k'))
+        self.assertEqual(0, job().run(process))
+
+        self.assertRaises(ValueError, HarvestJob, server, self.path, rg=2,
+                          store=self.store, key='k', c='Books')
+        next_job = HarvestJob(server, self.path + '2', rg=1,
+                              store=self.store, key='k', c='Books')
+        self.assertEqual('2014-12-12 08:00:00', next_job.since)
+
+    def test_harvest_job_capped(self):
+        """HarvestJob - pages capped by the server are not skipped"""
+        session = PageSession(dict(
+            (jrec, make_marcxml(range(jrec, min(jrec + 2, 8)), total=7))
+            for jrec in (1, 3, 5, 7)))
+        server = InvenioConnector(CFG_SITE_URL, session=session)
+        processed = []
+        job = HarvestJob(server, self.path, rg=3, c='Books')
+        self.assertEqual(7, job.run(
+            lambda records: processed.extend(record.recid
+                                             for record in records)))
+        self.assertEqual(list(range(1, 8)), processed)
+        self.assertEqual(9, job.jrec)
+
+    def test_upload_job(self):
+        """UploadJob - uploaded batches are not sent again"""
+        records = InvenioConnector(CFG_SITE_URL, session=FakeSession(
+            FakeResponse(make_marcxml(range(1, 11))))).search(p='')
+        session = FakeSession(FakeResponse(b'[INFO] ok'),
+                              FakeResponse(b'[ERROR] failed'),
+                              FakeResponse(b'[INFO] ok'))
+        server = InvenioConnector(CFG_SITE_URL, session=session)
+        job = UploadJob(server, self.path, '-ir', max_records=4,
+                        max_workers=1)
+        self.assertEqual([True, False, True],
+                         [batch.ok for batch in job.run(records)])
+
+        job = UploadJob(server, self.path, '-ir', max_records=4)
+        self.assertEqual(set([0, 2]), job.uploaded)
+        self.assertEqual([1], [batch.index for batch in job.run(records)])
+        posts = [kwargs['data'] for method, _, kwargs in session.requests
+                 if method == 'POST']
+        self.assertEqual(4, len(posts))
+        body = b''.join(posts[-1])
+        self.assertTrue(b'<controlfield tag="001">5</controlfield>' in body)
+        self.assertFalse(b'<controlfield tag="001">1</controlfield>' in body)
+        self.assertEqual([], job.run(records))
+        self.assertRaises(ValueError, UploadJob, server, self.path, '-r')
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio-Client.
+# Copyright (C) 2014 CERN.
+#
+# Invenio-Client is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio-Client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this licence, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Conformance tests of the MARCXML parser backends."""
+
+from io import BytesIO
+from unittest import TestCase
+
+from invenio_client.connector import RecordsHandler
+from invenio_client.parsers import PARSERS, make_parser
+
+from test_connector import MARCXML, TEXTMARC, make_marcxml
+
+CORPUS = [
+    MARCXML,
+    make_marcxml(range(1, 50), total=1000),
+    # Repeated fields, indicators, entities, CDATA and non-ASCII text.
+    u"""<?xml version="1.0" encoding="UTF-8"?>
+<collection xmlns="http://www.loc.gov/MARC21/slim">
+<record>
+  <controlfield tag="001">10</controlfield>
+  <controlfield tag="005">20141210101530.0</controlfield>
+  <datafield tag="100" ind1=" " ind2=" ">
+    <subfield code="a">Müller, K &amp; Co</subfield>
+    <subfield code="u">CERN</subfield>
+    <subfield code="u">DESY</subfield>
+  </datafield>
+  <datafield tag="700" ind1=" " ind2=" ">
+    <subfield code="a"><![CDATA[<Smith>, J]]></subfield>
+  </datafield>
+  <datafield tag="700" ind1=" " ind2=" ">
+    <subfield code="a">Dupont, É</subfield>
+    <subfield code="e"/>
+  </datafield>
+  <datafield tag="650" ind1="1" ind2="7">
+    <subfield code="a">Particle Physics - Experiment</subfield>
+  </datafield>
+</record>
+<record>
+  <datafield tag="245" ind1=" " ind2=" ">
+    <subfield code="a">A record without recid is skipped</subfield>
+  </datafield>
+</record>
+</collection>
+""".encode('utf-8'),
+    # A long subfield split over many chunks.
+    (u'<collection><record><controlfield tag="001">11</controlfield>'
+     u'<datafield tag="520" ind1=" " ind2=" "><subfield code="a">%s'
+     u'</subfield></datafield></record></collection>'
+     % (u'x' * 200000, )).encode('utf-8'),
+]
+
+
+def parse(document, backend, chunk_size=None):
+    """Parse ``document`` and return the records and the total count."""
+    handler = RecordsHandler({})
+    if backend == 'tm':
+        parser = make_parser(handler, of='tm')
+    else:
+        parser = make_parser(handler, backend)
+    if chunk_size is None:
+        parser.parse(BytesIO(document))
+    else:
+        for start in range(0, len(document), chunk_size):
+            parser.feed(document[start:start + chunk_size])
+        parser.close()
+    return [(record.recid, dict(record)) for record in handler.records], \
+        handler.counts
+
+
+class TestParsers(TestCase):
+
+    """Test that all the parser backends produce the same records."""
+
+    def test_conformance(self):
+        """Parsers - all the backends produce identical records"""
+        for document in CORPUS:
+            expected = parse(document, 'sax')
+            self.assertTrue(expected[0])
+            for backend in PARSERS:
+                self.assertEqual(expected, parse(document, backend))
+                self.assertEqual(expected, parse(document, backend, 7))
+
+    def test_text_marc(self):
+        """Parsers - text MARC gives the same records as MARCXML"""
+        self.assertEqual(parse(MARCXML, 'sax'), (parse(TEXTMARC, 'tm')[0], 2))
+        self.assertEqual(parse(MARCXML, 'sax')[0],
+                         parse(TEXTMARC, 'tm', 5)[0])
+        records = parse(b'000000003 001__ 3\n'
+                        b'000000003 520__ $$aFirst line\nsecond line\n'
+                        b'000000003 65017 $$aPhysics', 'tm')[0]
+        self.assertEqual([(3, {'001__': ['3'],
+                               '520__': [{'a': ['First line\nsecond line']}],
+                               '65017': [{'a': ['Physics']}]})], records)
+
+    def test_unknown_backend(self):
+        """Parsers - unknown backends are rejected"""
+        self.assertRaises(ValueError, make_parser, RecordsHandler({}),
+                          'unknown')
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio-Client.
+# Copyright (C) 2014 CERN.
+#
+# Invenio-Client is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio-Client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this licence, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Test the recid sets."""
+
+import pickle
+
+from random import Random
+from unittest import TestCase
+
+from invenio_client import InvenioConnector
+from invenio_client.cache import approximate_size
+from invenio_client.recids import RecidSet
+
+from test_connector import CFG_SITE_URL, FakeResponse, FakeSession
+
+
+class TestRecidSet(TestCase):
+
+    """Test the compact recid sets."""
+
+    def test_parse(self):
+        """RecidSet - id lists are parsed incrementally"""
+        body = b'[' + b', '.join(str(recid).encode('ascii') for recid in
+                                 range(1500, 0, -3)) + b']'
+        expected = list(range(3, 1501, 3))
+        for size in (1, 7, len(body)):
+            chunks = [body[i:i + size] for i in range(0, len(body), size)]
+            self.assertEqual(expected, RecidSet.parse(chunks).tolist())
+        self.assertEqual(RecidSet(), RecidSet.parse([b'[]']))
+        self.assertRaises(ValueError, RecidSet.parse, [b'<html>'])
+
+    def test_algebra(self):
+        """RecidSet - recid sets are combined like sets"""
+        odd = RecidSet(range(1, 20, 2))
+        small = RecidSet([5, 1, 3, 3, 2, 4])
+        self.assertEqual([1, 2, 3, 4, 5], small.tolist())
+        self.assertEqual([1, 3, 5], (odd & small).tolist())
+        self.assertEqual([1, 2, 3, 4, 5, 7, 9], (small | odd[:5]).tolist())
+        self.assertEqual([2, 4], (small - odd).tolist())
+        self.assertEqual([2, 4, 7, 9], (small ^ odd[:5]).tolist())
+        self.assertEqual([3], small.intersection(odd, [3, 6]).tolist())
+        self.assertTrue(RecidSet([1, 3]) <= small)
+        self.assertFalse(small <= odd)
+        self.assertTrue(3 in small)
+        self.assertFalse(6 in small)
+        self.assertEqual([3, 5, 7], odd.range(3, 9).tolist())
+        self.assertEqual(19, odd[-1])
+        self.assertEqual(odd, pickle.loads(pickle.dumps(odd)))
+        self.assertFalse(RecidSet())
+        self.assertEqual([1, 2, 3], RecidSet([3, 3, 2, 1, 1]).tolist())
+        self.assertEqual([], (small - small).tolist())
+        self.assertEqual([], (small ^ small).tolist())
+        self.assertEqual([1, 2, 3, 4, 5, 6], small.union([6, 6]).tolist())
+        self.assertTrue(approximate_size(RecidSet(range(1000))) >= 4000)
+
+    def test_algebra_sizes(self):
+        """RecidSet - the algebra matches sets of any relative sizes"""
+        random = Random(42)
+        samples = [set(random.sample(range(1, 2000), size))
+                   for size in (0, 3, 50, 900)]
+        for first in samples:
+            for second in samples:
+                recids = RecidSet(first), RecidSet(second)
+                for operator in ('__or__', '__and__', '__sub__', '__xor__'):
+                    self.assertEqual(
+                        sorted(getattr(first, operator)(second)),
+                        getattr(recids[0], operator)(recids[1]).tolist())
+                self.assertEqual(first <= second, recids[0] <= recids[1])
+
+    def test_ranked(self):
+        """RecidSet - the ranking of the server is kept"""
+        ranked = RecidSet.parse([b'[5, 9, 1, 7]'])
+        self.assertEqual([1, 5, 7, 9], ranked.tolist())
+        self.assertEqual([5, 9, 1, 7], ranked.ranked())
+        self.assertEqual([1, 5, 7, 9], (ranked | [5]).ranked())
+        latest = RecidSet.parse([b'[9, 7, 5, 1]'])
+        self.assertEqual([1, 5, 7, 9], latest.ranked())
+        self.assertTrue(latest._ranking is None)
+
+    def test_connector(self):
+        """RecidSet - id searches return recid sets"""
+        server = InvenioConnector(CFG_SITE_URL, session=FakeSession(
+            FakeResponse(b'[3, 2, 1]'), FakeResponse(b'<html>')))
+        self.assertEqual(RecidSet([1, 2, 3]), server.search(p='', of='id'))
+        self.assertEqual(RecidSet(), server.search(p='x', of='id'))
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio-Client.
+# Copyright (C) 2014 CERN.
+#
+# Invenio-Client is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio-Client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this licence, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Test the retry policy of the requests."""
+
+from email.utils import formatdate
+from unittest import TestCase
+
+from requests.exceptions import ConnectionError, ConnectTimeout, \
+    InvalidURL, ReadTimeout
+from requests.packages.urllib3.exceptions import MaxRetryError, \
+    NewConnectionError
+
+from invenio_client import InvenioConnector
+from invenio_client.retry import RetryPolicy
+
+from test_connector import CFG_SITE_URL, MARCXML, FakeResponse, FakeSession
+
+
+def refused():
+    """Return the error raised by requests when a connection is refused."""
+    return ConnectionError(MaxRetryError(
+        None, CFG_SITE_URL, NewConnectionError(None, "refused")))
+
+
+class Sender(object):
+
+    """Return (or raise) the given outcomes of successive attempts."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.attempts = 0
+
+    def __call__(self):
+        self.attempts += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+class TestRetryPolicy(TestCase):
+
+    """Test when and how requests are retried."""
+
+    def test_retry_statuses(self):
+        """RetryPolicy - transient errors of idempotent requests"""
+        policy = RetryPolicy(backoff=0)
+        send = Sender(FakeResponse(status_code=503),
+                      ConnectionError("reset"), ReadTimeout("slow"),
+                      FakeResponse(b"ok"))
+        self.assertEqual(b"ok", policy.call('get', send).content)
+        self.assertEqual(4, send.attempts)
+
+        send = Sender(*[FakeResponse(status_code=500)] * 4)
+        self.assertEqual(500, policy.call('GET', send).status_code)
+        self.assertEqual(4, send.attempts)
+
+        send = Sender(FakeResponse(status_code=404))
+        self.assertEqual(404, policy.call('GET', send).status_code)
+        self.assertRaises(InvalidURL, policy.call, 'GET',
+                          Sender(InvalidURL("bad")))
+
+        stats = policy.stats()
+        self.assertEqual(4, stats['requests'])
+        self.assertEqual(6, stats['retries'])
+        self.assertEqual(1, stats['failures'])
+        self.assertEqual(0.0, stats['waited'])
+
+    def test_non_idempotent_methods(self):
+        """RetryPolicy - uploads are only retried if not sent"""
+        policy = RetryPolicy(backoff=0)
+        send = Sender(FakeResponse(status_code=503))
+        self.assertEqual(503, policy.call('POST', send).status_code)
+        self.assertRaises(ReadTimeout, policy.call, 'POST',
+                          Sender(ReadTimeout("slow")))
+        self.assertRaises(ConnectionError, policy.call, 'POST',
+                          Sender(ConnectionError("Connection aborted.")))
+        send = Sender(refused(), ConnectTimeout("slow"), FakeResponse(b"ok"))
+        self.assertEqual(b"ok", policy.call('POST', send).content)
+        send = Sender(ConnectionError("Connection aborted."),
+                      FakeResponse(b"ok"))
+        self.assertEqual(b"ok", RetryPolicy(backoff=0, methods=(
+            'GET', 'POST')).call('POST', send).content)
+
+    def test_retry_after(self):
+        """RetryPolicy - the Retry-After header is honored"""
+        policy = RetryPolicy(backoff=1000, max_backoff=10)
+        send = Sender(FakeResponse(status_code=429,
+                                   headers={'Retry-After': '0'}),
+                      FakeResponse(status_code=503, headers={
+                          'Retry-After': formatdate(usegmt=True)}),
+                      FakeResponse(b"ok"))
+        self.assertEqual(b"ok", policy.call('GET', send).content)
+        self.assertTrue(policy.stats()['waited'] < 2)
+
+        send = Sender(FakeResponse(status_code=429,
+                                   headers={'Retry-After': '3600'}))
+        self.assertEqual(429, policy.call('GET', send).status_code)
+        self.assertEqual(1, policy.stats()['failures'])
+
+    def test_budget(self):
+        """RetryPolicy - retries are limited by the budget"""
+        policy = RetryPolicy(backoff=0, budget=0.5, max_budget=1)
+        send = Sender(ConnectionError("reset"), FakeResponse(b"ok"))
+        self.assertEqual(b"ok", policy.call('GET', send).content)
+        self.assertRaises(ConnectionError, policy.call, 'GET',
+                          Sender(ConnectionError("reset")))
+        stats = policy.stats()
+        self.assertEqual(1, stats['budget_exhausted'])
+        self.assertEqual(0.5, stats['budget'])
+
+        policy = RetryPolicy(backoff=0, budget=None)
+        send = Sender(*[FakeResponse(status_code=502)] * 3 +
+                      [FakeResponse(b"ok")])
+        self.assertEqual(b"ok", policy.call('GET', send).content)
+
+    def test_connector(self):
+        """InvenioConnector - requests are retried with their body"""
+        session = FakeSession(FakeResponse(status_code=503),
+                              FakeResponse(MARCXML))
+        server = InvenioConnector(CFG_SITE_URL, session=session,
+                                  retry=RetryPolicy(backoff=0))
+        self.assertEqual(2, len(server.search(p='higgs')))
+        self.assertEqual(['HEAD', 'GET', 'GET'],
+                         [method for method, _, _ in session.requests])
+
+        class FailingSession(FakeSession):
+
+            def __init__(self, *errors):
+                super(FailingSession, self).__init__()
+                self.errors = list(errors)
+
+            def request(self, method, url, **kwargs):
+                if method == 'POST':
+                    body = kwargs['data']
+                    if hasattr(body, 'read'):
+                        body = body.read(10) + body.read()
+                    self.requests.append(body)
+                    if self.errors:
+                        raise self.errors.pop(0)
+                    return FakeResponse(b"[INFO] ok")
+                return FakeSession.request(self, method, url, **kwargs)
+
+        session = FailingSession(refused())
+        server = InvenioConnector(CFG_SITE_URL, session=session,
+                                  retry=RetryPolicy(backoff=0))
+        batch, = server.upload_records([MARCXML], '-ir')
+        self.assertTrue(batch.ok)
+        self.assertEqual(3, len(session.requests))
+        self.assertEqual(session.requests[1], session.requests[2])
+        self.assertTrue(session.requests[2].endswith(b'--\r\n'))
+
+        # The server may have received a request whose connection broke.
+        session = FailingSession(ConnectionError("Connection aborted."))
+        server = InvenioConnector(CFG_SITE_URL, session=session,
+                                  retry=RetryPolicy(backoff=0))
+        self.assertRaises(ConnectionError, server.upload_marcxml, MARCXML,
+                          '-i')
+        self.assertEqual(2, len(session.requests))
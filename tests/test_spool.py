@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio-Client.
+# Copyright (C) 2014 CERN.
+#
+# Invenio-Client is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio-Client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this licence, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Test the spooling of responses."""
+
+import os
+import shutil
+import tempfile
+
+from copy import deepcopy
+from unittest import TestCase
+
+from invenio_client import InvenioConnector
+from invenio_client.connector import CFG_MAX_SPOOLS
+from invenio_client.spool import BufferReader, Spool
+
+from test_connector import CFG_SITE_URL, FakeResponse, FakeSession, \
+    make_marcxml
+
+
+class TestSpool(TestCase):
+
+    """Test the memory-mapped spools."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'results.xml')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_spool(self):
+        """Spool - chunks are written to a mapped file"""
+        with Spool.from_chunks([b'<record>', b'</record>'],
+                               path=self.path) as spool:
+            self.assertEqual(b'<record></record>', spool.data[:])
+            self.assertEqual(17, len(spool))
+        self.assertTrue(os.path.exists(self.path))
+        spool = Spool.from_chunks([], directory=self.tmpdir)
+        self.assertEqual(0, len(spool))
+        spool.close()
+        self.assertEqual(['results.xml'], os.listdir(self.tmpdir))
+
+        def broken():
+            yield b'<record>'
+            raise IOError("connection reset")
+
+        for path in (None, os.path.join(self.tmpdir, 'broken.xml')):
+            self.assertRaises(IOError, Spool.from_chunks, broken(),
+                              path=path, directory=self.tmpdir)
+        self.assertEqual(['results.xml'], os.listdir(self.tmpdir))
+
+    def test_buffer_reader(self):
+        """Spool - buffers are read from an offset after a prefix"""
+        reader = BufferReader(b'0123456789', 6, b'ab')
+        self.assertEqual(b'ab6', reader.read(3))
+        self.assertEqual(b'789', reader.read())
+        self.assertEqual(b'', reader.read(3))
+
+    def test_spooled_search(self):
+        """Spool - spooled responses are parsed from the file"""
+        marcxml = make_marcxml(range(1, 20), total=19)
+        server = InvenioConnector(CFG_SITE_URL, session=FakeSession(
+            FakeResponse(marcxml)), spool=True, spool_dir=self.tmpdir)
+        records = server.search(p='higgs')
+        self.assertEqual(list(range(1, 20)), [r.recid for r in records])
+        self.assertTrue(isinstance(records[0]._marcxml[0], Spool))
+        self.assertTrue(records[3].export().startswith(
+            '<record><controlfield tag="001">4<'))
+        self.assertEqual([], os.listdir(self.tmpdir))
+        copy = deepcopy(records[3])
+        self.assertEqual(records[3].export(), copy.export())
+
+    def test_spool_limit(self):
+        """Spool - only the last spooled responses stay mapped"""
+        marcxml = make_marcxml([1, 2])
+        session = FakeSession(*[FakeResponse(marcxml)
+                                for dummy in range(CFG_MAX_SPOOLS + 1)])
+        server = InvenioConnector(CFG_SITE_URL, session=session, spool=True,
+                                  spool_dir=self.tmpdir)
+        results = [server.search(p='higgs', jrec=jrec)
+                   for jrec in range(CFG_MAX_SPOOLS + 1)]
+        self.assertEqual(None, results[0][0]._marcxml[0].data)
+        self.assertEqual(results[0][1].export(), results[-1][1].export())
+        self.assertEqual(CFG_MAX_SPOOLS, len(server._spools))
+        server.close()
+        self.assertEqual(None, results[-1][0]._marcxml[0].data)
+
+        server = InvenioConnector(CFG_SITE_URL, session=FakeSession(
+            FakeResponse(marcxml)), spool=True, keep_marcxml=False)
+        self.assertEqual(2, len(server.search(p='higgs')))
+        self.assertEqual(0, len(server._spools))
+
+    def test_resume(self):
+        """Spool - processing is resumed from a record offset"""
+        marcxml = make_marcxml(range(1, 20), total=19)
+        server = InvenioConnector(CFG_SITE_URL, session=FakeSession(
+            FakeResponse(marcxml)))
+        server.spool_search(self.path, p='higgs').close()
+
+        for processes in (None, 2):
+            server = InvenioConnector(CFG_SITE_URL, session=FakeSession(),
+                                      parse_processes=processes)
+            with Spool(self.path) as spool:
+                records = server.parse_marcxml(spool, chunk_size=100)
+                self.assertEqual(19, len(records))
+                start, end = records[9].marcxml_span
+                self.assertEqual(marcxml[start:end].decode('utf-8'),
+                                 records[9].export())
+                server.clear_cache()
+                resumed = server.parse_marcxml(spool, chunk_size=100,
+                                               start=end)
+                self.assertEqual(records[10:], resumed)
+                self.assertEqual(records[-1].marcxml_span,
+                                 resumed[-1].marcxml_span)
+            server.close()
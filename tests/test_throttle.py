@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio-Client.
+# Copyright (C) 2014 CERN.
+#
+# Invenio-Client is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio-Client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this licence, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Test the client-side throttling of the requests."""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from unittest import TestCase
+
+from requests.exceptions import ConnectionError
+
+from invenio_client import InvenioConnector
+from invenio_client.throttle import RateLimiter, get_rate_limiter
+
+from test_connector import CFG_SITE_URL, MARCXML, FakeResponse, FakeSession
+
+
+def timed(limiter, count, response=None):
+    """Send ``count`` requests through limiter and return the time taken."""
+    started = time.time()
+    for dummy in range(count):
+        limiter.call(lambda: response or FakeResponse())
+    return time.time() - started
+
+
+class TestRateLimiter(TestCase):
+
+    """Test the rate limiter and concurrency governor."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_rate(self):
+        """RateLimiter - requests are spaced out after a burst"""
+        self.assertTrue(timed(RateLimiter(rate=20, burst=1), 5) >= 0.15)
+        self.assertTrue(timed(RateLimiter(rate=1, burst=3), 3) < 0.5)
+        self.assertTrue(timed(RateLimiter(), 100) < 0.5)
+        limiter = RateLimiter(rate=20, burst=1)
+        timed(limiter, 3)
+        stats = limiter.stats()
+        self.assertEqual(3, stats['requests'])
+        self.assertTrue(stats['waited'] >= 0.05)
+
+    def test_max_in_flight(self):
+        """RateLimiter - concurrent requests are limited"""
+        limiter = RateLimiter(max_in_flight=2)
+        in_flight = []
+        observed = []
+
+        def send():
+            in_flight.append(None)
+            observed.append(len(in_flight))
+            time.sleep(0.02)
+            in_flight.pop()
+            return FakeResponse()
+
+        threads = [threading.Thread(target=limiter.call, args=(send, ))
+                   for dummy in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(6, len(observed))
+        self.assertEqual(2, max(observed))
+        self.assertEqual(0, limiter.stats()['in_flight'])
+
+    def test_streamed_body(self):
+        """RateLimiter - streamed responses hold their slot until read"""
+        limiter = RateLimiter(max_in_flight=1)
+
+        def streamed():
+            response = FakeResponse(b'body')
+            response._content_consumed = False
+            return response
+
+        response = limiter.call(streamed)
+        self.assertEqual(1, limiter.stats()['in_flight'])
+        thread = threading.Thread(target=limiter.call, args=(FakeResponse, ))
+        thread.start()
+        thread.join(0.05)
+        self.assertTrue(thread.is_alive())
+        self.assertEqual(b'body', response.raw.read())
+        self.assertEqual(b'', response.raw.read())
+        thread.join()
+        self.assertEqual(0, limiter.stats()['in_flight'])
+        limiter.call(streamed).close()
+        self.assertEqual(0, limiter.stats()['in_flight'])
+        response = limiter.call(streamed)
+        del response
+        self.assertEqual(0, limiter.stats()['in_flight'])
+
+    def test_lock_file(self):
+        """RateLimiter - processes share the rate through a lock file"""
+        path = os.path.join(self.tmpdir, 'rate')
+        first = RateLimiter(rate=20, burst=1, lock_path=path)
+        second = RateLimiter(rate=20, burst=1, lock_path=path)
+        started = time.time()
+        for dummy in range(2):
+            timed(first, 1)
+            timed(second, 1)
+        self.assertTrue(time.time() - started >= 0.15)
+        self.assertTrue(os.path.exists(path))
+
+    def test_adaptive(self):
+        """RateLimiter - the rate adapts to errors and latency"""
+        self.assertRaises(ValueError, RateLimiter, adaptive=True)
+        limiter = RateLimiter(rate=100, adaptive=True)
+        timed(limiter, 1, FakeResponse(status_code=503))
+        self.assertEqual(50, limiter.stats()['rate'])
+
+        def fail():
+            raise ConnectionError("reset")
+
+        time.sleep(0.03)
+        self.assertRaises(ConnectionError, limiter.call, fail)
+        self.assertEqual(25, limiter.stats()['rate'])
+        timed(limiter, 2)
+        self.assertEqual(35, limiter.stats()['rate'])
+        self.assertEqual(2, limiter.stats()['errors'])
+
+        limiter = RateLimiter(rate=100, adaptive=True, latency_target=0)
+        limiter.call(lambda: time.sleep(0.01) or FakeResponse())
+        self.assertEqual(50, limiter.stats()['rate'])
+
+    def test_connector(self):
+        """InvenioConnector - requests go through the rate limiter"""
+        limiter = get_rate_limiter('http://throttled.example.org/', rate=100)
+        self.assertTrue(limiter is get_rate_limiter(
+            'https://THROTTLED.example.org/search', rate=1))
+        server = InvenioConnector(CFG_SITE_URL, rate_limiter=limiter,
+                                  session=FakeSession(FakeResponse(MARCXML)))
+        self.assertEqual(2, len(server.search(p='higgs')))
+        self.assertEqual(2, limiter.stats()['requests'])